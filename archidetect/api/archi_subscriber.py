@@ -3,197 +3,203 @@
 import os
 import json
 import logging
-from google.cloud import pubsub_v1
-from google.api_core import exceptions
-import re
 
 # Import the analysis function from our archi_detector module
 from archi_detector import process_architecture_analysis_request
+from utils.agent_messages import decode_message, message_type_of, result_attributes, lane_name, lane_of, InvalidMessageError, PRIORITY_LANES, ARCHIDETECT_REQUEST
+from utils.subscriber_flow import SubscriberMetrics, subscribe_lanes
+from utils.worker_supervisor import SUBSCRIBER_PROCESSES, WorkerSupervisor, run_until_stopped
+from utils.idempotency import IDEMPOTENCY_STORE, ACQUIRED, COMPLETED
+from utils.failure_handling import FAILURE_TRACKER, DEAD_LETTER_TOPIC_ID, DEAD_LETTER_SUBSCRIPTION_ID, JobFailedError, TRANSIENT, handle_failure
+from utils.claim_check import encode_result
+from utils.transport import get_transport
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# One set of metrics per priority lane (queue depth and wait time)
+SUBSCRIBER_METRICS = {lane: SubscriberMetrics(f"archidetect-{lane}") for lane in PRIORITY_LANES}
+
 # --- Pub/Sub Configuration ---
-PROJECT_ID = os.getenv('PUBSUB_PROJECT_ID', 'my-local-emulator-project')
 ARCHI_TOPIC_ID = "strange-archidetect-sub"
 ARCHI_SUBSCRIPTION_ID = os.getenv('ARCHI_SUBSCRIPTION_ID', 'strange-archidetect-sub-subscription')
+# Server-side filter on the message attributes, legacy messages without attributes still pass
+SUBSCRIPTION_FILTER = f'attributes.message_type = "{ARCHIDETECT_REQUEST}" OR NOT attributes:message_type'
 
 # Define a topic for sending results back to the main application
 RESULTS_TOPIC_ID = os.getenv('RESULTS_TOPIC_ID', 'archi-analysis-results') 
+# Pub/Sub, or Redis Streams with MESSAGE_TRANSPORT=redis
+transport = get_transport()
 
-# Configure Pub/Sub emulator if running locally
-if os.getenv('PUBSUB_EMULATOR_HOST'):
-    logger.info(f"Using Pub/Sub emulator at {os.getenv('PUBSUB_EMULATOR_HOST')}")
-else:
-    logger.info("Using production Pub/Sub.")
+# Interactive requests use the original topic and subscription, each other lane adds its name
+dead_letter_topic_path = transport.topic_path(DEAD_LETTER_TOPIC_ID)
+archi_subscription_paths = {lane: transport.subscription_path(lane_name(ARCHI_SUBSCRIPTION_ID, lane)) for lane in PRIORITY_LANES}
+results_topic_path = transport.topic_path(RESULTS_TOPIC_ID)
 
-publisher = pubsub_v1.PublisherClient()
-subscriber = pubsub_v1.SubscriberClient()
+# --- Result publishing ---
+def publish_result(analysis_result, idempotency_key, request):
+    """Publishes an analysis result and records it as published once Pub/Sub accepts it."""
+    try:
+        # Ensure the results topic exists before publishing
+        if transport.ensure_topic(RESULTS_TOPIC_ID):
+            # Large results go to the blob store and only a reference envelope is published
+            result_data, attributes = encode_result(analysis_result)
+            # Publish asynchronously
+            future = transport.publish(results_topic_path, result_data, **result_attributes(request), **attributes)
+
+            def on_published(f):
+                try:
+                    logger.info(f"Published analysis result message ID: {f.result()} to {results_topic_path}")
+                    IDEMPOTENCY_STORE.mark_published(idempotency_key, request.correlation_id)
+                except Exception as e:
+                    logger.error(f"Failed to publish analysis result message: {e}")
 
-archi_topic_path = publisher.topic_path(PROJECT_ID, ARCHI_TOPIC_ID)
-archi_subscription_path = subscriber.subscription_path(PROJECT_ID, ARCHI_SUBSCRIPTION_ID)
-results_topic_path = publisher.topic_path(PROJECT_ID, RESULTS_TOPIC_ID)
+            # Add a callback to log the publish result
+            future.add_done_callback(on_published)
+            logger.info("Analysis result message publish initiated.")
+        else:
+            logger.error("Failed to create results topic. Analysis result not published.")
 
-# --- Function to create topic if it doesn't exist ---
-def create_topic_if_not_exists(client, topic_id):
-    """Creates a Pub/Sub topic if it doesn't already exist."""
-    topic_path = publisher.topic_path(PROJECT_ID, topic_id)
-    logger.info(f"Checking for topic existence: {topic_path}")
-    try:
-        publisher.get_topic(request={"topic": topic_path})
-        logger.info(f"Topic {topic_path} already exists.")
-        return True
-    except exceptions.NotFound:
-        logger.info(f"Topic {topic_path} not found. Creating...")
-        try:
-            publisher.create_topic(request={"name": topic_path})
-            logger.info(f"Topic {topic_path} created.")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to create topic {topic_path}: {e}")
-            return False
     except Exception as e:
-        logger.error(f"Error checking for topic {topic_path}: {e}")
-        return False
+        logger.error(f"Failed to publish analysis result message: {e}")
+
+
+def handle_duplicate(message, idempotency_key, state, record, request):
+    """Answers a redelivered or repeated request from the stored result instead of recomputing it."""
+    if state != COMPLETED:
+        logger.info(f"Request {idempotency_key[:12]} is already being analyzed, waiting for it.")
+        record = IDEMPOTENCY_STORE.wait(idempotency_key)
+    stored_result = IDEMPOTENCY_STORE.get_result(record) if record and record["state"] == COMPLETED else None
+    if isinstance(stored_result, dict) and "error" in stored_result:
+        # Stored as completed before failed analyses were retried; run the analysis again instead
+        logger.info(f"Discarding the stored error of request {idempotency_key[:12]}.")
+        IDEMPOTENCY_STORE.discard(idempotency_key)
+        stored_result = None
+    if stored_result is None:
+        # Still running, failed or expired: hand the message back so a later delivery handles it
+        logger.info(f"No stored result for request {idempotency_key[:12]}. Message not acknowledged, Pub/Sub will retry.")
+        message.nack()
+        return
+    # A repeated request from another orchestration gets the result under its own correlation ID
+    if IDEMPOTENCY_STORE.needs_publish(record, request.correlation_id):
+        logger.info(f"Republishing the stored result of request {idempotency_key[:12]}.")
+        publish_result(stored_result, idempotency_key, request)
+    message.ack()
+    logger.info(f"Duplicate message {message.message_id} answered from the stored result and acknowledged.")
+
+
+def handle_job_failure(message, error):
+    """Retries the message later or moves it to the dead-letter topic, depending on the failure."""
+    outcome = handle_failure(message, error, transport, dead_letter_topic_path, "archidetect",
+                             archi_subscription_paths[lane_of(message.attributes)])
+    logger.info(f"Message {message.message_id}: {outcome}.")
 
-# --- Function to create subscription if it doesn't exist ---
-def create_subscription_if_not_exists(subscriber_client, topic_path, subscription_path):
-    """Creates a Pub/Sub subscription if it doesn't already exist."""
-    logger.info(f"Checking for subscription existence: {subscription_path}")
-    try:
-        subscriber_client.get_subscription(request={"subscription": subscription_path})
-        logger.info(f"Subscription {subscription_path} already exists.")
-        return True
-    except exceptions.NotFound:
-        logger.info(f"Subscription {subscription_path} not found. Creating...")
-        try:
-            subscriber_client.create_subscription(
-                request={"name": subscription_path, "topic": topic_path}
-            )
-            logger.info(f"Subscription {subscription_path} created.")
-            return True
-        except exceptions.Conflict:
-            logger.warning(f"Subscription {subscription_path} already exists (Conflict during creation).")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to create subscription {subscription_path}: {e}")
-            return False
-    except Exception as e:
-        logger.error(f"Error checking for subscription {subscription_path}: {e}")
-        return False
 
 # --- Callback function for processing messages ---
 def process_message(message):
     """Processes an incoming Pub/Sub message."""
-    logger.info(f"Received raw message: {message.data}")
-
-    try:
-        # The message data is a JSON string from the orchestrator
-        full_message_payload = json.loads(message.data.decode('utf-8'))
-        agent_instruction = full_message_payload.get('agent_instruction')
-
-        if not agent_instruction:
-            logger.warning("Received message with no 'agent_instruction'. Acknowledging.")
-            message.ack()
-            return
-
-        logger.info(f"Processing instruction: {agent_instruction}")
-
-        # --- Extract information using regex patterns based on observed format ---
-        repo_url_match = re.search(r'https?://github\.com/[\w-]+/[\w.-]+', agent_instruction)
-        analysis_type_match = re.search(r'analyze the ([\w]+) of this repo', agent_instruction)
-        token_match = re.search(r', "([\w-]+)"', agent_instruction)
-
-        repo_url = repo_url_match.group(0) if repo_url_match else None
-        if repo_url and repo_url.endswith('.'):
-            repo_url = repo_url[:-1]
+    # Dispatch on the attributes first, the body is only decoded for our own message type
+    message_type = message_type_of(message.attributes)
+    if message_type and message_type != ARCHIDETECT_REQUEST:
+        logger.warning(f"Ignoring {message_type} message {message.message_id}. Acknowledging.")
+        message.ack()
+        return
 
-        # Default analysis type is full if not specified
-        analysis_type = "full"
-        if analysis_type_match:
-            raw_type = analysis_type_match.group(1).lower()
-            analysis_type = raw_type
+    logger.info(f"Received message {message.message_id} ({message_type or 'legacy'}, {len(message.data)} bytes)")
 
-        auth_token = token_match.group(1) if token_match else None
+    try:
+        request = decode_message(message.data, message.attributes, legacy_type=ARCHIDETECT_REQUEST)
+    except InvalidMessageError as e:
+        logger.error(f"Invalid message: {e}. Moving it to the dead-letter topic.")
+        logger.error(f"Raw message data: {message.data}")
+        handle_job_failure(message, e)
+        return
 
-        if not repo_url:
-            logger.error(f"Could not extract repository URL from instruction. Acknowledging and skipping.")
-            logger.error(f"Instruction: {agent_instruction}")
-            logger.error(f"Extracted values: repo_url={repo_url}, analysis_type={analysis_type}, auth_token={'[REDACTED]' if auth_token else 'None'}")
-            message.ack()
-            return
+    idempotency_key, state, record = IDEMPOTENCY_STORE.begin(message.message_id, request)
+    if state != ACQUIRED:
+        handle_duplicate(message, idempotency_key, state, record, request)
+        return
 
-        logger.info(f"Successfully extracted: repo_url={repo_url}, analysis_type={analysis_type}, auth_token={'[REDACTED]' if auth_token else 'None'}")
+    try:
+        logger.info(f"Successfully extracted: repo_url={request.repo_url}, analysis_type={request.analysis_type}, auth_token={'[REDACTED]' if request.token else 'None'}, correlation_id={request.correlation_id}")
 
         # --- Prepare data for the analysis function ---
         analysis_data = {
-            'repo_url': repo_url,
-            'analysis_type': analysis_type,
-            'auth_token': auth_token
+            'repo_url': request.repo_url,
+            'analysis_type': request.analysis_type,
+            'auth_token': request.token
         }
 
         # --- Call the core analysis function with extracted parameters ---
         analysis_result = process_architecture_analysis_request(analysis_data)
 
         # --- Handle the result ---
+        # The analysis reports failures (GitHub, Gemini, invalid requests) as a dict with an "error" key
+        if isinstance(analysis_result, dict) and "error" in analysis_result:
+            raise JobFailedError(
+                f"Architecture analysis failed: {analysis_result['error']}",
+                analysis_result.get("error_classification", TRANSIENT),
+            )
         if analysis_result:
             logger.info("Analysis completed successfully.")
             logger.info(f"Analysis Result:\n{json.dumps(analysis_result, indent=2)}")
 
-            # --- Publish the analysis result to the results topic ---
-            try:
-                # Ensure the results topic exists before publishing
-                if create_topic_if_not_exists(publisher, RESULTS_TOPIC_ID):
-                    result_data = json.dumps(analysis_result).encode('utf-8')
-                    # Publish asynchronously
-                    future = publisher.publish(results_topic_path, result_data)
-                    # Add a callback to log the publish result
-                    future.add_done_callback(lambda f: logger.info(f"Published analysis result message ID: {f.result()} to {results_topic_path}"))
-                    logger.info("Analysis result message publish initiated.")
-                else:
-                    logger.error("Failed to create results topic. Analysis result not published.")
-
-            except Exception as e:
-                logger.error(f"Failed to publish analysis result message: {e}")
+            # --- Store and publish the analysis result ---
+            IDEMPOTENCY_STORE.complete(idempotency_key, analysis_result)
+            publish_result(analysis_result, idempotency_key, request)
 
             # Acknowledge the incoming message after processing and initiating result publishing
             message.ack()
+            FAILURE_TRACKER.clear(message.message_id)
             logger.info(f"Message {message.message_id} acknowledged.")
         else:
-            logger.error("Analysis failed. Message not acknowledged, Pub/Sub will retry.")
+            IDEMPOTENCY_STORE.fail(idempotency_key)
+            logger.error("Analysis failed.")
+            handle_job_failure(message, JobFailedError("Architecture analysis returned no result"))
 
-    except json.JSONDecodeError:
-        logger.error("Failed to decode message data as JSON. Acknowledging and skipping.")
-        logger.error(f"Raw message data: {message.data}")
-        message.ack()
     except Exception as e:
-        logger.error(f"Error processing message: {e}. Message not acknowledged, Pub/Sub will retry.")
-        if 'agent_instruction' in locals():
-            logger.error(f"Instruction that caused error: {agent_instruction}")
+        IDEMPOTENCY_STORE.fail(idempotency_key)
+        logger.error(f"Error processing message: {e}")
+        logger.error(f"Request that caused error: {request}")
+        handle_job_failure(message, e)
 
 # --- Main subscriber loop ---
+def prepare_topics():
+    """Creates the topics and subscriptions the subscriber uses. Returns False if one is missing."""
+    for lane in PRIORITY_LANES:
+        # Ensure the archi topic of the lane exists first (where we receive messages from)
+        if not transport.ensure_topic(lane_name(ARCHI_TOPIC_ID, lane)):
+            logger.error(f"Failed to create or verify archi {lane} topic. Subscriber will not start.")
+            return False
+        # Then ensure its subscription exists
+        if not transport.ensure_subscription(lane_name(ARCHI_TOPIC_ID, lane), lane_name(ARCHI_SUBSCRIPTION_ID, lane), SUBSCRIPTION_FILTER):
+            logger.error(f"Failed to create or verify archi {lane} subscription. Subscriber will not start.")
+            return False
+    # Ensure the results topic exists (where we publish results to)
+    if not (transport.ensure_topic(RESULTS_TOPIC_ID)
+            and transport.ensure_topic(DEAD_LETTER_TOPIC_ID)
+            and transport.ensure_subscription(DEAD_LETTER_TOPIC_ID, DEAD_LETTER_SUBSCRIPTION_ID)):
+        logger.error("Failed to create or verify results or dead-letter topic. Subscriber will not start.")
+        return False
+    return True
+
+
+def run_worker():
+    """Pulls from the archi lane subscriptions until SIGTERM or SIGINT. Also the target of each worker process."""
+    logger.info(f"Starting listeners for subscriptions: {', '.join(archi_subscription_paths.values())} (pid {os.getpid()})")
+    try:
+        streaming_pull_futures = subscribe_lanes(transport, archi_subscription_paths, process_message, SUBSCRIBER_METRICS, name="archidetect")
+        run_until_stopped(list(streaming_pull_futures.values()), list(SUBSCRIBER_METRICS.values()))
+    except Exception as e:
+        logger.error(f"An error occurred in the main subscriber loop: {e}")
+        raise
+
+
 if __name__ == "__main__":
-    # Ensure the archi topic exists first (where we receive messages from)
-    if create_topic_if_not_exists(publisher, ARCHI_TOPIC_ID): # Use publisher client for topic creation
-        # Then ensure the archi subscription exists
-        if create_subscription_if_not_exists(subscriber, archi_topic_path, archi_subscription_path):
-            # Ensure the results topic exists (where we publish results to)
-            if create_topic_if_not_exists(publisher, RESULTS_TOPIC_ID): # Use publisher client for topic creation
-                try:
-                    logger.info(f"Starting Pub/Sub listener for subscription: {archi_subscription_path}")
-                    streaming_pull_future = subscriber.subscribe(archi_subscription_path, callback=process_message)
-                    streaming_pull_future.result()
-
-                except KeyboardInterrupt:
-                    logger.info("Keyboard interrupt received. Shutting down subscriber.")
-                    streaming_pull_future.cancel()
-                    streaming_pull_future.result()
-                except Exception as e:
-                    logger.error(f"An error occurred in the main subscriber loop: {e}")
-            else:
-                 logger.error("Failed to create or verify results topic. Subscriber will not start.")
+    if prepare_topics():
+        if SUBSCRIBER_PROCESSES > 1:
+            # One process per core: the workers share the subscription, each with its own flow control
+            WorkerSupervisor("archidetect", run_worker).run()
         else:
-            logger.error("Failed to create or verify archi subscription. Subscriber will not start.")
-    else:
-        logger.error("Failed to create or verify archi topic. Subscriber will not start.")
\ No newline at end of file
+            run_worker()
@@ -0,0 +1,141 @@
+"""
+Local registry of the JSON schemas returned by the archidetect analyses.
+
+The `repositoryAnalysis`/`meta` structure is declared once here and sent to Gemini as a
+response schema (structured output), instead of pasting a commented JSON template into
+every prompt. The same declaration is used to validate the parsed answer.
+"""
+
+EVIDENCE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "type": {"type": "string", "description": 'Kind of evidence ("file", "commit", "branch", etc.)'},
+        "path": {"type": "string", "description": "File path or branch name"},
+        "reason": {"type": "string", "description": "Why this is evidence"},
+    },
+    "required": ["type", "path", "reason"],
+}
+
+DESIGN_PATTERN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "patternName": {"type": "string"},
+        "confidence": {"type": "number", "description": "0.0 to 1.0"},
+        "evidence": {"type": "array", "items": EVIDENCE_SCHEMA},
+    },
+    "required": ["patternName", "confidence", "evidence"],
+}
+
+UNUSUAL_PATTERN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "description": {"type": "string"},
+        "confidence": {"type": "number", "description": "0.0 to 1.0"},
+        "evidence": {"type": "array", "items": EVIDENCE_SCHEMA},
+    },
+    "required": ["description", "confidence", "evidence"],
+}
+
+# Per analysis type: the revision field of repositoryAnalysis and the counters in meta
+SCHEMA_VARIANTS = {
+    "commits": {"revision_field": "lastCommitHash", "meta_fields": ["analyzedCommits", "analyzedBranches"]},
+    "issues": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+    "user_stories": {"revision_field": None, "meta_fields": ["analyzedUserStories"]},
+    "contributors": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+    "commit_sizes": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+    "architecture_trends": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+    "commit_activity": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+    "full": {"revision_field": "lastIssueHash", "meta_fields": ["analyzedIssues"]},
+}
+
+JSON_TYPES = {"string": str, "integer": int, "number": float, "array": list, "object": dict}
+
+
+def build_schema(revision_field, meta_fields):
+    """
+    Build the response schema for one analysis variant.
+
+    Args:
+        revision_field (str): Name of the last commit/issue field, or None.
+        meta_fields (list): Names of the integer counters reported in meta.
+
+    Returns:
+        dict: OpenAPI-style schema accepted by Gemini's response_schema.
+    """
+    analysis_properties = {
+        "repoName": {"type": "string"},
+        "analysisDate": {"type": "string", "description": "ISO date"},
+        "predictedDesignPatterns": {"type": "array", "items": DESIGN_PATTERN_SCHEMA},
+        "unusualPatterns": {"type": "array", "items": UNUSUAL_PATTERN_SCHEMA},
+    }
+    if revision_field:
+        analysis_properties[revision_field] = {"type": "string"}
+
+    meta_properties = {field: {"type": "integer"} for field in meta_fields}
+    meta_properties["linesOfCode"] = {"type": "integer"}
+    meta_properties["toolVersion"] = {"type": "string"}
+
+    return {
+        "type": "object",
+        "properties": {
+            "repositoryAnalysis": {
+                "type": "object",
+                "properties": analysis_properties,
+                "required": list(analysis_properties),
+            },
+            "meta": {
+                "type": "object",
+                "properties": meta_properties,
+                "required": list(meta_properties),
+            },
+        },
+        "required": ["repositoryAnalysis", "meta"],
+    }
+
+
+def required_fields_for(schema, prefix=""):
+    """
+    Flatten the required object fields of a schema into dotted paths for validation.
+
+    Args:
+        schema (dict): Schema built by build_schema.
+        prefix (str): Dotted path of the schema being flattened.
+
+    Returns:
+        dict: Dotted path -> expected Python type.
+    """
+    fields = {}
+    for name in schema.get("required", []):
+        prop = schema["properties"][name]
+        path = f"{prefix}{name}"
+        fields[path] = JSON_TYPES[prop["type"]]
+        if prop["type"] == "object":
+            fields.update(required_fields_for(prop, f"{path}."))
+    return fields
+
+
+ANALYSIS_SCHEMAS = {
+    analysis_type: build_schema(variant["revision_field"], variant["meta_fields"])
+    for analysis_type, variant in SCHEMA_VARIANTS.items()
+}
+
+REQUIRED_FIELDS = {
+    analysis_type: required_fields_for(schema)
+    for analysis_type, schema in ANALYSIS_SCHEMAS.items()
+}
+
+
+def get_generation_config(analysis_type):
+    """
+    Generation config that makes Gemini answer with JSON matching the analysis schema.
+
+    Args:
+        analysis_type (str): Key of ANALYSIS_SCHEMAS.
+
+    Returns:
+        dict: generation_config for generate_content.
+    """
+    return {
+        "response_mime_type": "application/json",
+        "response_schema": ANALYSIS_SCHEMAS[analysis_type],
+    }
@@ -0,0 +1,212 @@
+# failure_handling.py
+#
+# Retry and dead-letter policy of the agent subscribers.
+#
+# Shared with the other services: edit mock_aplens/server/api/failure_handling.py and copy it to
+# archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# A failed job is classified as transient (rate limits, timeouts, server errors, network) or
+# permanent (bad input, missing repository). Transient failures are retried with exponential
+# backoff: the message's ack deadline is set to the backoff delay and it is released from lease
+# management, so Pub/Sub redelivers it only once the delay has passed. Permanent failures, and
+# transient ones that reached JOB_MAX_ATTEMPTS, are published to the dead-letter topic together
+# with their failure history, then acked. strange's `dead_letters` command inspects and replays them.
+
+import os
+import json
+import base64
+import random
+import socket
+import logging
+from datetime import datetime
+
+try:
+    from .github_cache import LocalRedis
+except ImportError:  # Imported as a top-level module by the subscriber scripts
+    from github_cache import LocalRedis
+
+logger = logging.getLogger(__name__)
+
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', '5'))
+JOB_RETRY_BACKOFF_BASE = float(os.getenv('JOB_RETRY_BACKOFF_BASE', '30'))
+# Pub/Sub ack deadlines cannot exceed 600 seconds
+JOB_RETRY_BACKOFF_MAX = min(float(os.getenv('JOB_RETRY_BACKOFF_MAX', '600')), 600.0)
+DEAD_LETTER_TOPIC_ID = os.getenv('DEAD_LETTER_TOPIC_ID', 'agent-dead-letters')
+# Created with the topic so dead letters are retained until inspected with strange's `dead_letters` command
+DEAD_LETTER_SUBSCRIPTION_ID = os.getenv('DEAD_LETTER_SUBSCRIPTION_ID', 'agent-dead-letters-admin')
+FAILURES_REDIS_URL = os.getenv('FAILURES_REDIS_URL', os.getenv('REDIS_URL'))
+# Failure histories are kept a bit longer than a full retry cycle
+FAILURES_TTL = int(os.getenv('FAILURES_TTL', str(24 * 3600)))
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+
+# HTTP statuses worth retrying. GitHub answers 403 when the rate limit is exhausted.
+TRANSIENT_STATUS_CODES = {403, 408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class JobFailedError(Exception):
+    """A job failure with an explicit classification."""
+
+    def __init__(self, message, classification=TRANSIENT):
+        super().__init__(message)
+        self.classification = classification
+
+
+def _status_of(error):
+    for candidate in (error, getattr(error, "response", None)):
+        for attribute in ("status_code", "status", "code"):
+            value = getattr(candidate, attribute, None)
+            if isinstance(value, int):
+                return value
+    return None
+
+
+def classify_failure(error):
+    """
+    Decides whether a failed job is worth retrying.
+
+    Args:
+        error (Exception): What made the job fail.
+
+    Returns:
+        str: TRANSIENT or PERMANENT.
+    """
+    if isinstance(error, JobFailedError):
+        return error.classification
+    status = _status_of(error)
+    if status is not None and 400 <= status < 600:
+        return TRANSIENT if status in TRANSIENT_STATUS_CODES else PERMANENT
+    # requests, socket and urllib3 errors are OSError subclasses
+    if isinstance(error, (TimeoutError, ConnectionError, OSError)):
+        return TRANSIENT
+    if isinstance(error, (ValueError, TypeError, KeyError, LookupError)):
+        return PERMANENT
+    return TRANSIENT
+
+
+def retry_delay(attempt, base=JOB_RETRY_BACKOFF_BASE, maximum=JOB_RETRY_BACKOFF_MAX):
+    """Exponential backoff with jitter before retry number `attempt` (1-based)."""
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class FailureTracker:
+    """Failure history of each message, shared through Redis so every worker sees the attempt count."""
+
+    def __init__(self, redis_url=None, namespace="job-failures", ttl=FAILURES_TTL, client=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LocalRedis()
+        self.client = client
+        if client is None and redis_url:
+            try:
+                import redis
+
+                self.client = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("redis package not installed, retry attempts are counted per process")
+
+    def _call(self, method, *args, **kwargs):
+        if self.client is not None:
+            try:
+                return getattr(self.client, method)(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Redis failure tracker unavailable ({e}), using the local store")
+        return getattr(self.local, method)(*args, **kwargs)
+
+    def _key(self, message_id):
+        return f"{self.namespace}:{message_id}"
+
+    def history(self, message_id):
+        raw = self._call("get", self._key(message_id))
+        return json.loads(raw) if raw is not None else []
+
+    def record(self, message_id, error, classification):
+        """Appends a failure and returns the full history (its length is the attempt count)."""
+        history = self.history(message_id)
+        history.append({
+            "error": str(error),
+            "error_type": type(error).__name__,
+            "classification": classification,
+            "worker": f"{socket.gethostname()}:{os.getpid()}",
+            "failed_at": datetime.utcnow().isoformat(),
+        })
+        self._call("set", self._key(message_id), json.dumps(history), ex=self.ttl)
+        return history
+
+    def clear(self, message_id):
+        self._call("delete", self._key(message_id))
+
+
+FAILURE_TRACKER = FailureTracker(FAILURES_REDIS_URL)
+
+
+def build_dead_letter(message, source, subscription_path, history):
+    """Dead-letter envelope: the original message plus its failure context."""
+    return {
+        "source": source,
+        "subscription": subscription_path,
+        "message_id": message.message_id,
+        "data": base64.b64encode(message.data).decode('ascii'),
+        "attributes": dict(message.attributes or {}),
+        "publish_time": message.publish_time.isoformat() if getattr(message, "publish_time", None) else None,
+        "attempts": len(history),
+        "classification": history[-1]["classification"] if history else None,
+        "last_error": history[-1]["error"] if history else None,
+        "failures": history,
+        "dead_lettered_at": datetime.utcnow().isoformat(),
+    }
+
+
+def handle_failure(message, error, publisher, dead_letter_topic_path, source, subscription_path,
+                   max_attempts=JOB_MAX_ATTEMPTS, tracker=FAILURE_TRACKER):
+    """
+    Schedules a delayed retry of a failed message or moves it to the dead-letter topic.
+
+    Args:
+        message: The Pub/Sub message being processed.
+        error (Exception): What made the job fail.
+        publisher (Transport): Transport (or Pub/Sub publisher client) used for the dead-letter topic.
+        dead_letter_topic_path (str): Full path of the dead-letter topic.
+        source (str): Name of the agent, stored in the dead letter.
+        subscription_path (str): Subscription the message came from, stored for replay.
+
+    Returns:
+        str: "retry" or "dead_lettered".
+    """
+    classification = classify_failure(error)
+    history = tracker.record(message.message_id, error, classification)
+    attempts = len(history)
+
+    if classification == TRANSIENT and attempts < max_attempts:
+        delay = retry_delay(attempts)
+        logger.warning(
+            f"Message {message.message_id} failed ({type(error).__name__}: {error}), "
+            f"retrying in {delay:.0f}s (attempt {attempts}/{max_attempts})"
+        )
+        # Redelivered once this deadline passes; drop() stops the client from extending it
+        message.modify_ack_deadline(int(delay))
+        message.drop()
+        return "retry"
+
+    reason = "permanent failure" if classification == PERMANENT else f"{attempts} failed attempts"
+    logger.error(f"Message {message.message_id} dead-lettered after {reason}: {error}")
+    dead_letter = build_dead_letter(message, source, subscription_path, history)
+    try:
+        publisher.publish(
+            dead_letter_topic_path,
+            json.dumps(dead_letter).encode('utf-8'),
+            source=source,
+            classification=classification,
+            repo=(message.attributes or {}).get("repo", ""),
+        ).result(timeout=30)
+    except Exception as e:
+        # Keep the message rather than lose it, it will be redelivered after the backoff
+        logger.error(f"Could not publish dead letter of {message.message_id}: {e}")
+        message.modify_ack_deadline(int(JOB_RETRY_BACKOFF_MAX))
+        message.drop()
+        return "retry"
+    message.ack()
+    tracker.clear(message.message_id)
+    return "dead_lettered"
@@ -1,51 +1,30 @@
-import requests
+from .github_cache import get_cached_commits, get_cached_json
 
 # Function to get issues
 def get_issues(repo_owner, repo_name):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/issues"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch issues: {response.status_code}")
-        return None
+    return get_cached_json(repo_owner, repo_name, "issues", url, description="issues")
 
 # Function to get pull requests
 def get_pull_requests(repo_owner, repo_name):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/pulls"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch pull requests: {response.status_code}")
-        return None
+    return get_cached_json(repo_owner, repo_name, "pulls", url, description="pull requests")
 
 # Function to get branches
 def get_branches(repo_owner, repo_name):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/branches"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch branches: {response.status_code}")
-        return None
+    return get_cached_json(repo_owner, repo_name, "branches", url, description="branches")
 
 # Function to get commits
 def get_commits(repo_owner, repo_name, branch="main"):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits?sha={branch}"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch commits: {response.status_code}")
-        return None
+    return get_cached_json(repo_owner, repo_name, "commits:first_page", url, description="commits", ref=branch)
     
 def get_user_stories(repo_owner, repo_name):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/issues"
     params = {'state': 'all'}  # Fetch both open and closed issues
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        issues = response.json()
+    issues = get_cached_json(repo_owner, repo_name, "issues:all", url, params, description="issues")
+    if issues is not None:
         user_stories = []
         for issue in issues:
             # Extract the title and body as the description
@@ -65,7 +44,6 @@ def get_user_stories(repo_owner, repo_name):
             })
         return user_stories
     else:
-        print(f"Failed to fetch issues: {response.status_code}")
         return None
 
 def extract_story_points(issue):
@@ -80,27 +58,8 @@ def extract_story_points(issue):
 
 def get_contributors_activity(repo_owner, repo_name):
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/contributors"
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.json()
-    else:
-        print(f"Failed to fetch contributors' activity: {response.status_code}")
-        return None
+    return get_cached_json(repo_owner, repo_name, "contributors", url, description="contributors' activity")
 
 def get_all_commits(repo_owner, repo_name, branch="main"):
-    url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits"
-    commits = []
-    params = {"sha": branch, "per_page": 100, "page": 1}
-
-    while True:
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            batch = response.json()
-            if not batch:
-                break
-            commits.extend(batch)
-            params["page"] += 1
-        else:
-            print(f"Failed to fetch commits: {response.status_code}")
-            break
-    return commits
+    # Read through the shared cache, which the orchestrator may already have warmed
+    return get_cached_commits(repo_owner, repo_name, branch)
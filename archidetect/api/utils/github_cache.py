@@ -0,0 +1,444 @@
+# github_cache.py
+#
+# Shared cache of GitHub data, read through by the agents and warmed speculatively by the
+# orchestrator.
+#
+# Shared with the other services: edit strange/api/github_cache.py and copy it to
+# mock_aplens/server/api and archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# Entries are keyed by (repository, ref, resource), compressed, and stored in Redis when
+# GITHUB_CACHE_REDIS_URL (or REDIS_URL) is set, so a prefetch started by strange is visible to
+# the agents. Without Redis (or while it is unreachable) LocalRedis, an in-process stand-in with
+# the same API, is used instead. Every entry has a TTL, oversized values are not cached, the
+# local store evicts least-recently-used entries by size, and all entries of a repository can be
+# invalidated at once. While one process fetches a resource it holds an in-flight marker, and
+# readers wait for that fetch instead of calling GitHub a second time.
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+GITHUB_CACHE_REDIS_URL = os.getenv('GITHUB_CACHE_REDIS_URL', os.getenv('REDIS_URL'))
+GITHUB_CACHE_TTL = int(os.getenv('GITHUB_CACHE_TTL', '3600'))
+# Compressed size limits: per entry, and in total for the in-process store
+GITHUB_CACHE_MAX_ENTRY_BYTES = int(os.getenv('GITHUB_CACHE_MAX_ENTRY_BYTES', str(8 * 1024 * 1024)))
+GITHUB_CACHE_LOCAL_MAX_BYTES = int(os.getenv('GITHUB_CACHE_LOCAL_MAX_BYTES', str(128 * 1024 * 1024)))
+# How long an in-flight marker survives a crashed fetcher, and how long readers wait on it
+GITHUB_CACHE_INFLIGHT_TTL = int(os.getenv('GITHUB_CACHE_INFLIGHT_TTL', '120'))
+GITHUB_CACHE_INFLIGHT_WAIT = float(os.getenv('GITHUB_CACHE_INFLIGHT_WAIT', '60'))
+
+MAX_ARTIFACT_FILES = 50
+ARTIFACT_SOURCE_PATHS = ["src", "src/main/java", ""]
+DEFAULT_BRANCH = "main"
+ARTIFACTS_REF = "HEAD"
+# Ref of resources that do not belong to a branch (issues, contributors, ...)
+REPO_REF = "HEAD"
+
+
+class FetchCancelled(Exception):
+    """Raised inside a fetch when its cancel event is set."""
+
+
+def _check_cancelled(cancel_event):
+    if cancel_event is not None and cancel_event.is_set():
+        raise FetchCancelled()
+
+
+def repo_id(owner, name):
+    return f"{owner}/{name}".lower()
+
+
+def artifacts_resource(token=None):
+    """Resource name of the Java artifacts. Authenticated fetches are kept apart per token."""
+    if not token:
+        return "java_artifacts"
+    return f"java_artifacts:{hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]}"
+
+
+class LocalRedis:
+    """
+    In-process stand-in for the subset of the Redis API the cache uses.
+
+    Keys expire like Redis keys. String values count towards max_bytes and the least
+    recently used ones are evicted when it is exceeded. Also used directly in tests.
+    """
+
+    def __init__(self, max_bytes=GITHUB_CACHE_LOCAL_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._data = OrderedDict()
+        self._expires = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        return len(value) if isinstance(value, (bytes, str)) else 0
+
+    def _live(self, key):
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._remove(key)
+        return key in self._data
+
+    def _remove(self, key):
+        if key in self._data:
+            self.used_bytes -= self._size(self._data.pop(key))
+        self._expires.pop(key, None)
+
+    def _store(self, key, value, ex=None):
+        self._remove(key)
+        self._data[key] = value
+        self.used_bytes += self._size(value)
+        if ex:
+            self._expires[key] = time.monotonic() + ex
+        while self.used_bytes > self.max_bytes:
+            # Only sized values are evicted, the repository indexes are tiny
+            oldest = next(k for k, v in self._data.items() if self._size(v))
+            self._remove(oldest)
+
+    def get(self, key):
+        with self._lock:
+            if not self._live(key):
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._live(key):
+                return None
+            if isinstance(value, str):
+                value = value.encode("utf-8")
+            self._store(key, value, ex)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = sum(1 for key in keys if self._live(key))
+            for key in keys:
+                self._remove(key)
+            return removed
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if not self._live(key):
+                return False
+            self._expires[key] = time.monotonic() + seconds
+            return True
+
+    def sadd(self, key, *members):
+        with self._lock:
+            current = self._data[key] if self._live(key) else set()
+            added = len(set(members) - current)
+            current.update(members)
+            self._data[key] = current
+            return added
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._data[key]) if self._live(key) else set()
+
+
+class GitHubCache:
+    """
+    TTL cache of GitHub resources with per-repository invalidation and cross-process
+    in-flight deduplication.
+
+    Values are JSON-serializable objects, stored zlib-compressed. Values larger than
+    max_entry_bytes once compressed are returned to the caller but not cached.
+    """
+
+    def __init__(self, redis_url=None, namespace="github-cache", ttl=GITHUB_CACHE_TTL,
+                 inflight_ttl=GITHUB_CACHE_INFLIGHT_TTL, inflight_wait=GITHUB_CACHE_INFLIGHT_WAIT,
+                 max_entry_bytes=GITHUB_CACHE_MAX_ENTRY_BYTES, client=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.inflight_ttl = inflight_ttl
+        self.inflight_wait = inflight_wait
+        self.max_entry_bytes = max_entry_bytes
+        self.local = LocalRedis()
+        self.client = client
+        if client is None and redis_url:
+            try:
+                import redis
+
+                self.client = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("redis package not installed, GitHub cache is per process only")
+
+    @classmethod
+    def from_env(cls):
+        return cls(GITHUB_CACHE_REDIS_URL)
+
+    def make_key(self, repo, ref, resource):
+        return f"{self.namespace}:{repo.lower()}:{ref}:{resource}"
+
+    def _index_key(self, repo):
+        return f"{self.namespace}:{repo.lower()}:keys"
+
+    def _call(self, method, *args, **kwargs):
+        """Runs a Redis command on the shared client, or on the local stand-in if it is unavailable."""
+        if self.client is not None:
+            try:
+                return getattr(self.client, method)(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Redis GitHub cache unavailable ({e}), using the local cache")
+        return getattr(self.local, method)(*args, **kwargs)
+
+    # --- Cache API ---
+
+    def get(self, repo, ref, resource):
+        """Returns the cached value, or None on a miss."""
+        raw = self._call("get", self.make_key(repo, ref, resource))
+        if raw is None:
+            return None
+        try:
+            return json.loads(zlib.decompress(raw))
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Discarding unreadable GitHub cache entry for {repo} {resource}: {e}")
+            return None
+
+    def set(self, repo, ref, resource, value, ttl=None):
+        """
+        Stores a value and records its key in the repository index.
+
+        Returns:
+            bool: False if the value was too large to cache.
+        """
+        raw = zlib.compress(json.dumps(value).encode("utf-8"))
+        if len(raw) > self.max_entry_bytes:
+            logger.info(f"Not caching {repo} {resource}: {len(raw)} bytes compressed")
+            return False
+        ttl = ttl or self.ttl
+        key = self.make_key(repo, ref, resource)
+        self._call("set", key, raw, ex=ttl)
+        index_key = self._index_key(repo)
+        self._call("sadd", index_key, key)
+        # The index outlives every entry it lists, since all share the same default TTL
+        self._call("expire", index_key, max(ttl, self.ttl))
+        return True
+
+    def invalidate_repo(self, repo):
+        """
+        Drops every cached resource of a repository, e.g. after a push.
+
+        Returns:
+            int: Number of entries removed.
+        """
+        index_key = self._index_key(repo)
+        keys = [key.decode() if isinstance(key, bytes) else key for key in self._call("smembers", index_key)]
+        removed = self._call("delete", *keys) if keys else 0
+        self._call("delete", index_key)
+        logger.info(f"Invalidated {removed} GitHub cache entries of {repo}")
+        return removed
+
+    def claim(self, repo, ref, resource):
+        """Sets the in-flight marker. Returns False if another process is already fetching."""
+        return bool(self._call("set", self.make_key(repo, ref, resource) + ":inflight", "1", ex=self.inflight_ttl, nx=True))
+
+    def release(self, repo, ref, resource):
+        self._call("delete", self.make_key(repo, ref, resource) + ":inflight")
+
+    def is_inflight(self, repo, ref, resource):
+        return self._call("get", self.make_key(repo, ref, resource) + ":inflight") is not None
+
+    def get_or_fetch(self, repo, ref, resource, fetch):
+        """
+        Reads a resource through the cache.
+
+        On a miss, waits for a fetch already in flight elsewhere (up to inflight_wait seconds),
+        then fetches it itself while holding the in-flight marker.
+
+        Args:
+            repo (str): "owner/name".
+            ref (str): Branch or ref the resource belongs to.
+            resource (str): Resource name, e.g. "commits".
+            fetch (callable): Returns (value, cacheable). Incomplete results are returned
+                but not cached.
+
+        Returns:
+            The cached or freshly fetched value.
+        """
+        value = self.get(repo, ref, resource)
+        if value is not None:
+            return value
+
+        waited_until = time.monotonic() + self.inflight_wait
+        claimed = self.claim(repo, ref, resource)
+        while not claimed:
+            if time.monotonic() >= waited_until:
+                logger.warning(f"Gave up waiting for the in-flight fetch of {repo} {resource}")
+                break
+            time.sleep(0.25)
+            value = self.get(repo, ref, resource)
+            if value is not None:
+                return value
+            claimed = self.claim(repo, ref, resource)
+
+        try:
+            value, cacheable = fetch()
+            if cacheable:
+                self.set(repo, ref, resource, value)
+            return value
+        finally:
+            if claimed:
+                self.release(repo, ref, resource)
+
+
+_github_cache = None
+_github_cache_lock = threading.Lock()
+
+
+def get_github_cache():
+    """Returns the process-wide GitHub cache configured from the environment."""
+    global _github_cache
+    with _github_cache_lock:
+        if _github_cache is None:
+            _github_cache = GitHubCache.from_env()
+    return _github_cache
+
+
+# --- Fetchers shared by the agents and the orchestrator prefetch ---
+
+def fetch_github_artifacts(repo_url, token=None, cancel_event=None):
+    """
+    Fetches up to MAX_ARTIFACT_FILES Java files of a repository.
+
+    Returns:
+        tuple: (list of {'name', 'path', 'content'}, whether the result can be cached).
+    """
+    from github import Github, Auth
+
+    _, _, _, owner, repo = repo_url.rstrip('/').split('/')
+    g = Github(auth=Auth.Token(token)) if token else Github()
+    try:
+        repo = g.get_repo(f"{owner}/{repo}")
+    except Exception as e:
+        logger.error(f"Error getting repository: {e}")
+        return [], False
+    artifacts = []
+    def process_contents(contents, path="", current_count=0):
+        for content in contents:
+            _check_cancelled(cancel_event)
+            if current_count >= MAX_ARTIFACT_FILES:
+                return current_count
+            if content.type == 'file':
+                if content.name.endswith('.java'):
+                    try:
+                        file_content = content.decoded_content.decode('utf-8')
+                        artifacts.append({
+                            'name': content.name,
+                            'path': content.path,
+                            'content': file_content
+                        })
+                        current_count += 1
+                    except Exception as e:
+                        logger.warning(f"Error decoding {content.path}: {e}")
+            elif content.type == 'dir':
+                # Removed exclusions to catch all dirs
+                current_count = process_contents(repo.get_contents(content.path), content.path, current_count)
+            if current_count >= MAX_ARTIFACT_FILES:
+                return current_count
+        return current_count
+    # Try multiple source paths
+    # A missing path (404) is expected; any other error (e.g. a 403 rate limit) makes the result incomplete
+    complete = True
+    for source_path in ARTIFACT_SOURCE_PATHS:
+        try:
+            if source_path:
+                contents = repo.get_contents(source_path)
+            else:
+                contents = repo.get_contents("")  # Root
+            process_contents(contents, source_path)
+            if artifacts:  # Stop if we found files
+                break
+        except FetchCancelled:
+            raise
+        except Exception as e:
+            if getattr(e, "status", None) != 404:
+                complete = False
+                logger.warning(f"Could not fetch {source_path or 'the root'} of {repo_url}: {e}")
+            else:
+                logger.info(f"No files in {source_path}: {e}")
+    logger.info(f"Total files fetched: {len(artifacts)}")
+    return artifacts, complete
+
+
+def fetch_all_commits(repo_owner, repo_name, branch=DEFAULT_BRANCH, cancel_event=None):
+    """
+    Fetches every commit of a branch, 100 per page.
+
+    Returns:
+        tuple: (list of commits, whether every page was fetched).
+    """
+    import requests
+
+    url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits"
+    commits = []
+    params = {"sha": branch, "per_page": 100, "page": 1}
+
+    while True:
+        _check_cancelled(cancel_event)
+        response = requests.get(url, params=params)
+        if response.status_code == 200:
+            batch = response.json()
+            if not batch:
+                return commits, True
+            commits.extend(batch)
+            params["page"] += 1
+        else:
+            logger.warning(f"Failed to fetch commits: {response.status_code}")
+            return commits, False
+
+
+def fetch_json(url, params=None, description="data"):
+    """
+    GETs a GitHub REST endpoint.
+
+    Returns:
+        tuple: (decoded JSON or None, whether the request succeeded).
+    """
+    import requests
+
+    response = requests.get(url, params=params)
+    if response.status_code == 200:
+        return response.json(), True
+    logger.warning(f"Failed to fetch {description}: {response.status_code}")
+    return None, False
+
+
+def get_cached_json(repo_owner, repo_name, resource, url, params=None, description="data", ref=REPO_REF):
+    """A GitHub REST resource of a repository, read through the shared cache."""
+    return get_github_cache().get_or_fetch(
+        repo_id(repo_owner, repo_name), ref, resource,
+        lambda: fetch_json(url, params, description),
+    )
+
+
+def invalidate_repo(repo_owner, repo_name):
+    """Drops every cached resource of a repository."""
+    return get_github_cache().invalidate_repo(repo_id(repo_owner, repo_name))
+
+
+def get_cached_artifacts(repo_url, token=None):
+    """Java artifacts of a repository, read through the shared cache."""
+    parts = repo_url.rstrip('/').split('/')
+    return get_github_cache().get_or_fetch(
+        repo_id(parts[-2], parts[-1]), ARTIFACTS_REF, artifacts_resource(token),
+        lambda: fetch_github_artifacts(repo_url, token),
+    )
+
+
+def get_cached_commits(repo_owner, repo_name, branch=DEFAULT_BRANCH):
+    """All commits of a branch, read through the shared cache."""
+    return get_github_cache().get_or_fetch(
+        repo_id(repo_owner, repo_name), branch, "commits",
+        lambda: fetch_all_commits(repo_owner, repo_name, branch),
+    )
@@ -0,0 +1,211 @@
+# idempotency.py
+#
+# Suppresses duplicate analyses when Pub/Sub redelivers a request.
+#
+# Shared with the other services: edit mock_aplens/server/api/idempotency.py and copy it to
+# archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# Each request is identified by a hash of its content (message type, repository, pattern or
+# analysis type, token), and every delivered message ID is mapped to that hash. The first
+# delivery claims the hash as in progress; the others wait for it, then reuse its stored result
+# instead of crawling GitHub and calling Gemini again. Records live in the Redis given by
+# IDEMPOTENCY_REDIS_URL (or REDIS_URL), or in-process without it.
+
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+
+try:
+    from .github_cache import LocalRedis
+except ImportError:  # Imported as a top-level module by the subscriber scripts
+    from github_cache import LocalRedis
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_REDIS_URL = os.getenv('IDEMPOTENCY_REDIS_URL', os.getenv('REDIS_URL'))
+# An in-progress claim expires after this long, so a crashed worker does not block the request forever
+IDEMPOTENCY_INFLIGHT_TTL = int(os.getenv('IDEMPOTENCY_INFLIGHT_TTL', '3900'))
+IDEMPOTENCY_RESULT_TTL = int(os.getenv('IDEMPOTENCY_RESULT_TTL', str(24 * 3600)))
+# How long a duplicate delivery waits for the in-flight analysis before handing the message back
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '300'))
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# begin() outcomes
+ACQUIRED = "acquired"
+
+# Request fields that identify the work; timestamps and the router's context do not
+IDENTITY_FIELDS = ("message_type", "repo_url", "pattern", "analysis_type")
+
+# Atomically deletes a record if it is still in progress and claimed by the given owner, so a
+# failing worker never drops a claim another worker has taken over in the meantime.
+# KEYS: record key. ARGV: owner. Returns 1 when the record was deleted.
+RELEASE_CLAIM_LUA = """
+local raw = redis.call('GET', KEYS[1])
+if not raw then
+    return 0
+end
+local record = cjson.decode(raw)
+if record['state'] == 'in_progress' and record['owner'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def request_hash(request):
+    """Content hash of an AgentRequest."""
+    identity = {name: getattr(request, name) for name in IDENTITY_FIELDS}
+    identity["repo_url"] = (identity["repo_url"] or "").rstrip('/').lower()
+    if request.token:
+        identity["token"] = hashlib.sha256(request.token.encode('utf-8')).hexdigest()
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    In-progress/completed records of requests, keyed by content hash, with result references.
+
+    Records are JSON objects: {"state", "owner", "message_id", "started_at", and once
+    completed "completed_at", "result_ref", "published", "published_to"}. published_to lists
+    the correlation IDs the result was published for.
+    """
+
+    def __init__(self, redis_url=None, namespace="idempotency", inflight_ttl=IDEMPOTENCY_INFLIGHT_TTL,
+                 result_ttl=IDEMPOTENCY_RESULT_TTL, client=None):
+        self.namespace = namespace
+        self.inflight_ttl = inflight_ttl
+        self.result_ttl = result_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.local = LocalRedis()
+        self.client = client
+        if client is None and redis_url:
+            try:
+                import redis
+
+                self.client = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("redis package not installed, duplicate deliveries are only detected per process")
+
+    @classmethod
+    def from_env(cls):
+        return cls(IDEMPOTENCY_REDIS_URL)
+
+    def _call(self, method, *args, **kwargs):
+        if self.client is not None:
+            try:
+                return getattr(self.client, method)(*args, **kwargs)
+            except Exception as e:
+                logger.warning(f"Redis idempotency store unavailable ({e}), using the local store")
+        return getattr(self.local, method)(*args, **kwargs)
+
+    def _record_key(self, key):
+        return f"{self.namespace}:request:{key}"
+
+    def _message_key(self, message_id):
+        return f"{self.namespace}:message:{message_id}"
+
+    def result_key(self, key):
+        return f"{self.namespace}:result:{key}"
+
+    def get_record(self, key):
+        raw = self._call("get", self._record_key(key))
+        return json.loads(raw) if raw is not None else None
+
+    def _put_record(self, key, record, ttl):
+        self._call("set", self._record_key(key), json.dumps(record), ex=ttl)
+
+    def begin(self, message_id, request):
+        """
+        Claims a request for processing.
+
+        Returns:
+            tuple: (content hash, outcome, record). The outcome is ACQUIRED when this delivery
+            must run the analysis, otherwise the state of the existing record (IN_PROGRESS or
+            COMPLETED).
+        """
+        known_key = self._call("get", self._message_key(message_id))
+        key = known_key.decode() if isinstance(known_key, bytes) else known_key
+        key = key or request_hash(request)
+        self._call("set", self._message_key(message_id), key, ex=self.result_ttl)
+
+        record = {"state": IN_PROGRESS, "owner": self.owner, "message_id": message_id, "started_at": time.time()}
+        if self._call("set", self._record_key(key), json.dumps(record), ex=self.inflight_ttl, nx=True):
+            return key, ACQUIRED, record
+
+        existing = self.get_record(key)
+        if existing is None:
+            # The previous claim just expired or failed, try once more
+            if self._call("set", self._record_key(key), json.dumps(record), ex=self.inflight_ttl, nx=True):
+                return key, ACQUIRED, record
+            existing = self.get_record(key) or record
+        logger.info(f"Duplicate delivery {message_id} of request {key[:12]} ({existing['state']} by {existing.get('owner')})")
+        return key, existing["state"], existing
+
+    def wait(self, key, timeout=IDEMPOTENCY_WAIT, poll_interval=2.0):
+        """
+        Waits for an in-flight analysis of the request to finish.
+
+        Returns:
+            dict: The completed record, or None if it failed, expired or is still running.
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            record = self.get_record(key)
+            if record is None or record["state"] == COMPLETED:
+                return record
+            time.sleep(poll_interval)
+        return None
+
+    def complete(self, key, result):
+        """Stores the result and marks the request completed."""
+        result_ref = self.result_key(key)
+        self._call("set", result_ref, json.dumps(result), ex=self.result_ttl)
+        record = self.get_record(key) or {"owner": self.owner, "started_at": time.time()}
+        record.update(state=COMPLETED, completed_at=time.time(), result_ref=result_ref, published=False)
+        self._put_record(key, record, self.result_ttl)
+        return record
+
+    def mark_published(self, key, correlation_id=None):
+        record = self.get_record(key)
+        if record is not None and record["state"] == COMPLETED:
+            record["published"] = True
+            if correlation_id and correlation_id not in record.setdefault("published_to", []):
+                record["published_to"].append(correlation_id)
+            self._put_record(key, record, self.result_ttl)
+
+    def needs_publish(self, record, correlation_id=None):
+        """Whether a completed result still has to be published, for this requester in particular."""
+        if not record.get("published"):
+            return True
+        return bool(correlation_id) and correlation_id not in record.get("published_to", [])
+
+    def fail(self, key):
+        """Drops this worker's in-progress claim so the next delivery runs the analysis again."""
+        if self.client is not None:
+            try:
+                self.client.eval(RELEASE_CLAIM_LUA, 1, self._record_key(key), self.owner)
+                return
+            except Exception as e:
+                logger.warning(f"Redis idempotency store unavailable ({e}), using the local store")
+        # Every claim in the local store belongs to this process
+        raw = self.local.get(self._record_key(key))
+        if raw is not None and json.loads(raw)["state"] == IN_PROGRESS:
+            self.local.delete(self._record_key(key))
+
+    def discard(self, key):
+        """Drops a record and its result, whatever its state, so the next delivery runs the analysis again."""
+        self._call("delete", self._record_key(key))
+        self._call("delete", self.result_key(key))
+
+    def get_result(self, record):
+        """Loads the result a completed record refers to, or None if it expired."""
+        raw = self._call("get", record["result_ref"]) if record and record.get("result_ref") else None
+        return json.loads(raw) if raw is not None else None
+
+
+IDEMPOTENCY_STORE = IdempotencyStore.from_env()
@@ -0,0 +1,771 @@
+# llm_backend.py
+#
+# Pluggable LLM backends.
+#
+# Shared with the other services: edit strange/api/llm_backend.py and copy it to
+# mock_aplens/server/api and archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# LLM_BACKEND=gemini (default) talks to Gemini; LLM_BACKEND=fake uses a deterministic local
+# stand-in with configurable latency and failures, to benchmark the pipelines offline.
+# Both are wrapped in ResilientBackend, which adds deadlines, retries with backoff, a circuit
+# breaker and optional hedged requests. When LLM_RPM/LLM_TPM are set, every call first
+# acquires from a QuotaScheduler shared by all processes through Redis.
+#
+# Callers get models through get_model(), which returns a cheap handle backed by a
+# process-wide registry: each configured model is built once, lazily, on first use.
+
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+import itertools
+from collections import deque
+from string import Template
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+DEFAULT_MODEL_NAME = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+# Number of underlying gRPC channels per Gemini model; each channel multiplexes many calls
+LLM_MAX_CHANNELS = int(os.getenv('LLM_MAX_CHANNELS', '1'))
+
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '120'))
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '1'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '30'))
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', '30'))
+LLM_HEDGE = os.getenv('LLM_HEDGE', 'false').lower() == 'true'
+
+# Shared quota (requests and tokens per minute) across every process using the same Redis
+LLM_RPM = int(os.getenv('LLM_RPM', '0'))
+LLM_TPM = int(os.getenv('LLM_TPM', '0'))
+LLM_QUOTA_REDIS_URL = os.getenv('LLM_QUOTA_REDIS_URL', os.getenv('REDIS_URL'))
+LLM_QUOTA_MAX_WAIT = float(os.getenv('LLM_QUOTA_MAX_WAIT', '300'))
+LLM_PRIORITY = os.getenv('LLM_PRIORITY', 'interactive')
+
+# Share of each bucket a priority class must leave untouched, so interactive calls go first
+PRIORITY_RESERVES = {
+    "interactive": 0.0,
+    "batch": 0.25,
+}
+
+# HTTP statuses worth retrying: rate limiting and server-side errors
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+GITHUB_URL_REGEX = re.compile(r'https?://github\.com/[\w-]+/[\w.-]+')
+
+
+class LLMError(Exception):
+    """Raised when a generation request fails. status_code mirrors the HTTP status when known."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CircuitOpenError(LLMError):
+    """Raised without calling the model while the circuit breaker is open."""
+
+    def __init__(self, message):
+        super().__init__(message, status_code=503)
+
+
+class QuotaTimeoutError(LLMError):
+    """Raised when the shared quota could not be acquired within the allowed wait."""
+
+    def __init__(self, message):
+        super().__init__(message, status_code=429)
+
+
+class LLMResponse:
+    """Minimal response object exposing the same `.text` attribute as Gemini responses."""
+
+    def __init__(self, text, prompt_tokens=0, output_tokens=0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token), good enough for pacing and budgets."""
+    return max(1, len(text or "") // 4)
+
+
+class LLMBackend:
+    """Interface every backend implements: generate_content(prompt, **kwargs) -> object with `.text`."""
+
+    name = "base"
+
+    def generate_content(self, prompt, **kwargs):
+        raise NotImplementedError
+
+
+class GeminiBackend(LLMBackend):
+    """
+    Backend calling Gemini through google-generativeai.
+
+    With channels=1 every call goes through the SDK's default client. With more, each model
+    instance gets its own GenerativeServiceClient (one gRPC channel each) and calls are spread
+    round-robin, so the number of transport channels stays bounded.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key, model_name=DEFAULT_MODEL_NAME, channels=LLM_MAX_CHANNELS):
+        # Imported here so the fake backend works without the Gemini SDK installed
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.models = [genai.GenerativeModel(model_name) for _ in range(max(1, channels))]
+        if channels > 1:
+            from google.ai import generativelanguage as glm
+
+            for model in self.models:
+                # GenerativeModel has no public way to pass a client; it only builds the default one lazily
+                model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        self.model = self.models[0]
+        self._next_model = itertools.cycle(self.models)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs["request_options"] = {**kwargs.get("request_options", {}), "timeout": timeout}
+        with self._lock:
+            model = next(self._next_model)
+        return model.generate_content(prompt, **kwargs)
+
+
+# --- Fake backend ---
+
+# Canned answers for the prompts used across the services, first regex match wins.
+# Templates may use $repo_url, $prompt_tokens and any named group of the regex.
+DEFAULT_FAKE_RESPONSES = [
+    (r"SELECTED_AGENT", (
+        "SELECTED_AGENT: Pattern Evaluation Agent\n"
+        "MISSING_INFORMATION: None\n"
+        "MESSAGE_TO_AGENT: Evaluate the mvc architectural pattern of $repo_url\n"
+        "REASON: The user asked to evaluate a specific architectural pattern."
+    )),
+    (r"### Percentage", (
+        "### Percentage\n75%\n"
+        "### Explanation\nThe provided files separate models, views and controllers in most places.\n"
+        "### Improvements\n- Improvement 1: Move input handling into controllers\n"
+        "- Improvement 2: Avoid rendering logic in models\n"
+        "- Improvement 3: Add interfaces between layers\n"
+        "### Strengths\n- Strength 1: Clear package structure\n"
+        "- Strength 2: Models have no view dependencies\n"
+        "- Strength 3: Controllers are small"
+    )),
+    (r"(?i)json", json.dumps({
+        "repositoryAnalysis": {
+            "repoName": "repo",
+            "lastCommitHash": "",
+            "lastIssueHash": "",
+            "analysisDate": "1970-01-01",
+            "predictedDesignPatterns": [{
+                "patternName": "Layered Architecture",
+                "confidence": 0.5,
+                "evidence": [{"type": "file", "path": "src", "reason": "Fake backend answer"}],
+            }],
+            "unusualPatterns": [],
+        },
+        "meta": {
+            "analyzedCommits": 0, "analyzedBranches": 0, "analyzedIssues": 0,
+            "analyzedUserStories": 0, "linesOfCode": 0, "toolVersion": "fake",
+        },
+    })),
+]
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution spec into a sampler.
+
+    Supported specs: "constant:S", "uniform:LOW,HIGH", "normal:MEAN,STD" and
+    "lognormal:MU,SIGMA", all in seconds (lognormal parameters are those of the
+    underlying normal distribution).
+
+    Args:
+        spec (str): Distribution spec.
+
+    Returns:
+        callable: Function taking a random.Random and returning a delay in seconds.
+    """
+    kind, _, raw_params = (spec or "constant:0").partition(":")
+    params = [float(p) for p in raw_params.split(",") if p.strip()] or [0.0]
+    if kind == "constant":
+        return lambda rng: params[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(params[0], params[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic local stand-in for Gemini.
+
+    Each call sleeps for a base latency drawn from a configurable distribution plus a
+    per-token delay proportional to the prompt and answer sizes, may fail with an injected
+    error, and answers with the first canned or templated response whose regex matches the
+    prompt. A fixed seed makes latencies and failures reproducible across runs.
+    """
+
+    name = "fake"
+
+    def __init__(self, responses=None, default_response="", latency="constant:0",
+                 input_token_latency=0.0, output_token_latency=0.0,
+                 failure_rate=0.0, failure_status=503, seed=0):
+        self.responses = [(re.compile(pattern), Template(template))
+                          for pattern, template in (responses or DEFAULT_FAKE_RESPONSES)]
+        self.default_response = Template(default_response)
+        self.sample_latency = parse_latency(latency)
+        self.input_token_latency = input_token_latency
+        self.output_token_latency = output_token_latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds a fake backend from LLM_FAKE_* environment variables.
+
+        LLM_FAKE_RESPONSES points to a JSON file with a list of {"match": regex, "response": template}.
+        """
+        responses = None
+        responses_file = os.getenv('LLM_FAKE_RESPONSES')
+        if responses_file:
+            with open(responses_file) as f:
+                responses = [(entry["match"], entry["response"]) for entry in json.load(f)]
+        return cls(
+            responses=responses,
+            latency=os.getenv('LLM_FAKE_LATENCY', 'constant:0'),
+            input_token_latency=float(os.getenv('LLM_FAKE_INPUT_TOKEN_LATENCY', '0')),
+            output_token_latency=float(os.getenv('LLM_FAKE_OUTPUT_TOKEN_LATENCY', '0')),
+            failure_rate=float(os.getenv('LLM_FAKE_FAILURE_RATE', '0')),
+            failure_status=int(os.getenv('LLM_FAKE_FAILURE_STATUS', '503')),
+            seed=int(os.getenv('LLM_FAKE_SEED', '0')),
+        )
+
+    def render(self, prompt):
+        """Returns the answer for a prompt without any delay."""
+        url_match = GITHUB_URL_REGEX.search(prompt)
+        variables = {
+            "repo_url": url_match.group(0) if url_match else "https://github.com/user/repo",
+            "prompt_tokens": estimate_tokens(prompt),
+        }
+        for regex, template in self.responses:
+            match = regex.search(prompt)
+            if match:
+                return template.safe_substitute(variables, **match.groupdict())
+        return self.default_response.safe_substitute(variables)
+
+    def generate_content(self, prompt, generation_config=None, stream=False, **kwargs):
+        prompt = prompt if isinstance(prompt, str) else str(prompt)
+        with self._lock:
+            self.calls += 1
+            base_delay = self.sample_latency(self._rng)
+            failed = self._rng.random() < self.failure_rate
+
+        text = self.render(prompt)
+        max_output_tokens = (generation_config or {}).get("max_output_tokens")
+        if max_output_tokens:
+            text = text[:max_output_tokens * 4]
+
+        prompt_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(text)
+        time.sleep(base_delay + prompt_tokens * self.input_token_latency)
+        if failed:
+            raise LLMError("Injected fake backend failure", status_code=self.failure_status)
+
+        if stream:
+            return self._stream(text, prompt_tokens)
+        time.sleep(output_tokens * self.output_token_latency)
+        return LLMResponse(text, prompt_tokens, output_tokens)
+
+    def _stream(self, text, prompt_tokens):
+        for line in text.splitlines(keepends=True):
+            output_tokens = estimate_tokens(line)
+            time.sleep(output_tokens * self.output_token_latency)
+            yield LLMResponse(line, prompt_tokens, output_tokens)
+
+
+# --- Resilience ---
+
+class CallCounters:
+    """Thread-safe counters for retries, breaker trips, hedges and other call outcomes."""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counts[name] = self._counts.get(name, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+LLM_COUNTERS = CallCounters()
+
+
+def is_retryable(error):
+    """
+    Tells whether a failed call is worth retrying (429, 5xx, timeouts).
+
+    Args:
+        error (Exception): Error raised by a backend.
+
+    Returns:
+        bool: True for transient errors.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, TimeoutError):
+        return True
+    # LLMError.status_code, google.api_core exceptions expose the HTTP status as .code
+    status_code = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status_code, int):
+        return status_code in RETRYABLE_STATUS_CODES
+    return type(error).__name__ in ("ResourceExhausted", "ServiceUnavailable", "InternalServerError",
+                                    "DeadlineExceeded", "TooManyRequests", "GatewayTimeout")
+
+
+class CircuitBreaker:
+    """
+    Fails fast after `failure_threshold` consecutive transient failures.
+
+    While open, calls are rejected for `reset_timeout` seconds; then a single trial call is
+    let through (half-open) and its outcome closes or reopens the circuit. A trial that fails
+    for any reason reopens it, so the circuit never stays half-open without a trial in flight.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_THRESHOLD, reset_timeout=LLM_BREAKER_RESET, counters=LLM_COUNTERS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.counters = counters
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        """Whether calls are still being rejected, without claiming the half-open trial."""
+        with self._lock:
+            return self.state == "half_open" or (
+                self.state == "open" and time.monotonic() - self._opened_at < self.reset_timeout
+            )
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                return True
+            return self.state == "closed"
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+
+    def record_failure(self, transient=True):
+        """Only transient failures count towards the threshold; any failure of the half-open trial reopens."""
+        with self._lock:
+            if transient:
+                self._failures += 1
+            if self.state == "half_open" or (
+                transient and self.state == "closed" and self._failures >= self.failure_threshold
+            ):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.counters.increment("breaker_trips")
+                logger.warning(f"LLM circuit breaker opened after {self._failures} consecutive failures")
+
+
+class LatencyTracker:
+    """Keeps the latencies of the last successful calls to estimate percentiles."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent, min_samples=20):
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+# --- Shared quota ---
+
+# Atomically refills and takes from the RPM and TPM buckets. Returns 0 when granted, otherwise
+# the number of milliseconds to wait before the request could be granted.
+# The Redis clock is used so that hosts with skewed clocks share consistent buckets.
+# KEYS: rpm bucket, tpm bucket. ARGV: rpm, tpm, tokens, reserve share.
+TOKEN_BUCKET_LUA = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local limits = {tonumber(ARGV[1]), tonumber(ARGV[2])}
+local costs = {1, tonumber(ARGV[3])}
+local reserve = tonumber(ARGV[4])
+local levels = {}
+local wait_ms = 0
+for i = 1, 2 do
+    local capacity = limits[i]
+    if capacity > 0 then
+        local bucket = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        local level = tonumber(bucket[1]) or capacity
+        local ts = tonumber(bucket[2]) or now
+        local rate = capacity / 60000
+        level = math.min(capacity, level + (now - ts) * rate)
+        levels[i] = level
+        local cost = math.min(costs[i], capacity)
+        local needed = cost + reserve * capacity - level
+        if needed > 0 then
+            wait_ms = math.max(wait_ms, math.ceil(needed / rate))
+        end
+    end
+end
+for i = 1, 2 do
+    if limits[i] > 0 then
+        local level = levels[i]
+        if wait_ms == 0 then
+            level = level - math.min(costs[i], limits[i])
+        end
+        redis.call('HSET', KEYS[i], 'level', level, 'ts', now)
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+return wait_ms
+"""
+
+
+class QuotaScheduler:
+    """
+    Distributed token-bucket scheduler for requests-per-minute and tokens-per-minute.
+
+    All processes pointing at the same Redis share one pair of buckets, so aplens,
+    archidetect and strange together stay under the Gemini quota. Priority classes leave
+    a reserve of each bucket to higher classes: batch work only proceeds while the buckets
+    are above PRIORITY_RESERVES["batch"], which keeps headroom for interactive calls.
+    Without Redis (or if it becomes unreachable) an in-process bucket is used instead.
+    """
+
+    def __init__(self, rpm, tpm, redis_url=None, namespace="llm-quota", max_wait=LLM_QUOTA_MAX_WAIT, counters=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_wait = max_wait
+        self.counters = counters
+        self.keys = [f"{namespace}:rpm", f"{namespace}:tpm"]
+        self._local_levels = {}
+        self._lock = threading.Lock()
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+
+                self._redis = redis.Redis.from_url(redis_url)
+                self._script = self._redis.register_script(TOKEN_BUCKET_LUA)
+            except ImportError:
+                logger.warning("redis package not installed, LLM quota is enforced per process only")
+
+    @classmethod
+    def from_env(cls, counters=None):
+        """Builds the scheduler from LLM_RPM/LLM_TPM, or returns None when no quota is configured."""
+        if not (LLM_RPM or LLM_TPM):
+            return None
+        return cls(LLM_RPM, LLM_TPM, LLM_QUOTA_REDIS_URL, counters=counters)
+
+    def _try_acquire_local(self, tokens, reserve):
+        now = time.monotonic()
+        wait_seconds = 0.0
+        levels = {}
+        with self._lock:
+            for key, capacity, cost in zip(self.keys, (self.rpm, self.tpm), (1, tokens)):
+                if capacity <= 0:
+                    continue
+                level, ts = self._local_levels.get(key, (capacity, now))
+                rate = capacity / 60.0
+                level = min(capacity, level + (now - ts) * rate)
+                levels[key] = (level, min(cost, capacity))
+                needed = min(cost, capacity) + reserve * capacity - level
+                if needed > 0:
+                    wait_seconds = max(wait_seconds, needed / rate)
+            for key, (level, cost) in levels.items():
+                self._local_levels[key] = (level - cost if wait_seconds == 0 else level, now)
+        return wait_seconds
+
+    def try_acquire(self, tokens, priority="interactive"):
+        """
+        Takes one request and `tokens` tokens from the buckets if the priority class allows it.
+
+        Returns:
+            float: 0 when granted, otherwise the seconds to wait before trying again.
+        """
+        reserve = PRIORITY_RESERVES.get(priority, 0.0)
+        if self._redis is not None:
+            try:
+                return self._script(keys=self.keys, args=[self.rpm, self.tpm, tokens, reserve]) / 1000.0
+            except Exception as e:
+                logger.warning(f"Redis quota unavailable ({e}), falling back to the local bucket")
+        return self._try_acquire_local(tokens, reserve)
+
+    def acquire(self, tokens, priority="interactive"):
+        """
+        Blocks until the request can be sent under the shared quota.
+
+        Args:
+            tokens (int): Estimated tokens of the request.
+            priority (str): Priority class, a key of PRIORITY_RESERVES.
+
+        Raises:
+            QuotaTimeoutError: If the quota could not be acquired within max_wait seconds.
+        """
+        started = time.monotonic()
+        while True:
+            wait_seconds = self.try_acquire(tokens, priority)
+            if wait_seconds <= 0:
+                if self.counters:
+                    self.counters.increment(f"quota_wait_ms_{priority}", int((time.monotonic() - started) * 1000))
+                return
+            if time.monotonic() - started + wait_seconds > self.max_wait:
+                if self.counters:
+                    self.counters.increment("quota_timeouts")
+                raise QuotaTimeoutError(f"LLM quota not available within {self.max_wait:g}s")
+            if self.counters:
+                self.counters.increment(f"quota_throttled_{priority}")
+            # Small jitter so waiting processes do not all retry at the same instant
+            time.sleep(min(wait_seconds, 5.0) + random.uniform(0, 0.05))
+
+
+class ResilientBackend(LLMBackend):
+    """
+    Wraps a backend with per-call deadlines, jittered exponential backoff on transient errors,
+    a circuit breaker and, optionally, a hedged duplicate request once the first one has been
+    running for longer than the observed p95 latency. When a quota scheduler is given, every
+    attempt acquires from it before being sent, using the call's priority class.
+
+    Calls run on a bounded executor so a hung request never blocks the caller past its deadline.
+    """
+
+    def __init__(self, backend, deadline=LLM_DEADLINE, max_retries=LLM_MAX_RETRIES,
+                 backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX,
+                 breaker=None, hedge=LLM_HEDGE, max_workers=16, counters=LLM_COUNTERS,
+                 quota=None, priority=LLM_PRIORITY):
+        self.backend = backend
+        self.name = backend.name
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.counters = counters
+        self.breaker = breaker or CircuitBreaker(counters=counters)
+        self.hedge = hedge
+        self.latencies = LatencyTracker()
+        self.quota = quota
+        self.priority = priority
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm-call")
+        self._rng = random.Random()
+
+    def generate_content(self, prompt, deadline=None, priority=None, **kwargs):
+        deadline = deadline or self.deadline
+        for attempt in range(self.max_retries + 1):
+            # Fail fast without spending quota while the circuit is open
+            if self.breaker.is_open():
+                self.counters.increment("breaker_rejections")
+                raise CircuitOpenError("LLM circuit breaker is open, failing fast")
+
+            # Wait for quota before claiming the half-open trial, so the trial is always sent
+            if self.quota is not None:
+                self.quota.acquire(estimate_tokens(str(prompt)), priority or self.priority)
+
+            if not self.breaker.allow_request():
+                self.counters.increment("breaker_rejections")
+                raise CircuitOpenError("LLM circuit breaker is open, failing fast")
+
+            self.counters.increment("calls")
+            try:
+                if kwargs.get("stream"):
+                    # Streams are consumed by the caller, only the initial request is guarded
+                    result = self.backend.generate_content(prompt, timeout=deadline, **kwargs)
+                else:
+                    result = self._call_with_deadline(prompt, deadline, kwargs)
+            except Exception as e:
+                retryable = is_retryable(e)
+                self.breaker.record_failure(transient=retryable)
+                if not retryable or attempt == self.max_retries:
+                    self.counters.increment("failures")
+                    raise
+                delay = self._rng.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                self.counters.increment("retries")
+                logger.warning(f"LLM call failed ({e}), retrying in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries})")
+                time.sleep(delay)
+            else:
+                self.breaker.record_success()
+                self.counters.increment("successes")
+                return result
+
+    def _call_with_deadline(self, prompt, deadline, kwargs):
+        started = time.monotonic()
+        expires_at = started + deadline
+
+        def call():
+            return self.backend.generate_content(prompt, timeout=deadline, **kwargs)
+
+        primary = self._executor.submit(call)
+        pending = {primary}
+        hedge_after = self.latencies.percentile(95) if self.hedge else None
+        last_error = None
+
+        while pending:
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = remaining
+            if hedge_after is not None and len(pending) == 1 and primary in pending:
+                timeout = min(remaining, max(0.0, started + hedge_after - time.monotonic()))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self.counters.increment("hedge_wins")
+                    self.latencies.record(time.monotonic() - started)
+                    return future.result()
+                last_error = future.exception()
+
+            if not done and hedge_after is not None and primary in pending and len(pending) == 1:
+                hedge_after = None
+                self.counters.increment("hedges_sent")
+                pending.add(self._executor.submit(call))
+
+        if last_error is not None and not pending:
+            raise last_error
+        self.counters.increment("timeouts")
+        raise TimeoutError(f"LLM call exceeded its {deadline:g}s deadline")
+
+
+_quota_scheduler = None
+_quota_lock = threading.Lock()
+
+
+def get_quota_scheduler():
+    """Returns the process-wide quota scheduler configured from the environment, if any."""
+    global _quota_scheduler
+    with _quota_lock:
+        if _quota_scheduler is None:
+            _quota_scheduler = QuotaScheduler.from_env(counters=LLM_COUNTERS) or False
+    return _quota_scheduler or None
+
+
+def get_backend(api_key, model_name=DEFAULT_MODEL_NAME, backend=None, resilient=True, priority=LLM_PRIORITY):
+    """
+    Builds the backend selected by `backend` or the LLM_BACKEND environment variable.
+
+    Args:
+        api_key (str): Gemini API key (ignored by the fake backend).
+        model_name (str): Gemini model name.
+        backend (str): "gemini" or "fake". Defaults to LLM_BACKEND.
+        resilient (bool): Wrap the backend in ResilientBackend (LLM_* environment settings).
+        priority (str): Default quota priority class of the calls ("interactive" or "batch").
+
+    Returns:
+        LLMBackend: The configured backend.
+    """
+    backend = backend or LLM_BACKEND
+    if backend == "fake":
+        logger.info("Using fake LLM backend")
+        instance = FakeBackend.from_env()
+    elif backend == "gemini":
+        instance = GeminiBackend(api_key, model_name)
+    else:
+        raise ValueError(f"Unknown LLM backend: {backend}")
+    if not resilient:
+        return instance
+    return ResilientBackend(instance, quota=get_quota_scheduler(), priority=priority)
+
+
+# --- Process-wide model registry ---
+
+class ModelHandle:
+    """
+    Cheap, thread-safe handle to a registry model.
+
+    Holding one (e.g. as a module global) does not build anything: the backend is created by
+    the registry on the first call and then shared with every other handle for that model.
+    """
+
+    def __init__(self, registry, key, priority):
+        self.registry = registry
+        self.key = key
+        self.priority = priority
+
+    def generate_content(self, prompt, **kwargs):
+        kwargs.setdefault("priority", self.priority)
+        return self.registry.resolve(self.key).generate_content(prompt, **kwargs)
+
+
+class ModelRegistry:
+    """
+    Builds each configured model once per process, lazily, and shares it between threads.
+
+    Views, subscribers and management commands all get handles from the same registry, so
+    genai.configure and the transport channels are set up once instead of per request.
+    """
+
+    def __init__(self):
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    def get(self, api_key, model_name=DEFAULT_MODEL_NAME, priority=LLM_PRIORITY, backend=None):
+        return ModelHandle(self, (backend or LLM_BACKEND, api_key, model_name), priority)
+
+    def resolve(self, key):
+        instance = self._backends.get(key)
+        if instance is None:
+            with self._lock:
+                instance = self._backends.get(key)
+                if instance is None:
+                    backend, api_key, model_name = key
+                    logger.info(f"Building {backend} model {model_name}")
+                    instance = get_backend(api_key, model_name, backend=backend)
+                    self._backends[key] = instance
+        return instance
+
+
+MODEL_REGISTRY = ModelRegistry()
+
+
+def get_model(api_key, model_name=DEFAULT_MODEL_NAME, priority=LLM_PRIORITY, backend=None):
+    """
+    Returns a handle to the process-wide model for these settings.
+
+    Args:
+        api_key (str): Gemini API key (ignored by the fake backend).
+        model_name (str): Gemini model name.
+        priority (str): Quota priority class used by calls made through this handle.
+        backend (str): "gemini" or "fake". Defaults to LLM_BACKEND.
+
+    Returns:
+        ModelHandle: Object exposing generate_content like a Gemini model.
+    """
+    return MODEL_REGISTRY.get(api_key, model_name, priority, backend)
@@ -0,0 +1,166 @@
+import re
+import json
+import logging
+
+try:
+    import orjson
+except ImportError:  # Optional fast parser, falls back to the standard library
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Fields every analysis response must contain, as dotted paths
+REQUIRED_FIELDS = {
+    "repositoryAnalysis": dict,
+    "repositoryAnalysis.repoName": str,
+    "repositoryAnalysis.analysisDate": str,
+    "repositoryAnalysis.predictedDesignPatterns": list,
+    "repositoryAnalysis.unusualPatterns": list,
+    "meta": dict,
+}
+
+CODE_FENCE_REGEX = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+
+
+def extract_json(response_text):
+    """
+    Parse the model answer as JSON, tolerating markdown code fences around it.
+
+    Args:
+        response_text (str): Raw text returned by the model.
+
+    Returns:
+        tuple: (parsed object or None, error message or None).
+    """
+    text = (response_text or "").strip()
+    fence_match = CODE_FENCE_REGEX.match(text)
+    if fence_match:
+        text = fence_match.group(1)
+    if orjson is not None:
+        try:
+            return orjson.loads(text), None
+        except orjson.JSONDecodeError:
+            pass  # Fall through to get a descriptive error message
+    try:
+        return json.loads(text), None
+    except json.JSONDecodeError as e:
+        return None, f"{e.msg} at line {e.lineno} column {e.colno}"
+
+
+def _get_path(data, path):
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _set_path(data, path, value):
+    keys = path.split(".")
+    for key in keys[:-1]:
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+        data = data[key]
+    data[keys[-1]] = value
+
+
+def find_invalid_fields(data, required_fields=None):
+    """
+    Detect which required JSON fields are missing or have the wrong type.
+
+    Args:
+        data (dict): Parsed model answer.
+        required_fields (dict): Dotted path -> expected type. Defaults to REQUIRED_FIELDS.
+
+    Returns:
+        list: Dotted paths of the invalid fields.
+    """
+    required_fields = required_fields or REQUIRED_FIELDS
+    if not isinstance(data, dict):
+        return list(required_fields)
+    return [
+        path for path, expected_type in required_fields.items()
+        if not isinstance(_get_path(data, path), expected_type)
+    ]
+
+
+def build_json_fix_prompt(response_text, error):
+    """Prompt asking the model to fix the syntax of its own answer, without the original input."""
+    return (
+        f"Your previous answer was not valid JSON ({error}). "
+        "Return the same content as strictly valid JSON, with no comments, no markdown and no extra text.\n\n"
+        f"Previous answer:\n{response_text}"
+    )
+
+
+def build_fields_prompt(data, invalid_fields, required_fields):
+    """Prompt asking the model to fill in only the fields that are missing or malformed."""
+    expected = ", ".join(f'"{path}" ({required_fields[path].__name__})' for path in invalid_fields)
+    return (
+        "Below is your previous JSON analysis. The following fields are missing or have the wrong type: "
+        f"{expected}.\n"
+        "Reply ONLY with a JSON object whose keys are exactly these dotted paths and whose values are the "
+        "corrected values, consistent with the rest of the analysis. No comments, no markdown.\n\n"
+        f"Previous answer:\n{json.dumps(data)}"
+    )
+
+
+def repair_json_response(model, response_text, required_fields=None, max_attempts=1, generation_config=None):
+    """
+    Validate a JSON analysis answer and issue small follow-up requests for only the broken parts.
+
+    Syntax errors are first fixed locally (code fences) and otherwise sent back with the
+    original answer only; missing or malformed fields are asked for individually and merged
+    into the answer, so the whole multi-file prompt never has to be resent.
+
+    Args:
+        model: Object exposing generate_content(prompt) (a Gemini model or compatible backend).
+        response_text (str): Raw text returned by the model.
+        required_fields (dict): Dotted path -> expected type. Defaults to REQUIRED_FIELDS.
+        max_attempts (int): Maximum number of follow-up requests per kind of problem.
+        generation_config (dict): Structured-output config of the original request, reused
+            for syntax repairs. Field repairs only request plain JSON output.
+
+    Returns:
+        tuple: (parsed dict or None, list of fields still invalid).
+    """
+    required_fields = required_fields or REQUIRED_FIELDS
+    patch_config = {"response_mime_type": "application/json"} if generation_config else None
+
+    data, error = extract_json(response_text)
+    attempts = 0
+    while data is None and attempts < max_attempts:
+        attempts += 1
+        logger.warning(f"Response is not valid JSON ({error}), requesting syntax repair")
+        try:
+            response_text = model.generate_content(
+                build_json_fix_prompt(response_text, error), generation_config=generation_config
+            ).text
+        except Exception as e:
+            logger.error(f"JSON repair request failed: {e}")
+            break
+        data, error = extract_json(response_text)
+
+    if not isinstance(data, dict):
+        return None, list(required_fields)
+
+    invalid_fields = find_invalid_fields(data, required_fields)
+    attempts = 0
+    while invalid_fields and attempts < max_attempts:
+        attempts += 1
+        logger.warning(f"Response has invalid fields {invalid_fields}, requesting repair")
+        try:
+            repair_text = model.generate_content(
+                build_fields_prompt(data, invalid_fields, required_fields), generation_config=patch_config
+            ).text
+        except Exception as e:
+            logger.error(f"Field repair request failed: {e}")
+            break
+        patch, _ = extract_json(repair_text)
+        if isinstance(patch, dict):
+            for path in invalid_fields:
+                if path in patch:
+                    _set_path(data, path, patch[path])
+        invalid_fields = find_invalid_fields(data, required_fields)
+
+    return data, invalid_fields
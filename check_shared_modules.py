@@ -0,0 +1,46 @@
+import os
+import sys
+import shutil
+import filecmp
+
+# Modules copied into several services, because each service is built from its own directory.
+# The first path of each entry is the one to edit; the others must stay identical to it.
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SHARED_MODULES = {
+    "agent_messages.py": ["strange/api", "mock_aplens/server/api", "archidetect/api/utils"],
+    "llm_backend.py": ["strange/api", "mock_aplens/server/api", "archidetect/api/utils"],
+    "github_cache.py": ["strange/api", "mock_aplens/server/api", "archidetect/api/utils"],
+    "claim_check.py": ["strange/api", "mock_aplens/server/api", "archidetect/api/utils"],
+    "transport.py": ["strange/api", "mock_aplens/server/api", "archidetect/api/utils"],
+    "idempotency.py": ["mock_aplens/server/api", "archidetect/api/utils"],
+    "subscriber_flow.py": ["mock_aplens/server/api", "archidetect/api/utils"],
+    "failure_handling.py": ["mock_aplens/server/api", "archidetect/api/utils"],
+    "worker_supervisor.py": ["mock_aplens/server/api", "archidetect/api/utils"],
+}
+
+
+def stale_copies():
+    """Yields (source, copy) for every copy that differs from its source module."""
+    for name, directories in SHARED_MODULES.items():
+        source = os.path.join(ROOT, directories[0], name)
+        for directory in directories[1:]:
+            copy = os.path.join(ROOT, directory, name)
+            if not os.path.exists(copy) or not filecmp.cmp(source, copy, shallow=False):
+                yield source, copy
+
+
+if __name__ == "__main__":
+    # Usage: python check_shared_modules.py [--sync]
+    sync = "--sync" in sys.argv[1:]
+    stale = list(stale_copies())
+    for source, copy in stale:
+        if sync:
+            shutil.copyfile(source, copy)
+            print(f"Updated {os.path.relpath(copy, ROOT)} from {os.path.relpath(source, ROOT)}")
+        else:
+            print(f"{os.path.relpath(copy, ROOT)} differs from {os.path.relpath(source, ROOT)}")
+    if stale and not sync:
+        print("Edit the first copy and run: python check_shared_modules.py --sync")
+        sys.exit(1)
+    if not stale:
+        print(f"All copies of the {len(SHARED_MODULES)} shared modules are identical")
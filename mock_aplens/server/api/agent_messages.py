@@ -0,0 +1,262 @@
+# agent_messages.py
+#
+# Versioned schema of the messages the orchestrator publishes to the agents.
+#
+# Shared with the other services: edit strange/api/agent_messages.py and copy it to
+# mock_aplens/server/api and archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# A message carries explicit, validated fields (repository, pattern or analysis type, token);
+# the router's natural-language instruction is only optional context. Bodies are msgpack when
+# the package is installed and JSON otherwise. The routing-relevant fields are duplicated in the
+# Pub/Sub attributes, so workers and subscription filters can dispatch without decoding the body.
+# Messages without a schema_version attribute come from older publishers and are parsed from
+# their free-text instruction.
+
+import re
+import json
+import logging
+
+try:
+    import msgpack
+except ImportError:  # Optional compact encoding, falls back to JSON
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = "1"
+CONTENT_TYPE_MSGPACK = "application/msgpack"
+CONTENT_TYPE_JSON = "application/json"
+
+PATTERN_EVALUATION_REQUEST = "pattern_evaluation.request"
+ARCHIDETECT_REQUEST = "archidetect.request"
+
+PATTERN_EVALUATION_RESULT = "pattern_evaluation.result"
+ARCHIDETECT_RESULT = "archidetect.result"
+RESULT_TYPES = {
+    PATTERN_EVALUATION_REQUEST: PATTERN_EVALUATION_RESULT,
+    ARCHIDETECT_REQUEST: ARCHIDETECT_RESULT,
+}
+
+# Fields each message type must carry, besides repo_url
+REQUIRED_FIELDS = {
+    PATTERN_EVALUATION_REQUEST: ("pattern",),
+    ARCHIDETECT_REQUEST: ("analysis_type",),
+}
+
+# Priority lanes, highest first. Each agent has one request topic and subscription per lane:
+# interactive requests keep the original names, the other lanes add their name as a suffix.
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BULK = "bulk"
+PRIORITY_LANES = (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+
+GITHUB_URL_REGEX = re.compile(r'https?://github\.com/[\w-]+/[\w.-]+')
+
+
+class InvalidMessageError(ValueError):
+    """The message cannot be decoded or misses a required field."""
+
+
+class AgentRequest:
+    """
+    A request for one agent.
+
+    Args:
+        message_type (str): PATTERN_EVALUATION_REQUEST or ARCHIDETECT_REQUEST.
+        repo_url (str): GitHub repository URL.
+        pattern (str): Architectural pattern to evaluate (pattern evaluation only).
+        analysis_type (str): ArchiDetect analysis type (archidetect only).
+        token (str): Optional GitHub token for private repositories.
+        context (str): Optional natural-language instruction from the router.
+        timestamp (str): ISO timestamp of the request.
+        correlation_id (str): ID of the orchestrated request, copied onto the result message.
+        priority (str): Lane of the request, one of PRIORITY_LANES (interactive when not set).
+    """
+
+    FIELDS = ("message_type", "repo_url", "pattern", "analysis_type", "token", "context", "timestamp", "correlation_id",
+              "priority")
+
+    def __init__(self, message_type, repo_url, pattern=None, analysis_type=None, token=None, context=None, timestamp=None,
+                 correlation_id=None, priority=None):
+        self.message_type = message_type
+        self.repo_url = repo_url
+        self.pattern = pattern
+        self.analysis_type = analysis_type
+        self.token = token
+        self.context = context
+        self.timestamp = timestamp
+        self.correlation_id = correlation_id
+        self.priority = priority
+
+    def missing_fields(self):
+        """Names of the required fields that are empty."""
+        if self.message_type not in REQUIRED_FIELDS:
+            return ["message_type"]
+        return [name for name in ("repo_url",) + REQUIRED_FIELDS[self.message_type] if not getattr(self, name)]
+
+    def validate(self):
+        missing = self.missing_fields()
+        if missing:
+            raise InvalidMessageError(f"{self.message_type} message is missing {', '.join(missing)}")
+        return self
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.FIELDS})
+
+    def __repr__(self):
+        # Never log the token
+        fields = {**self.to_dict(), "token": "[REDACTED]" if self.token else None}
+        if self.token and self.context:
+            fields["context"] = self.context.replace(self.token, "[REDACTED]")
+        return f"AgentRequest({fields})"
+
+
+def repo_attribute(repo_url):
+    parts = repo_url.rstrip('/').split('/')
+    return f"{parts[-2]}/{parts[-1]}".lower()
+
+
+def lane_name(name, priority):
+    """Topic or subscription ID of a lane, from the ID of the interactive lane."""
+    if priority in (None, PRIORITY_INTERACTIVE):
+        return name
+    if priority not in PRIORITY_LANES:
+        raise ValueError(f"Unknown priority {priority}")
+    return f"{name}-{priority}"
+
+
+def lane_of(attributes):
+    """Lane of a received message; messages without a known priority are interactive."""
+    priority = (attributes or {}).get("priority")
+    return priority if priority in PRIORITY_LANES else PRIORITY_INTERACTIVE
+
+
+def encode_message(request):
+    """
+    Serializes a validated request for Pub/Sub.
+
+    Returns:
+        tuple: (body bytes, attributes dict of strings).
+    """
+    body = {"schema_version": SCHEMA_VERSION, **request.validate().to_dict()}
+    if msgpack is not None:
+        data, content_type = msgpack.packb(body, use_bin_type=True), CONTENT_TYPE_MSGPACK
+    else:
+        data, content_type = json.dumps(body).encode('utf-8'), CONTENT_TYPE_JSON
+
+    attributes = {
+        "schema_version": SCHEMA_VERSION,
+        "message_type": request.message_type,
+        "content_type": content_type,
+        "repo": repo_attribute(request.repo_url),
+    }
+    if request.pattern:
+        attributes["pattern"] = request.pattern
+    if request.analysis_type:
+        attributes["analysis_type"] = request.analysis_type
+    if request.correlation_id:
+        attributes["correlation_id"] = request.correlation_id
+    if request.priority:
+        attributes["priority"] = request.priority
+    return data, attributes
+
+
+def result_attributes(request):
+    """Attributes of the result message answering a request, so consumers can index it without decoding the body."""
+    attributes = {
+        "schema_version": SCHEMA_VERSION,
+        "message_type": RESULT_TYPES[request.message_type],
+        "repo": repo_attribute(request.repo_url),
+        # Results of token-authenticated requests may describe private repositories
+        "private": "1" if request.token else "0",
+    }
+    if request.pattern:
+        attributes["pattern"] = request.pattern
+    if request.analysis_type:
+        attributes["analysis_type"] = request.analysis_type
+    if request.correlation_id:
+        attributes["correlation_id"] = request.correlation_id
+    return attributes
+
+
+def message_type_of(attributes):
+    """The message type from the attributes alone, or None for legacy messages."""
+    return (attributes or {}).get("message_type")
+
+
+def decode_message(data, attributes=None, legacy_type=None):
+    """
+    Decodes and validates a Pub/Sub message body.
+
+    Args:
+        data (bytes): Message body.
+        attributes (dict): Message attributes.
+        legacy_type (str): Message type to assume for legacy free-text messages.
+
+    Returns:
+        AgentRequest: The validated request.
+
+    Raises:
+        InvalidMessageError: If the body cannot be decoded or misses required fields.
+    """
+    attributes = attributes or {}
+    if not attributes.get("schema_version"):
+        return parse_legacy_message(data, legacy_type)
+
+    try:
+        if attributes.get("content_type") == CONTENT_TYPE_MSGPACK:
+            if msgpack is None:
+                raise InvalidMessageError("msgpack message received but the msgpack package is not installed")
+            body = msgpack.unpackb(data, raw=False)
+        else:
+            body = json.loads(data.decode('utf-8'))
+    except InvalidMessageError:
+        raise
+    except Exception as e:
+        raise InvalidMessageError(f"Could not decode message body: {e}")
+
+    if not isinstance(body, dict):
+        raise InvalidMessageError("Message body is not an object")
+    if str(body.get("schema_version")) != SCHEMA_VERSION:
+        raise InvalidMessageError(f"Unsupported schema version {body.get('schema_version')}")
+    return AgentRequest.from_dict(body).validate()
+
+
+# --- Legacy free-text messages ---
+
+def parse_legacy_message(data, message_type):
+    """
+    Parses the old {"agent_instruction": <free text>} payload with the original regexes.
+
+    Raises:
+        InvalidMessageError: If the payload is not JSON or the instruction lacks required fields.
+    """
+    try:
+        payload = json.loads(data.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise InvalidMessageError(f"Legacy message is not JSON: {e}")
+    instruction = payload.get('agent_instruction') if isinstance(payload, dict) else None
+    if not instruction:
+        raise InvalidMessageError("Legacy message has no 'agent_instruction'")
+
+    repo_url_match = GITHUB_URL_REGEX.search(instruction)
+    repo_url = repo_url_match.group(0).rstrip('.') if repo_url_match else None
+    token_match = re.search(r', "([\w-]+)"', instruction)
+    request = AgentRequest(
+        message_type,
+        repo_url,
+        token=token_match.group(1) if token_match else None,
+        context=instruction,
+        timestamp=payload.get('timestamp'),
+    )
+    if message_type == PATTERN_EVALUATION_REQUEST:
+        pattern_match = re.search(r'([\w-]+) architectural pattern', instruction)
+        request.pattern = pattern_match.group(1) if pattern_match else None
+    elif message_type == ARCHIDETECT_REQUEST:
+        analysis_type_match = re.search(r'analyze the ([\w]+) of this repo', instruction)
+        # Default analysis type is full if not specified
+        request.analysis_type = analysis_type_match.group(1).lower() if analysis_type_match else "full"
+    return request.validate()
@@ -0,0 +1,125 @@
+# batch_checkpoints.py
+#
+# Per-job checkpoints of the batch results of perform_pattern_analysis, so a redelivered or
+# resubmitted job only sends the batches that are missing to Gemini.
+#
+# Checkpoints live in a local SQLite file (PATTERN_CHECKPOINT_DB) that survives worker restarts.
+# Each batch result is stored with a hash of the files it covered, so a checkpoint is only reused
+# when the repository content of that batch is unchanged. A job's checkpoints are deleted once its
+# final result is published; checkpoints of jobs that never finish expire after PATTERN_CHECKPOINT_TTL.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Outside the source tree, which is bind-mounted in development; point it at a volume to keep it across containers
+PATTERN_CHECKPOINT_DB = os.getenv('PATTERN_CHECKPOINT_DB', '/tmp/pattern-checkpoints/pattern_checkpoints.sqlite3')
+PATTERN_CHECKPOINT_TTL = int(os.getenv('PATTERN_CHECKPOINT_TTL', str(7 * 24 * 3600)))
+# Expired checkpoints are purged at most this often
+PURGE_INTERVAL = 3600
+
+
+def batch_fingerprint(batch):
+    """Hash of the files of a batch, as they are sent in the prompt."""
+    digest = hashlib.sha256()
+    for artifact in batch:
+        digest.update(str(artifact.get('path', '')).encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(str(artifact.get('content', ''))[:1000].encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class CheckpointStore:
+    """SQLite store of completed batch results, keyed by job ID and batch index."""
+
+    def __init__(self, path=PATTERN_CHECKPOINT_DB, ttl=PATTERN_CHECKPOINT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._last_purge = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS batch_checkpoints ("
+                " job_id TEXT NOT NULL,"
+                " batch_index INTEGER NOT NULL,"
+                " fingerprint TEXT NOT NULL,"
+                " result TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (job_id, batch_index))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS batch_checkpoints_created_at ON batch_checkpoints (created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One connection per call, the subscriber runs analyses on several threads
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def load(self, job_id):
+        """
+        Loads the checkpointed batches of a job.
+
+        Returns:
+            dict: {batch index: (fingerprint, batch result dict)}.
+        """
+        self._purge_expired()
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT batch_index, fingerprint, result FROM batch_checkpoints WHERE job_id = ? AND created_at >= ?",
+                (job_id, time.time() - self.ttl),
+            ).fetchall()
+        return {index: (fingerprint, json.loads(result)) for index, fingerprint, result in rows}
+
+    def save(self, job_id, batch_index, fingerprint, result):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO batch_checkpoints (job_id, batch_index, fingerprint, result, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, batch_index, fingerprint, json.dumps(result), time.time()),
+            )
+
+    def delete_job(self, job_id):
+        """Garbage-collects the checkpoints of a job whose result was published."""
+        with self._connect() as connection:
+            removed = connection.execute("DELETE FROM batch_checkpoints WHERE job_id = ?", (job_id,)).rowcount
+        if removed:
+            logger.info(f"Removed {removed} batch checkpoints of job {job_id[:12]}")
+        return removed
+
+    def _purge_expired(self):
+        with self._lock:
+            if self._last_purge is not None and time.monotonic() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        with self._connect() as connection:
+            removed = connection.execute(
+                "DELETE FROM batch_checkpoints WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+        if removed:
+            logger.info(f"Purged {removed} expired batch checkpoints")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_checkpoint_store():
+    """Process-wide checkpoint store, opened on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = CheckpointStore()
+        return _store
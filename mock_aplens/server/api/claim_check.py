@@ -0,0 +1,223 @@
+# claim_check.py
+#
+# Claim-check publishing of analysis results.
+#
+# Shared with the other services: edit strange/api/claim_check.py and copy it to
+# mock_aplens/server/api and archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# Results up to CLAIM_CHECK_THRESHOLD bytes are published inline, as before. Larger ones are
+# compressed and written to a blob store shared by the containers (the CLAIM_CHECK_DIR volume),
+# and only a small reference envelope is published: blob ID, sizes, checksum and a summary of the
+# result's top-level fields. Consumers get a LazyResult whose summary is available at once and
+# whose payload is only read from the store when load() is called.
+
+import os
+import json
+import time
+import zlib
+import uuid
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CLAIM_CHECK_DIR = os.getenv('CLAIM_CHECK_DIR', '/tmp/analysis-blobs')
+# Results larger than this (serialized) are stored as blobs; Pub/Sub rejects messages over 10 MB
+CLAIM_CHECK_THRESHOLD = int(os.getenv('CLAIM_CHECK_THRESHOLD', str(64 * 1024)))
+CLAIM_CHECK_TTL = int(os.getenv('CLAIM_CHECK_TTL', str(7 * 24 * 3600)))
+PUBSUB_MAX_MESSAGE_BYTES = 10 * 1024 * 1024
+
+# Expired blobs are purged at most this often
+PURGE_INTERVAL = 3600
+# Longest string kept in an envelope's summary
+SUMMARY_MAX_CHARS = 200
+SUMMARY_MAX_FIELDS = 20
+
+
+class ClaimCheckError(Exception):
+    """A referenced blob is missing or does not match its checksum."""
+
+
+class BlobStore:
+    """
+    Content-addressed store of compressed payloads in a directory.
+
+    Blobs are named after the SHA-256 of their uncompressed content and written atomically, so
+    concurrent writers of the same result produce one blob and readers never see partial files.
+    """
+
+    def __init__(self, root=CLAIM_CHECK_DIR, ttl=CLAIM_CHECK_TTL):
+        self.root = root
+        self.ttl = ttl
+        self._last_purge = None
+        self._lock = threading.Lock()
+
+    def _path(self, blob_id):
+        if not blob_id.isalnum():
+            raise ClaimCheckError(f"Invalid blob ID {blob_id!r}")
+        return os.path.join(self.root, blob_id[:2], blob_id)
+
+    def put(self, data):
+        """
+        Compresses and stores a payload.
+
+        Returns:
+            dict: The reference (blob_id, size, compressed_size, checksum, encoding).
+        """
+        checksum = hashlib.sha256(data).hexdigest()
+        compressed = zlib.compress(data)
+        path = self._path(checksum)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(temporary_path, 'wb') as blob_file:
+                blob_file.write(compressed)
+            os.replace(temporary_path, path)
+        else:
+            # Refresh the age of a blob that is referenced again
+            os.utime(path)
+        self._purge_expired()
+        return {
+            "blob_id": checksum,
+            "size": len(data),
+            "compressed_size": len(compressed),
+            "checksum": f"sha256:{checksum}",
+            "encoding": "zlib",
+        }
+
+    def get(self, reference):
+        """Reads, decompresses and verifies the payload a reference points to."""
+        try:
+            with open(self._path(reference["blob_id"]), 'rb') as blob_file:
+                data = zlib.decompress(blob_file.read())
+        except FileNotFoundError:
+            raise ClaimCheckError(f"Blob {reference['blob_id'][:12]} not found in {self.root}")
+        except zlib.error as e:
+            raise ClaimCheckError(f"Blob {reference['blob_id'][:12]} is corrupt: {e}")
+        if len(data) != reference["size"] or f"sha256:{hashlib.sha256(data).hexdigest()}" != reference["checksum"]:
+            raise ClaimCheckError(f"Blob {reference['blob_id'][:12]} does not match its checksum")
+        return data
+
+    def delete(self, reference):
+        try:
+            os.remove(self._path(reference["blob_id"]))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _purge_expired(self):
+        with self._lock:
+            if self._last_purge is not None and time.monotonic() - self._last_purge < PURGE_INTERVAL:
+                return
+            self._last_purge = time.monotonic()
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    continue
+        if removed:
+            logger.info(f"Purged {removed} expired result blobs from {self.root}")
+
+
+_store = None
+
+
+def get_blob_store():
+    """Process-wide blob store on CLAIM_CHECK_DIR."""
+    global _store
+    if _store is None:
+        _store = BlobStore()
+    return _store
+
+
+def summarize(result):
+    """Top-level scalar fields of a result, with long strings truncated."""
+    summary = {}
+    if not isinstance(result, dict):
+        return summary
+    for name, value in result.items():
+        if len(summary) >= SUMMARY_MAX_FIELDS:
+            break
+        if isinstance(value, str):
+            summary[name] = value if len(value) <= SUMMARY_MAX_CHARS else value[:SUMMARY_MAX_CHARS] + "..."
+        elif isinstance(value, (int, float, bool)) or value is None:
+            summary[name] = value
+    return summary
+
+
+def encode_result(result, store=None, threshold=CLAIM_CHECK_THRESHOLD):
+    """
+    Serializes a result for Pub/Sub, replacing it with a reference envelope when it is large.
+
+    Returns:
+        tuple: (body bytes, attributes dict of strings).
+    """
+    data = json.dumps(result).encode('utf-8')
+    if len(data) <= threshold:
+        return data, {"claim_check": "0"}
+
+    store = store or get_blob_store()
+    try:
+        reference = store.put(data)
+    except OSError as e:
+        if len(data) > PUBSUB_MAX_MESSAGE_BYTES:
+            raise
+        logger.warning(f"Could not store {len(data)} byte result in the blob store ({e}), publishing it inline")
+        return data, {"claim_check": "0"}
+
+    envelope = {"claim_check": reference, "summary": summarize(result)}
+    logger.info(f"Stored {len(data)} byte result as blob {reference['blob_id'][:12]} ({reference['compressed_size']} bytes compressed)")
+    return json.dumps(envelope).encode('utf-8'), {"claim_check": "1", "blob_id": reference["blob_id"]}
+
+
+class LazyResult:
+    """
+    A received result. Inline results are loaded at once; claim-checked ones only on load().
+
+    Attributes:
+        summary (dict): Top-level scalar fields, available without reading the blob.
+        reference (dict): The blob reference, or None for inline results.
+    """
+
+    def __init__(self, summary, reference=None, payload=None, store=None):
+        self.summary = summary
+        self.reference = reference
+        self._payload = payload
+        self._store = store
+
+    @property
+    def is_claim_check(self):
+        return self.reference is not None
+
+    def load(self):
+        """
+        The full result, read from the blob store on first use.
+
+        Raises:
+            ClaimCheckError: If the blob is missing or corrupt.
+        """
+        if self._payload is None:
+            store = self._store or get_blob_store()
+            self._payload = json.loads(store.get(self.reference).decode('utf-8'))
+        return self._payload
+
+
+def decode_result(data, attributes=None, store=None):
+    """
+    Parses a result message, inline or claim-checked.
+
+    Raises:
+        ValueError: If the body is not JSON.
+    """
+    body = json.loads(data.decode('utf-8'))
+    claim_check = (attributes or {}).get("claim_check")
+    if claim_check == "1" or (claim_check is None and isinstance(body, dict) and isinstance(body.get("claim_check"), dict)):
+        return LazyResult(body.get("summary", {}), reference=body["claim_check"], store=store)
+    return LazyResult(summarize(body), payload=body)
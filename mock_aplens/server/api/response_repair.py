@@ -0,0 +1,135 @@
+# response_repair.py
+
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Sections the analysis prompt asks for, in the order they must appear
+REQUIRED_SECTIONS = ["Percentage", "Explanation", "Improvements", "Strengths"]
+MIN_LIST_ITEMS = 3
+
+PERCENTAGE_REGEX = re.compile(r"^\d+(?:-\d+)?%?$")
+
+SECTION_TEMPLATES = {
+    "Percentage": "### Percentage\nX% or X-Y% (e.g., 85% or 70-80%)",
+    "Explanation": "### Explanation\nOne or more sentences explaining the {pattern} implementation.",
+    "Improvements": "### Improvements\n- [Description of improvement 1]\n- [Description of improvement 2]\n- [Description of improvement 3]",
+    "Strengths": "### Strengths\n- [Description of strength 1]\n- [Description of strength 2]\n- [Description of strength 3]",
+}
+
+
+def split_sections(response_text):
+    """
+    Splits a markdown analysis response into its ### sections.
+
+    Args:
+        response_text (str): The raw markdown returned by the LLM.
+
+    Returns:
+        dict: Section name -> list of non-empty stripped lines under it.
+    """
+    sections = {}
+    current_section = None
+    for line in (response_text or "").strip().split('\n'):
+        line = line.strip()
+        if line.startswith("###"):
+            current_section = line.lstrip("#").strip()
+            sections.setdefault(current_section, [])
+        elif current_section and line:
+            sections[current_section].append(line)
+    return sections
+
+
+def find_invalid_sections(response_text):
+    """
+    Detects which required sections are missing or malformed.
+
+    Args:
+        response_text (str): The raw markdown returned by the LLM.
+
+    Returns:
+        list: Names of the sections that need to be asked for again.
+    """
+    sections = split_sections(response_text)
+    invalid = []
+    for name in REQUIRED_SECTIONS:
+        lines = sections.get(name)
+        if not lines:
+            invalid.append(name)
+        elif name == "Percentage" and not PERCENTAGE_REGEX.match(lines[0].replace(" ", "")):
+            invalid.append(name)
+        elif name in ("Improvements", "Strengths") and \
+                len([line for line in lines if line.startswith("-")]) < MIN_LIST_ITEMS:
+            invalid.append(name)
+    return invalid
+
+
+def build_repair_prompt(response_text, invalid_sections, pattern):
+    """Builds a short follow-up prompt that asks only for the broken sections."""
+    templates = "\n".join(SECTION_TEMPLATES[name].format(pattern=pattern) for name in invalid_sections)
+    return f"""Below is your previous evaluation of the {pattern} pattern. The following sections were missing or did not follow the required format: {", ".join(invalid_sections)}.
+Previous answer:
+{response_text}
+
+Reply with ONLY these sections, using ### for headers, no extra newlines, and the EXACT structure below:
+{templates}
+"""
+
+
+def merge_sections(response_text, repair_text, repaired_sections):
+    """
+    Rebuilds the markdown response, taking the repaired sections from the follow-up answer.
+
+    Args:
+        response_text (str): The original answer.
+        repair_text (str): The answer to the repair prompt.
+        repaired_sections (list): Section names that were asked for again.
+
+    Returns:
+        str: Markdown with every required section in the canonical order.
+    """
+    original = split_sections(response_text)
+    repaired = split_sections(repair_text)
+    merged_lines = []
+    for name in REQUIRED_SECTIONS:
+        lines = repaired.get(name) if name in repaired_sections and repaired.get(name) else original.get(name)
+        if lines:
+            merged_lines.append(f"### {name}")
+            merged_lines.extend(lines)
+    return "\n".join(merged_lines)
+
+
+def repair_analysis_response(model, response_text, pattern, max_attempts=1):
+    """
+    Validates an analysis response and re-asks the model only for the sections that are broken.
+
+    Instead of resending the whole multi-file prompt, the original answer is sent back as
+    context together with the list of sections that must be regenerated.
+
+    Args:
+        model: Object exposing generate_content(prompt) (a Gemini model or compatible backend).
+        response_text (str): The raw markdown returned by the LLM.
+        pattern (str): The architectural pattern being evaluated.
+        max_attempts (int): Maximum number of follow-up requests.
+
+    Returns:
+        str: The repaired response text (the original one if nothing could be fixed).
+    """
+    for attempt in range(max_attempts):
+        invalid_sections = find_invalid_sections(response_text)
+        if not invalid_sections:
+            return response_text
+
+        logger.warning(f"Response has invalid sections {invalid_sections}, requesting repair (attempt {attempt + 1}/{max_attempts})")
+        try:
+            repair_response = model.generate_content(build_repair_prompt(response_text, invalid_sections, pattern))
+            response_text = merge_sections(response_text, repair_response.text, invalid_sections)
+        except Exception as e:
+            logger.error(f"Repair request failed: {e}")
+            break
+
+    remaining = find_invalid_sections(response_text)
+    if remaining:
+        logger.warning(f"Sections still invalid after repair, defaults will be used: {remaining}")
+    return response_text
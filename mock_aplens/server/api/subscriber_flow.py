@@ -0,0 +1,308 @@
+# subscriber_flow.py
+#
+# Flow control, worker pool and metrics of the agent subscribers.
+#
+# Shared with the other services: edit mock_aplens/server/api/subscriber_flow.py and copy it to
+# archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# The analysis callbacks block for minutes on GitHub and Gemini. The client therefore only leases
+# as many messages as the worker pool can work on (SUBSCRIBER_MAX_MESSAGES defaults to
+# SUBSCRIBER_WORKERS), extends their ack deadlines in large steps while they are processed, and
+# gives up on a lease after SUBSCRIBER_MAX_LEASE_DURATION, after which Pub/Sub redelivers.
+#
+# Each priority lane has its own subscription and flow control, and the lanes share one pool of
+# SUBSCRIBER_WORKERS threads. A free worker takes the next message of the highest
+# priority lane, unless a lower lane got less than LANE_MIN_SHARE of the recent dispatches while
+# it had messages waiting, so bulk work keeps moving while interactive requests come first.
+# LANE_RESERVED_WORKERS of the threads only ever run the highest lane, so an interactive request
+# does not wait for a multi-minute bulk analysis when bulk work occupies the other workers.
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+
+from google.cloud import pubsub_v1
+from google.cloud.pubsub_v1.subscriber.scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_WORKERS = int(os.getenv('SUBSCRIBER_WORKERS', '4'))
+SUBSCRIBER_MAX_MESSAGES = int(os.getenv('SUBSCRIBER_MAX_MESSAGES', str(SUBSCRIBER_WORKERS)))
+SUBSCRIBER_MAX_BYTES = int(os.getenv('SUBSCRIBER_MAX_BYTES', str(10 * 1024 * 1024)))
+# Lease management: total time a message is kept leased, and the size of each deadline extension
+SUBSCRIBER_MAX_LEASE_DURATION = int(os.getenv('SUBSCRIBER_MAX_LEASE_DURATION', '3600'))
+SUBSCRIBER_MIN_LEASE_EXTENSION = int(os.getenv('SUBSCRIBER_MIN_LEASE_EXTENSION', '60'))
+SUBSCRIBER_MAX_LEASE_EXTENSION = int(os.getenv('SUBSCRIBER_MAX_LEASE_EXTENSION', '600'))
+SUBSCRIBER_METRICS_INTERVAL = float(os.getenv('SUBSCRIBER_METRICS_INTERVAL', '60'))
+
+# Minimum share of the workers a lower-priority lane gets while it has messages waiting
+LANE_MIN_SHARE = float(os.getenv('LANE_MIN_SHARE', '0.2'))
+# Workers kept for the highest-priority lane; the lower lanes run on the others (at least one)
+LANE_RESERVED_WORKERS = int(os.getenv('LANE_RESERVED_WORKERS', '1'))
+# Number of recent dispatches the lane shares are measured over
+LANE_SHARE_WINDOW = 50
+
+# Message IDs remembered to detect redeliveries
+SEEN_MESSAGES_WINDOW = 10000
+# Wait times (publish to processing start) kept for the percentiles
+WAIT_SAMPLES_WINDOW = 1000
+
+
+def build_flow_control():
+    """FlowControl settings of the agent subscribers, from the SUBSCRIBER_* environment variables."""
+    return pubsub_v1.types.FlowControl(
+        max_messages=SUBSCRIBER_MAX_MESSAGES,
+        max_bytes=SUBSCRIBER_MAX_BYTES,
+        max_lease_duration=SUBSCRIBER_MAX_LEASE_DURATION,
+        min_duration_per_lease_extension=SUBSCRIBER_MIN_LEASE_EXTENSION,
+        max_duration_per_lease_extension=SUBSCRIBER_MAX_LEASE_EXTENSION,
+    )
+
+
+class SubscriberMetrics:
+    """
+    Counts what happens to the messages of one subscriber.
+
+    Gauges: leased (held by the client, queued or in progress), queued and in_progress.
+    Counters: received, completed, failed, redelivered (a message ID seen before) and
+    lease_expired (processing outlived the maximum lease, so Pub/Sub will redeliver).
+    wait_p50 and wait_p95: seconds from publishing to the start of processing.
+    """
+
+    def __init__(self, name, max_lease_duration=SUBSCRIBER_MAX_LEASE_DURATION):
+        self.name = name
+        self.max_lease_duration = max_lease_duration
+        self._counts = {}
+        self._gauges = {"queued": 0, "in_progress": 0}
+        self._seen = OrderedDict()
+        self._waits = deque(maxlen=WAIT_SAMPLES_WINDOW)
+        self._lock = threading.Lock()
+        self._reporter = None
+
+    def _increment(self, name, amount=1):
+        self._counts[name] = self._counts.get(name, 0) + amount
+
+    def queued(self, message):
+        with self._lock:
+            self._increment("received")
+            self._gauges["queued"] += 1
+            if message.message_id in self._seen:
+                self._increment("redelivered")
+            self._seen[message.message_id] = True
+            if len(self._seen) > SEEN_MESSAGES_WINDOW:
+                self._seen.popitem(last=False)
+
+    def wrap(self, callback):
+        """Wraps a subscriber callback to track in-progress messages, failures and lease expiry."""
+        def metered_callback(message):
+            publish_time = getattr(message, "publish_time", None)
+            with self._lock:
+                self._gauges["queued"] -= 1
+                self._gauges["in_progress"] += 1
+                if publish_time is not None:
+                    self._waits.append(max(0.0, time.time() - publish_time.timestamp()))
+            started = time.monotonic()
+            try:
+                callback(message)
+                outcome = "completed"
+            except Exception:
+                outcome = "failed"
+                raise
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._gauges["in_progress"] -= 1
+                    self._increment(outcome)
+                    if elapsed > self.max_lease_duration:
+                        self._increment("lease_expired")
+                if elapsed > self.max_lease_duration:
+                    logger.warning(
+                        f"Message {message.message_id} took {elapsed:.0f}s, longer than the "
+                        f"{self.max_lease_duration}s maximum lease; it will be redelivered"
+                    )
+        return metered_callback
+
+    def snapshot(self):
+        with self._lock:
+            gauges = dict(self._gauges)
+            gauges["leased"] = gauges["queued"] + gauges["in_progress"]
+            waits = sorted(self._waits)
+        if waits:
+            gauges["wait_p50"] = round(waits[len(waits) // 2], 3)
+            gauges["wait_p95"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3)
+        return {**self._counts, **gauges}
+
+    def start_reporting(self, interval=SUBSCRIBER_METRICS_INTERVAL):
+        """Logs a snapshot every `interval` seconds from a daemon thread."""
+        if self._reporter is not None or interval <= 0:
+            return
+
+        def report():
+            while True:
+                time.sleep(interval)
+                logger.info(f"{self.name} subscriber metrics: {self.snapshot()}")
+
+        self._reporter = threading.Thread(target=report, name=f"{self.name}-metrics", daemon=True)
+        self._reporter.start()
+
+
+# --- Priority lanes ---
+
+class LaneScheduler(Scheduler):
+    """
+    Scheduler of one lane of a LanePool, given to that lane's streaming pull.
+
+    Scheduled callbacks wait in the pool until a worker takes them; shutdown() hands the
+    messages still waiting back to the streaming pull, which returns them to Pub/Sub.
+    """
+
+    def __init__(self, pool, lane):
+        self.pool = pool
+        self.lane = lane
+        # The client library's dispatcher reads the requests of the callbacks from this queue
+        self._queue = queue.Queue()
+
+    @property
+    def queue(self):
+        return self._queue
+
+    def schedule(self, callback, *args, **kwargs):
+        if args:
+            self.pool.metrics[self.lane].queued(args[0])
+        self.pool.submit(self.lane, callback, args, kwargs)
+
+    def shutdown(self, await_msg_callbacks=False):
+        return self.pool.stop_lane(self.lane, await_msg_callbacks)
+
+
+class LanePool:
+    """
+    Worker threads shared by the priority lanes of a subscriber.
+
+    Args:
+        metrics (dict): SubscriberMetrics per lane, highest priority first.
+        workers (int): Number of threads.
+        min_share (float): Minimum share of the recent dispatches of each lower lane with
+                           messages waiting.
+        reserved (int): Workers that only run the highest-priority lane. Capped so that the
+                        lower lanes keep at least one worker.
+        name (str): Prefix of the thread names.
+    """
+
+    def __init__(self, metrics, workers=SUBSCRIBER_WORKERS, min_share=LANE_MIN_SHARE, reserved=LANE_RESERVED_WORKERS,
+                 name="subscriber"):
+        self.metrics = metrics
+        self.lanes = list(metrics)
+        self.schedulers = {lane: LaneScheduler(self, lane) for lane in self.lanes}
+        self.min_share = min_share
+        # Lower lanes together never run on more than this many workers at once
+        self.lower_lane_workers = max(1, workers - max(0, reserved))
+        self._running = {lane: 0 for lane in self.lanes}
+        # (callback, args, kwargs) waiting per lane, and the lanes whose pull has stopped
+        self._waiting = {lane: deque() for lane in self.lanes}
+        self._stopped_lanes = set()
+        self._recent = deque(maxlen=LANE_SHARE_WINDOW)
+        self._condition = threading.Condition()
+        self._stopped = False
+        # Not daemons, so in-progress analyses are not cut off when the main thread returns
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-worker-{index}") for index in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, lane, callback, args, kwargs):
+        with self._condition:
+            self._waiting[lane].append((callback, args, kwargs))
+            self._condition.notify()
+
+    def stop_lane(self, lane, wait):
+        """
+        Drops the callbacks still waiting in a lane; the workers stop once every lane is stopped.
+
+        Returns:
+            list: The messages of the dropped callbacks.
+        """
+        with self._condition:
+            dropped = [args[0] for _, args, _ in self._waiting[lane] if args]
+            self._waiting[lane].clear()
+            self._stopped_lanes.add(lane)
+            if len(self._stopped_lanes) == len(self.lanes):
+                self._stopped = True
+                self._condition.notify_all()
+        if wait and self._stopped and threading.current_thread() not in self._threads:
+            for thread in self._threads:
+                thread.join()
+        return dropped
+
+    def _next_lane(self):
+        """The lane to take a message from, or None if none is waiting. Called with the condition held."""
+        lower_lanes_full = sum(self._running[lane] for lane in self.lanes[1:]) >= self.lower_lane_workers
+        ready = [
+            lane for index, lane in enumerate(self.lanes)
+            if self._waiting[lane] and not (index > 0 and lower_lanes_full)
+        ]
+        if not ready:
+            return None
+        for lane in ready[1:]:
+            if self._recent.count(lane) < self.min_share * len(self._recent):
+                return lane
+        return ready[0]
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._stopped:
+                        return
+                    lane = self._next_lane()
+                    if lane is not None:
+                        callback, args, kwargs = self._waiting[lane].popleft()
+                        self._recent.append(lane)
+                        self._running[lane] += 1
+                        break
+                    self._condition.wait()
+            try:
+                callback(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"Unhandled error in {lane} lane callback: {e}")
+            finally:
+                with self._condition:
+                    self._running[lane] -= 1
+                    # A lower lane may have been waiting for this worker
+                    self._condition.notify()
+
+
+def subscribe_lanes(subscriber_client, subscription_paths, callback, metrics, name="subscriber"):
+    """
+    Starts one streaming pull per priority lane, all running their callbacks on one LanePool.
+
+    Args:
+        subscriber_client (Transport): Transport (or Pub/Sub subscriber client) to pull with.
+        subscription_paths (dict): Full subscription path per lane, highest priority first.
+        callback (callable): Message handler; it acks or leaves the message for redelivery.
+        metrics (dict): SubscriberMetrics per lane, in the same order.
+        name (str): Name of the subscriber, for the worker thread names.
+
+    Returns:
+        dict: The running StreamingPullFuture per lane.
+    """
+    logger.info(
+        f"Subscribing to {', '.join(subscription_paths.values())} with {SUBSCRIBER_WORKERS} shared workers, "
+        f"up to {SUBSCRIBER_MAX_MESSAGES} leased messages per lane, a {LANE_MIN_SHARE:.0%} minimum share per lower lane "
+        f"and {LANE_RESERVED_WORKERS} workers reserved for the first lane"
+    )
+    pool = LanePool(metrics, name=name)
+    streaming_pull_futures = {}
+    for lane, subscription_path in subscription_paths.items():
+        metrics[lane].start_reporting()
+        streaming_pull_futures[lane] = subscriber_client.subscribe(
+            subscription_path,
+            callback=metrics[lane].wrap(callback),
+            flow_control=build_flow_control(),
+            scheduler=pool.schedulers[lane],
+        )
+    return streaming_pull_futures
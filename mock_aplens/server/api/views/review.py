@@ -2,9 +2,10 @@
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
-import google.generativeai as genai
 import uuid
 from ..github_retrieval import get_github_artifacts
+from ..response_repair import repair_analysis_response
+from ..llm_backend import get_model
 from datetime import datetime
 import re
 
@@ -24,8 +25,7 @@ class ReviewView(APIView):
             print(f"Error retrieving Gemini key: {e}")
             return Response({"message": f"Error: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        genai.configure(api_key=gemini_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = get_model(api_key=gemini_key, priority="interactive")
 
         if not repo_url:
             return Response({"message": "Repo URL required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -76,7 +76,8 @@ Do NOT add extra newlines or deviate from this format.
             try:
                 response = model.generate_content(prompt)
                 print(f"Batch {i//batch_size + 1} response:\n{response.text}")
-                lines = response.text.split('\n')
+                response_text = repair_analysis_response(model, response.text, pattern)
+                lines = response_text.split('\n')
                 
                 # Defaults
                 percentage = "0%"
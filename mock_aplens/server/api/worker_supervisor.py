@@ -0,0 +1,180 @@
+# worker_supervisor.py
+#
+# Multi-process mode of the agent subscribers.
+#
+# Shared with the other services: edit mock_aplens/server/api/worker_supervisor.py and copy it to
+# archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# The callbacks of one subscriber process share its GIL, so CPU work (decoding large payloads,
+# assembling prompts, serializing results) does not scale with SUBSCRIBER_WORKERS. With
+# SUBSCRIBER_PROCESSES > 1 the subscriber script starts a supervisor instead, which runs that many
+# worker processes against the same subscription. Pub/Sub spreads the messages over their
+# streaming pulls, and each process applies its own flow control (SUBSCRIBER_MAX_MESSAGES is per
+# process). Crashed workers are restarted with a backoff; SIGTERM or SIGINT stops the workers once
+# their in-progress messages are done.
+
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_PROCESSES = int(os.getenv('SUBSCRIBER_PROCESSES', '1'))
+# Seconds a stopping worker waits for its in-progress messages before exiting
+SUBSCRIBER_SHUTDOWN_GRACE = float(os.getenv('SUBSCRIBER_SHUTDOWN_GRACE', '60'))
+# Restart delay of a crashed worker, doubled for each crash in a row up to the maximum
+WORKER_RESTART_BACKOFF_BASE = float(os.getenv('WORKER_RESTART_BACKOFF_BASE', '1'))
+WORKER_RESTART_BACKOFF_MAX = float(os.getenv('WORKER_RESTART_BACKOFF_MAX', '60'))
+# A worker that ran at least this long before exiting starts over from the base backoff
+WORKER_STABLE_AFTER = 60.0
+SUPERVISOR_POLL_INTERVAL = 1.0
+
+
+def install_stop_handlers():
+    """Returns an Event that is set on SIGTERM or SIGINT."""
+    stop = threading.Event()
+
+    def handle(signum, frame):
+        logger.info(f"Received {signal.Signals(signum).name} in process {os.getpid()}, stopping")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+    return stop
+
+
+def run_until_stopped(streaming_pull_futures, metrics, grace=SUBSCRIBER_SHUTDOWN_GRACE):
+    """
+    Blocks while the streaming pulls run, and stops them gracefully on SIGTERM or SIGINT.
+
+    The pulls are cancelled first, so no new messages are leased and the queued ones go back to
+    Pub/Sub. The in-progress callbacks then get up to `grace` seconds to finish and ack; if some
+    are still running after that, the process exits anyway and Pub/Sub redelivers them.
+
+    Args:
+        streaming_pull_futures (list): The running StreamingPullFutures (one per priority lane).
+        metrics (list): SubscriberMetrics of the pulls, to see what is in progress.
+        grace (float): Seconds to wait for in-progress messages.
+
+    Raises:
+        Exception: The error that ended a pull, if one stopped on its own.
+    """
+    stop = install_stop_handlers()
+    while not stop.is_set() and not any(future.done() for future in streaming_pull_futures):
+        stop.wait(SUPERVISOR_POLL_INTERVAL)
+    if not stop.is_set():
+        for future in streaming_pull_futures:
+            if not future.done():
+                future.cancel()
+        for future in streaming_pull_futures:
+            future.result()
+        return
+
+    deadline = time.monotonic() + grace
+    for future in streaming_pull_futures:
+        future.cancel()
+    for future in streaming_pull_futures:
+        try:
+            future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except Exception:
+            pass
+
+    def in_progress():
+        return sum(lane_metrics.snapshot()["in_progress"] for lane_metrics in metrics)
+
+    while in_progress() > 0 and time.monotonic() < deadline:
+        time.sleep(0.5)
+
+    remaining = in_progress()
+    if remaining:
+        logger.warning(f"{remaining} messages still in progress after {grace:.0f}s, exiting; they will be redelivered")
+        logging.shutdown()
+        # The worker threads are not daemons, a normal exit would wait for them
+        os._exit(1)
+    logger.info(f"{', '.join(lane_metrics.name for lane_metrics in metrics)} stopped, no message in progress")
+
+
+class WorkerSupervisor:
+    """
+    Runs `processes` copies of a subscriber worker and keeps them running.
+
+    Workers are started with the "spawn" method, so each one imports the subscriber module and
+    creates its own gRPC clients rather than inheriting the supervisor's.
+    """
+
+    def __init__(self, name, target, processes=SUBSCRIBER_PROCESSES, grace=SUBSCRIBER_SHUTDOWN_GRACE):
+        self.name = name
+        self.target = target
+        self.processes = processes
+        self.grace = grace
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = {}
+        self.started_at = {}
+        self.crashes = {}
+        self.restart_at = {}
+        self.restarts = 0
+
+    def _start(self, slot):
+        process = self.context.Process(target=self.target, name=f"{self.name}-worker-{slot}")
+        process.start()
+        self.workers[slot] = process
+        self.started_at[slot] = time.monotonic()
+        logger.info(f"Started {process.name} (pid {process.pid})")
+
+    def _check(self):
+        """Restarts the workers that exited, once their backoff has passed."""
+        now = time.monotonic()
+        for slot, process in list(self.workers.items()):
+            if process is None:
+                if now >= self.restart_at[slot]:
+                    self.restarts += 1
+                    self._start(slot)
+                continue
+            if process.is_alive():
+                continue
+
+            if now - self.started_at[slot] >= WORKER_STABLE_AFTER:
+                self.crashes[slot] = 0
+            self.crashes[slot] = self.crashes.get(slot, 0) + 1
+            delay = min(WORKER_RESTART_BACKOFF_BASE * 2 ** (self.crashes[slot] - 1), WORKER_RESTART_BACKOFF_MAX)
+            logger.error(
+                f"{process.name} (pid {process.pid}) exited with code {process.exitcode} after "
+                f"{now - self.started_at[slot]:.0f}s, restarting in {delay:.1f}s"
+            )
+            process.close()
+            self.workers[slot] = None
+            self.restart_at[slot] = now + delay
+
+    def _stop_all(self):
+        """Sends SIGTERM to every worker and kills those still running after the grace period."""
+        running = [process for process in self.workers.values() if process is not None and process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + self.grace + 5
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"{process.name} (pid {process.pid}) did not stop in time, killing it")
+                process.kill()
+                process.join()
+        logger.info(f"All {self.name} workers stopped ({self.restarts} restarts)")
+
+    def run(self):
+        """Starts the workers and supervises them until SIGTERM or SIGINT."""
+        if not (os.getenv('IDEMPOTENCY_REDIS_URL') or os.getenv('REDIS_URL')):
+            logger.warning(
+                "No Redis configured: duplicate suppression and failure counts are kept per worker process"
+            )
+        logger.info(f"Starting {self.processes} {self.name} worker processes")
+        stop = install_stop_handlers()
+        for slot in range(self.processes):
+            self._start(slot)
+        try:
+            while not stop.is_set():
+                self._check()
+                stop.wait(SUPERVISOR_POLL_INTERVAL)
+        finally:
+            self._stop_all()
@@ -0,0 +1,120 @@
+import os
+import re
+import logging
+
+from .routing import (
+    GITHUB_URL_REGEX,
+    GITHUB_TOKEN_REGEX,
+    DISCOVERY_INTENT_REGEX,
+    EVALUATION_INTENT_REGEX,
+    PATTERN_EVALUATION_AGENT,
+    ARCHIDETECT_AGENT,
+    extract_repo_info,
+    extract_architectures,
+    extract_analysis_type,
+)
+
+logger = logging.getLogger(__name__)
+
+# Seconds a composite request waits for all its parts before the partial report is returned
+COMPOSITE_DEADLINE = int(os.getenv('COMPOSITE_DEADLINE', '900'))
+# Patterns evaluated alongside discovery when the request does not name any
+COMPOSITE_DEFAULT_PATTERNS = [
+    p.strip() for p in os.getenv('COMPOSITE_DEFAULT_PATTERNS', 'mvc,layered,microservice,event-driven').split(',') if p.strip()
+]
+
+# "how well is each implemented", "evaluate each of them", "score every pattern"
+EACH_PATTERN_REGEX = re.compile(r'\b(each|every)\b', re.IGNORECASE)
+
+
+def plan_composite(user_input):
+    """
+    Splits a request that needs both agents into independent subtasks.
+
+    A request is composite when it references one repository and asks both which patterns it
+    uses and how well they are implemented. ArchiDetect discovers the architecture while the
+    Pattern Evaluation Agent scores the named patterns (or COMPOSITE_DEFAULT_PATTERNS) at the
+    same time, so the total latency is that of the slowest agent.
+
+    Args:
+        user_input (str): The raw user request.
+
+    Returns:
+        list: Routing decisions (same structure as fast_route), or None if the request is not composite.
+    """
+    urls = set(url.rstrip('.') for url in GITHUB_URL_REGEX.findall(user_input or ""))
+    if len(urls) != 1:
+        return None
+    wants_discovery = bool(DISCOVERY_INTENT_REGEX.search(user_input))
+    wants_evaluation = bool(EVALUATION_INTENT_REGEX.search(user_input)) or bool(EACH_PATTERN_REGEX.search(user_input))
+    if not (wants_discovery and wants_evaluation):
+        return None
+
+    repo_info = extract_repo_info(user_input)
+    token_match = GITHUB_TOKEN_REGEX.search(user_input)
+    token_suffix = f', "{token_match.group(1)}"' if token_match else ""
+    analysis_type = extract_analysis_type(user_input)
+
+    plan = [{
+        "selected_agent": ARCHIDETECT_AGENT,
+        "reason": "Discovers which architectural patterns the repository uses.",
+        "missing_information": "None",
+        "message_to_agent": f"Please analyze the {analysis_type} of this repo: {repo_info['repo_url']}{token_suffix}",
+        "extracted_information": {**repo_info, "analysis_type": analysis_type},
+    }]
+    for architecture in extract_architectures(user_input) or COMPOSITE_DEFAULT_PATTERNS:
+        plan.append({
+            "selected_agent": PATTERN_EVALUATION_AGENT,
+            "reason": f"Evaluates how well the {architecture} pattern is implemented.",
+            "missing_information": "None",
+            "message_to_agent": f"Evaluate the {architecture} architectural pattern of {repo_info['repo_url']}{token_suffix}",
+            "extracted_information": {**repo_info, "architecture": architecture},
+        })
+    return plan
+
+
+def _percentage_value(percentage):
+    match = re.match(r"(\d+(?:\.\d+)?)(?:-(\d+(?:\.\d+)?))?", str(percentage or ""))
+    if not match:
+        return None
+    low = float(match.group(1))
+    high = float(match.group(2)) if match.group(2) else low
+    return (low + high) / 2
+
+
+def merge_composite_report(parts):
+    """
+    Merges the parts of a composite request into one report.
+
+    Args:
+        parts (list): Dicts with "agent", "pattern", "analysis_type", "status" and, for
+                      completed parts, "result".
+
+    Returns:
+        dict: {"architecture": ArchiDetect result or None, "pattern_evaluations": scored patterns,
+               best first, "missing_parts": descriptions of the parts without a result}.
+    """
+    architecture = None
+    evaluations = []
+    missing = []
+    for part in parts:
+        if part["status"] != "completed":
+            missing.append(part.get("pattern") or part.get("analysis_type") or part["agent"])
+            continue
+        result = part["result"]
+        if part["agent"] == ARCHIDETECT_AGENT:
+            architecture = result
+        else:
+            evaluations.append({
+                "pattern": part.get("pattern") or result.get("pattern"),
+                "percentage": result.get("percentage"),
+                "explanation": result.get("explanation"),
+                "strengths": result.get("strengths", []),
+                "improvements": result.get("improvements", []),
+            })
+    evaluations.sort(key=lambda evaluation: _percentage_value(evaluation["percentage"]) or 0, reverse=True)
+    return {
+        "architecture": architecture,
+        "pattern_evaluations": evaluations,
+        "missing_parts": missing,
+    }
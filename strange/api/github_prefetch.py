@@ -0,0 +1,149 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .llm_backend import CallCounters
+from .routing import (
+    GITHUB_TOKEN_REGEX,
+    PATTERN_EVALUATION_AGENT,
+    ARCHIDETECT_AGENT,
+    extract_repo_info,
+)
+from .github_cache import (
+    ARTIFACTS_REF,
+    DEFAULT_BRANCH,
+    FetchCancelled,
+    artifacts_resource,
+    fetch_all_commits,
+    fetch_github_artifacts,
+    get_github_cache,
+    repo_id,
+)
+
+logger = logging.getLogger(__name__)
+
+GITHUB_PREFETCH_ENABLED = os.getenv('GITHUB_PREFETCH_ENABLED', 'true').lower() == 'true'
+GITHUB_PREFETCH_WORKERS = int(os.getenv('GITHUB_PREFETCH_WORKERS', '4'))
+# Prefetch tasks queued or running at once, further requests are not prefetched
+GITHUB_PREFETCH_MAX_PENDING = int(os.getenv('GITHUB_PREFETCH_MAX_PENDING', '16'))
+
+# Which prefetched resources each agent reads
+AGENT_RESOURCES = {
+    PATTERN_EVALUATION_AGENT: {"artifacts"},
+    ARCHIDETECT_AGENT: {"commits"},
+}
+
+
+class PrefetchJob:
+    """Prefetch tasks started for one request, cancellable per resource."""
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.tasks = {}
+
+    def add(self, resource, future, cancel_event):
+        self.tasks[resource] = (future, cancel_event)
+
+    def cancel(self, resources=None):
+        """Cancels the given resources (all by default). Queued tasks never start, running ones stop at the next page or file."""
+        for resource, (future, cancel_event) in self.tasks.items():
+            if resources is None or resource in resources:
+                cancel_event.set()
+                future.cancel()
+
+    def retain(self, parsed_response):
+        """Keeps only what the routed agent will read, or cancels everything if nothing is dispatched."""
+        missing = parsed_response.get("missing_information")
+        needed = AGENT_RESOURCES.get(parsed_response.get("selected_agent"), set())
+        if missing and missing.lower() != "none":
+            needed = set()
+        self.cancel(set(self.tasks) - needed)
+
+
+class GitHubPrefetcher:
+    """
+    Warms the shared GitHub cache for a repository while the request is being routed.
+
+    Both agents' resources are started as soon as a URL is seen, and the one the routed
+    agent does not need is cancelled once the routing decision is known. Work is bounded
+    by a small executor and a cap on pending tasks.
+    """
+
+    def __init__(self, cache=None, workers=GITHUB_PREFETCH_WORKERS, max_pending=GITHUB_PREFETCH_MAX_PENDING):
+        self.cache = cache
+        self.counters = CallCounters()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="github-prefetch")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def prefetch(self, user_input):
+        """
+        Starts prefetching the repository referenced by the user input.
+
+        Returns:
+            PrefetchJob: The started tasks, or None if the input has no GitHub URL.
+        """
+        repo_info = extract_repo_info(user_input)
+        if not repo_info:
+            return None
+        token_match = GITHUB_TOKEN_REGEX.search(user_input)
+        token = token_match.group(1) if token_match else None
+        owner, name = repo_info["repo_owner"], repo_info["repo_name"]
+
+        job = PrefetchJob(repo_id(owner, name))
+        self._submit(job, "artifacts", ARTIFACTS_REF, artifacts_resource(token),
+                     lambda cancel_event: fetch_github_artifacts(repo_info["repo_url"], token, cancel_event))
+        self._submit(job, "commits", DEFAULT_BRANCH, "commits",
+                     lambda cancel_event: fetch_all_commits(owner, name, DEFAULT_BRANCH, cancel_event))
+        return job
+
+    def _submit(self, job, name, ref, resource, fetch):
+        cache = self.cache or get_github_cache()
+        if cache.get(job.repo, ref, resource) is not None or cache.is_inflight(job.repo, ref, resource):
+            self.counters.increment("already_cached")
+            return
+        if not self._slots.acquire(blocking=False):
+            self.counters.increment("rejected")
+            return
+
+        cancel_event = threading.Event()
+
+        def run():
+            try:
+                if cancel_event.is_set() or not cache.claim(job.repo, ref, resource):
+                    return
+                try:
+                    value, cacheable = fetch(cancel_event)
+                    if cacheable:
+                        cache.set(job.repo, ref, resource, value)
+                        self.counters.increment("completed")
+                except FetchCancelled:
+                    self.counters.increment("cancelled")
+                    logger.info(f"Prefetch of {job.repo} {name} cancelled")
+                except Exception as e:
+                    self.counters.increment("failed")
+                    logger.warning(f"Prefetch of {job.repo} {name} failed: {e}")
+                finally:
+                    cache.release(job.repo, ref, resource)
+            finally:
+                self._slots.release()
+
+        future = self._executor.submit(run)
+        # A task cancelled before it started never runs, so its slot is released here
+        future.add_done_callback(lambda f: self._slots.release() if f.cancelled() else None)
+        self.counters.increment("started")
+        job.add(name, future, cancel_event)
+
+
+GITHUB_PREFETCHER = GitHubPrefetcher() if GITHUB_PREFETCH_ENABLED else None
+
+
+def start_prefetch(user_input):
+    """Starts the speculative prefetch for a request if it is enabled."""
+    if GITHUB_PREFETCHER is None:
+        return None
+    try:
+        return GITHUB_PREFETCHER.prefetch(user_input)
+    except Exception as e:
+        logger.warning(f"Could not start GitHub prefetch: {e}")
+        return None
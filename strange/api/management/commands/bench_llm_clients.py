@@ -0,0 +1,60 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+
+from api.llm_backend import get_backend, get_model, LLM_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Only needed with --backend gemini
+API_KEY = os.getenv('GEMINI_API_KEY')
+BENCH_PROMPT = "SELECTED_AGENT benchmark request for https://github.com/user/repo"
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class Command(BaseCommand):
+    help = 'Compares building an LLM client per request against the pooled process-wide clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests per mode')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent request threads')
+        parser.add_argument('--backend', default=LLM_BACKEND, help='"gemini" or "fake" (set LLM_FAKE_* to shape latency)')
+
+    def run_mode(self, label, make_model, requests, threads):
+        latencies = []
+
+        def one_request(_):
+            started = time.perf_counter()
+            make_model().generate_content(BENCH_PROMPT)
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(one_request, range(requests)))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{label:<12} {requests / elapsed:8.1f} req/s   "
+            f"p50 {percentile(latencies, 50) * 1000:7.1f} ms   p95 {percentile(latencies, 95) * 1000:7.1f} ms   "
+            f"p99 {percentile(latencies, 99) * 1000:7.1f} ms"
+        )
+
+    def handle(self, *args, **options):
+        backend = options['backend']
+        requests = options['requests']
+        threads = options['threads']
+        if backend == "gemini" and not API_KEY:
+            raise CommandError("Set GEMINI_API_KEY to benchmark the gemini backend")
+        self.stdout.write(f"Backend: {backend}, {requests} requests, {threads} threads")
+
+        # What ReviewView.post used to do: configure and build a new client on every request. Only the raw
+        # client, a resilient wrapper per request would also leave a thread pool behind each time
+        self.run_mode("per-request", lambda: get_backend(API_KEY, backend=backend, resilient=False), requests, threads)
+        # One lazily built client per process, shared by every thread
+        self.run_mode("pooled", lambda: get_model(API_KEY, backend=backend), requests, threads)
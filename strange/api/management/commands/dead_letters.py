@@ -0,0 +1,164 @@
+import os
+import json
+import base64
+import logging
+from django.core.management.base import BaseCommand, CommandError
+from api.transport import get_transport
+
+logger = logging.getLogger(__name__)
+
+# --- Pub/Sub Configuration ---
+DEAD_LETTER_TOPIC_ID = os.getenv('DEAD_LETTER_TOPIC_ID', 'agent-dead-letters')
+DEAD_LETTER_SUBSCRIPTION_ID = os.getenv('DEAD_LETTER_SUBSCRIPTION_ID', 'agent-dead-letters-admin')
+
+# Request topic of each agent, used when the dead letter's subscription no longer exists
+SOURCE_TOPICS = {
+    "aplens": "strange-aplens-sub",
+    "archidetect": "strange-archidetect-sub",
+}
+
+PULL_BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = 'Lists or replays the agent jobs that were moved to the dead-letter topic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['list', 'replay'])
+        parser.add_argument('--source', choices=sorted(SOURCE_TOPICS), help='Only dead letters of this agent')
+        parser.add_argument('--classification', choices=['transient', 'permanent'], help='Only dead letters of this failure class')
+        parser.add_argument('--repo', help='Only dead letters of this repository (owner/name)')
+        parser.add_argument('--limit', type=int, default=100, help='Maximum number of dead letters to handle')
+        parser.add_argument('--dry-run', action='store_true', help='With replay, show what would be replayed without publishing')
+
+    def handle(self, *args, **options):
+        self.transport = get_transport()
+        self.topic_cache = {}
+        subscription_path = self.transport.subscription_path(DEAD_LETTER_SUBSCRIPTION_ID)
+        self.ensure_subscription(subscription_path)
+
+        selected = self.pull_matching(subscription_path, options)
+        skipped = []
+        try:
+            if options['action'] == 'list' or options['dry_run']:
+                for ack_id, dead_letter in selected:
+                    self.print_dead_letter(dead_letter)
+                self.stdout.write(f"{len(selected)} dead letters matched")
+                # Inspecting does not consume them
+                skipped.extend(ack_id for ack_id, _ in selected)
+            else:
+                replayed = self.replay(subscription_path, selected, skipped)
+                self.stdout.write(self.style.SUCCESS(f"Replayed {replayed} of {len(selected)} dead letters"))
+        finally:
+            self.release(subscription_path, skipped)
+
+    def ensure_subscription(self, subscription_path):
+        if self.transport.subscription_topic(subscription_path) is not None:
+            return
+        self.transport.ensure_topic(DEAD_LETTER_TOPIC_ID)
+        if not self.transport.ensure_subscription(DEAD_LETTER_TOPIC_ID, DEAD_LETTER_SUBSCRIPTION_ID):
+            raise CommandError(f"Could not create the dead-letter subscription {subscription_path}")
+        self.stdout.write(f"Created {subscription_path}")
+
+    def pull_matching(self, subscription_path, options):
+        """
+        Pulls dead letters until `limit` of them match the filters or no new ones are delivered.
+
+        The others are released after each pull, so they are not held for the whole run; as they
+        can then be delivered again, each message is only considered once per run.
+
+        Returns:
+            list: [(ack_id, dead letter dict)] matching.
+        """
+        selected, seen = [], set()
+        while len(selected) < options['limit']:
+            received_messages = self.transport.pull(subscription_path, PULL_BATCH_SIZE, timeout=10)
+            if not received_messages:
+                break
+            skipped, new = [], 0
+            for received in received_messages:
+                message_id = received.message.message_id
+                if message_id in seen:
+                    skipped.append(received.ack_id)
+                    continue
+                seen.add(message_id)
+                new += 1
+                try:
+                    dead_letter = json.loads(received.message.data.decode('utf-8'))
+                except (UnicodeDecodeError, json.JSONDecodeError) as e:
+                    logger.warning(f"Unreadable dead letter {message_id}: {e}")
+                    skipped.append(received.ack_id)
+                    continue
+                if len(selected) < options['limit'] and self.matches(dead_letter, options):
+                    selected.append((received.ack_id, dead_letter))
+                else:
+                    skipped.append(received.ack_id)
+            self.release(subscription_path, skipped)
+            if not new:
+                # Only dead letters already looked at in this run are left
+                break
+        return selected
+
+    def matches(self, dead_letter, options):
+        if options['source'] and dead_letter.get("source") != options['source']:
+            return False
+        if options['classification'] and dead_letter.get("classification") != options['classification']:
+            return False
+        if options['repo'] and dead_letter.get("attributes", {}).get("repo") != options['repo'].lower():
+            return False
+        return True
+
+    def print_dead_letter(self, dead_letter):
+        attributes = dead_letter.get("attributes", {})
+        self.stdout.write(
+            f"{dead_letter.get('message_id')}  {dead_letter.get('source')}  "
+            f"{attributes.get('message_type', 'legacy')}  {attributes.get('repo', '-')}  "
+            f"{dead_letter.get('classification')} after {dead_letter.get('attempts')} attempts  "
+            f"at {dead_letter.get('dead_lettered_at')}"
+        )
+        self.stdout.write(f"    last error: {dead_letter.get('last_error')}")
+
+    def source_topic(self, dead_letter):
+        topic_cache = self.topic_cache
+        subscription = dead_letter.get("subscription")
+        if subscription and subscription not in topic_cache:
+            topic_cache[subscription] = self.transport.subscription_topic(subscription)
+        topic = topic_cache.get(subscription)
+        if topic:
+            return topic
+        topic_id = SOURCE_TOPICS.get(dead_letter.get("source"))
+        return self.transport.topic_path(topic_id) if topic_id else None
+
+    def replay(self, subscription_path, selected, skipped):
+        """Republishes the original messages to their topics and acks the dead letters that were replayed."""
+        pending = []
+        for ack_id, dead_letter in selected:
+            topic_path = self.source_topic(dead_letter)
+            if topic_path is None:
+                self.stderr.write(f"No source topic for dead letter {dead_letter.get('message_id')}, keeping it")
+                skipped.append(ack_id)
+                continue
+            attributes = {**dead_letter.get("attributes", {}), "replay_of": str(dead_letter.get("message_id"))}
+            future = self.transport.publish(topic_path, base64.b64decode(dead_letter["data"]), **attributes)
+            pending.append((ack_id, dead_letter, future))
+
+        replayed = []
+        for ack_id, dead_letter, future in pending:
+            try:
+                future.result(timeout=30)
+                replayed.append(ack_id)
+                self.stdout.write(f"Replayed {dead_letter.get('message_id')} ({dead_letter.get('source')})")
+            except Exception as e:
+                self.stderr.write(f"Could not replay {dead_letter.get('message_id')}: {e}")
+                skipped.append(ack_id)
+
+        self.transport.acknowledge(subscription_path, replayed)
+        return len(replayed)
+
+    def release(self, subscription_path, ack_ids):
+        """Makes the dead letters that were pulled but not replayed immediately available again."""
+        for start in range(0, len(ack_ids), PULL_BATCH_SIZE):
+            try:
+                self.transport.release(subscription_path, ack_ids[start:start + PULL_BATCH_SIZE])
+            except Exception as e:
+                raise CommandError(f"Could not release dead letters, they reappear after the ack deadline: {e}")
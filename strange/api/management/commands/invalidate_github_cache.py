@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.github_cache import invalidate_repo
+
+
+class Command(BaseCommand):
+    help = 'Drops every cached GitHub resource of a repository from the shared cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('repo', help='Repository as owner/name or GitHub URL')
+
+    def handle(self, *args, **options):
+        parts = options['repo'].rstrip('/').split('/')
+        if len(parts) < 2:
+            raise CommandError('Expected owner/name or a GitHub repository URL')
+        removed = invalidate_repo(parts[-2], parts[-1])
+        self.stdout.write(f"Removed {removed} cached entries of {parts[-2]}/{parts[-1]}")
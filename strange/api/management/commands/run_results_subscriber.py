@@ -1,123 +1,148 @@
 import os
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from django.core.management.base import BaseCommand
 from google.cloud import pubsub_v1
-from google.api_core import exceptions
+from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+
+from api.claim_check import decode_result
+from api.result_store import ResultWriter, build_result_row
+from api.transport import get_transport
 
 # Configure logging (can use Django's logging setup)
 logger = logging.getLogger(__name__)
 
 # --- Pub/Sub Configuration ---
-PROJECT_ID = os.getenv('PUBSUB_PROJECT_ID', 'my-local-emulator-project')
-ARCHI_RESULTS_TOPIC_ID = 'archi-analysis-results'
-STRANGE_RESULTS_SUBSCRIPTION_ID = 'archi-analysis-results-strange-sub'
+# Result topic of every agent. Override with RESULT_TOPICS (same JSON shape) to add an agent;
+# agents without a handler in RESULT_HANDLERS are stored with the generic one.
+DEFAULT_RESULT_TOPICS = {
+    "aplens": {"topic": "analysis-results-aplens", "max_messages": 50},
+    "archidetect": {"topic": "archi-analysis-results", "max_messages": 50},
+}
+RESULT_TOPICS = json.loads(os.getenv('RESULT_TOPICS')) if os.getenv('RESULT_TOPICS') else DEFAULT_RESULT_TOPICS
+# Threads shared by the callbacks of every result subscription
+RESULTS_SUBSCRIBER_WORKERS = int(os.getenv('RESULTS_SUBSCRIBER_WORKERS', '8'))
 
 
-# Configure Pub/Sub emulator if running locally
-if os.getenv('PUBSUB_EMULATOR_HOST'):
-    logger.info(f"Using Pub/Sub emulator at {os.getenv('PUBSUB_EMULATOR_HOST')}")
-else:
-    logger.info("Using production Pub/Sub.")
+# Pub/Sub, or Redis Streams with MESSAGE_TRANSPORT=redis
+transport = get_transport()
 
-publisher = pubsub_v1.PublisherClient()
-subscriber = pubsub_v1.SubscriberClient()
 
-archi_results_topic_path = publisher.topic_path(PROJECT_ID, ARCHI_RESULTS_TOPIC_ID)
-strange_results_subscription_path = subscriber.subscription_path(PROJECT_ID, STRANGE_RESULTS_SUBSCRIPTION_ID)
+# Results are written in batches; each message is acked once its batch is committed
+RESULT_WRITER = ResultWriter()
 
 
-def create_topic_if_not_exists(client, topic_id):
-    topic_path = publisher.topic_path(PROJECT_ID, topic_id)
-    logger.info(f"Checking for topic existence: {topic_path}")
-    try:
-        publisher.get_topic(request={"topic": topic_path})
-        logger.info(f"Topic {topic_path} already exists.")
-        return True
-    except exceptions.NotFound:
-        logger.info(f"Topic {topic_path} not found. Creating...")
-        try:
-            publisher.create_topic(request={"name": topic_path})
-            logger.info(f"Topic {topic_path} created.")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to create topic {topic_path}: {e}")
-            return False
-    except Exception as e:
-        logger.error(f"Error checking for topic {topic_path}: {e}")
-        return False
-
-
-def create_subscription_if_not_exists(subscriber_client, topic_path, subscription_path):
-    logger.info(f"Checking for subscription existence: {subscription_path}")
-    try:
-        subscriber_client.get_subscription(request={"subscription": subscription_path})
-        logger.info(f"Subscription {subscription_path} already exists.")
-        return True
-    except exceptions.NotFound:
-        logger.info(f"Subscription {subscription_path} not found. Creating...")
+def subscription_id_of(agent, config):
+    # Default matches the subscription the archidetect-only subscriber used to create
+    return config.get("subscription", f"{config['topic']}-strange-sub")
+
+
+def store_result(agent, message, analysis_result):
+    """Generic handler: logs the summary and queues the result for the result store."""
+    if analysis_result.is_claim_check:
+        logger.info(
+            f"Processing claim-checked {agent} result {analysis_result.reference['blob_id'][:12]} "
+            f"({analysis_result.reference['size']} bytes): {analysis_result.summary}"
+        )
+    else:
+        logger.info(f"Processing {agent} result: {analysis_result.summary}")
+    RESULT_WRITER.add(message, build_result_row(message, analysis_result))
+
+
+def handle_pattern_evaluation_result(agent, message, analysis_result):
+    summary = analysis_result.summary
+    logger.info(f"Pattern evaluation of {summary.get('name')} for {summary.get('pattern')}: {summary.get('percentage')}%")
+    store_result(agent, message, analysis_result)
+
+
+def handle_archidetect_result(agent, message, analysis_result):
+    if "error" in analysis_result.summary:
+        logger.warning(f"Archidetect reported an error: {analysis_result.summary['error']}")
+    store_result(agent, message, analysis_result)
+
+
+RESULT_HANDLERS = {
+    "aplens": handle_pattern_evaluation_result,
+    "archidetect": handle_archidetect_result,
+}
+
+
+def build_callback(agent):
+    """Pub/Sub callback decoding the results of one agent and passing them to its handler."""
+    handler = RESULT_HANDLERS.get(agent, store_result)
+
+    def callback(message):
         try:
-            subscriber_client.create_subscription(
-                request={"name": subscription_path, "topic": topic_path}
-            )
-            logger.info(f"Subscription {subscription_path} created.")
-            return True
-        except exceptions.Conflict:
-            logger.warning(f"Subscription {subscription_path} already exists (Conflict during creation).")
-            return True
+            # Claim-checked results only carry a summary here, the payload is read from the blob store on load()
+            analysis_result = decode_result(message.data, message.attributes)
+            handler(agent, message, analysis_result)
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            logger.error(f"Failed to decode {agent} result as JSON. Acknowledging and skipping.")
+            logger.error(f"Raw message data: {message.data}")
+            message.ack()
         except Exception as e:
-            logger.error(f"Failed to create subscription {subscription_path}: {e}")
-            return False
-    except Exception as e:
-        logger.error(f"Error checking for subscription {subscription_path}: {e}")
-        return False
-
-
-def handle_archidetect_message(message):
-    logger.info(f"Received raw message from Archidetect: {message.data}")
-    try:
-        analysis_result = json.loads(message.data.decode('utf-8'))
-        logger.info(f"Processing analysis result: {analysis_result}")
-        print(analysis_result)
-        # --- Implement your logic to handle the analysis result from Archidetect ---
-        message.ack()
-        logger.info(f"Message {message.message_id} from Archidetect acknowledged.")
-    except json.JSONDecodeError:
-        logger.error("Failed to decode message data from Archidetect as JSON. Acknowledging and skipping.")
-        logger.error(f"Raw message data: {message.data}")
-        message.ack()
-    except Exception as e:
-        logger.error(f"Error processing message from Archidetect: {e}. Message not acknowledged.")
-        logger.error(f"Message data that caused error: {message.data}")
+            logger.error(f"Error processing {agent} result: {e}. Message not acknowledged.")
+            logger.error(f"Message data that caused error: {message.data}")
+            message.nack()
+    return callback
+
+
+class SharedExecutor(ThreadPoolExecutor):
+    """Thread pool shared by several streaming pulls; it only shuts down when close() is called."""
+
+    def shutdown(self, wait=True, **kwargs):
+        # Each pull's scheduler shuts its executor down when it stops, which must not stop the others
+        pass
+
+    def close(self, wait=True):
+        super().shutdown(wait=wait)
 
 
 class Command(BaseCommand):
-    help = 'Starts the Pub/Sub listener for Archidetect analysis results'
+    help = 'Starts the Pub/Sub listener for the analysis results of every agent'
 
     def handle(self, *args, **options):
-        logger.info("Starting strange agent Pub/Sub subscriber for Archidetect results.")
+        logger.info(f"Starting strange results subscriber for {', '.join(RESULT_TOPICS)} with {RESULTS_SUBSCRIBER_WORKERS} workers.")
+        executor = SharedExecutor(max_workers=RESULTS_SUBSCRIBER_WORKERS, thread_name_prefix="results-worker")
+
+        streaming_pull_futures = {}
+        for agent, config in RESULT_TOPICS.items():
+            subscription_path = transport.subscription_path(subscription_id_of(agent, config))
+            if not (transport.ensure_topic(config["topic"])
+                    and transport.ensure_subscription(config["topic"], subscription_id_of(agent, config))):
+                logger.error(f"Failed to create or verify the {agent} result topic or subscription. Skipping it.")
+                continue
+            # Per-topic flow control, so a burst from one agent cannot take every shared worker
+            flow_control = pubsub_v1.types.FlowControl(max_messages=config.get("max_messages", 50))
+            streaming_pull_futures[agent] = transport.subscribe(
+                subscription_path,
+                callback=build_callback(agent),
+                flow_control=flow_control,
+                scheduler=ThreadScheduler(executor=executor),
+            )
+            logger.info(f"Listening to {subscription_path} for {agent} results.")
 
-        # Ensure the topic exists (published by Archi)
-        if create_topic_if_not_exists(publisher, ARCHI_RESULTS_TOPIC_ID):
-            # Then ensure Strange is subscribed to that topic
-            if create_subscription_if_not_exists(subscriber, archi_results_topic_path, strange_results_subscription_path):
-                try:
-                    logger.info(f"Starting Pub/Sub listener for subscription: {strange_results_subscription_path}")
-                    streaming_pull_future = subscriber.subscribe(
-                        strange_results_subscription_path,
-                        callback=handle_archidetect_message
-                    )
-                    logger.info("Listening for messages. Press Ctrl+C to stop.")
-                    streaming_pull_future.result()  # blocks
-
-                except KeyboardInterrupt:
-                    logger.info("Keyboard interrupt received. Shutting down subscriber.")
-                    streaming_pull_future.cancel()
-                    streaming_pull_future.result()
-                except Exception as e:
-                    logger.error(f"Error in subscriber loop: {e}")
-            else:
-                logger.error("Failed to create or verify subscription. Subscriber will not start.")
-        else:
-            logger.error("Failed to create or verify topic. Subscriber will not start.")
+        if not streaming_pull_futures:
+            logger.error("No result subscription could be started. Subscriber will not start.")
+            return
 
+        RESULT_WRITER.start()
+        logger.info("Listening for messages. Press Ctrl+C to stop.")
+        try:
+            for future in streaming_pull_futures.values():
+                future.result()  # blocks
+        except KeyboardInterrupt:
+            logger.info("Keyboard interrupt received. Shutting down subscriber.")
+        except Exception as e:
+            logger.error(f"Error in subscriber loop: {e}")
+        finally:
+            for future in streaming_pull_futures.values():
+                future.cancel()
+            for future in streaming_pull_futures.values():
+                try:
+                    future.result()
+                except Exception:
+                    pass
+            executor.close()
+            RESULT_WRITER.stop()
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.2 on 2026-10-19 06:45
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisRequest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('correlation_id', models.CharField(max_length=64, unique=True)),
+                ('user_input', models.TextField(blank=True)),
+                ('routed_by', models.CharField(blank=True, max_length=20)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('correlation_id', models.CharField(db_index=True, max_length=64)),
+                ('message_type', models.CharField(max_length=64)),
+                ('repo', models.CharField(max_length=200)),
+                ('pattern', models.CharField(blank=True, max_length=64)),
+                ('analysis_type', models.CharField(blank=True, max_length=64)),
+                ('message_id', models.CharField(blank=True, max_length=100)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('completed', 'Completed'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('request', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to='api.analysisrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['repo', 'pattern'], name='job_repo_pattern_idx'), models.Index(fields=['repo', 'analysis_type'], name='job_repo_analysis_type_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('correlation_id', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('dedup_key', models.CharField(max_length=64, unique=True)),
+                ('message_id', models.CharField(max_length=100)),
+                ('message_type', models.CharField(max_length=64)),
+                ('repo', models.CharField(max_length=200)),
+                ('pattern', models.CharField(blank=True, max_length=64)),
+                ('analysis_type', models.CharField(blank=True, max_length=64)),
+                ('revision', models.CharField(blank=True, max_length=64)),
+                ('private', models.BooleanField(default=False)),
+                ('is_error', models.BooleanField(default=False)),
+                ('summary', models.JSONField(default=dict)),
+                ('payload', models.JSONField(blank=True, null=True)),
+                ('blob_reference', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='results', to='api.analysisjob')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['repo', 'message_type', 'pattern', '-created_at'], name='result_repo_pattern_idx'), models.Index(fields=['repo', 'message_type', 'analysis_type', '-created_at'], name='result_repo_analysis_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_analysisrequest_analysisjob_analysisresult'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisrequest',
+            name='part_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='analysisrequest',
+            name='deadline',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
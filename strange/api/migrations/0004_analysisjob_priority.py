@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-19 07:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_analysisrequest_part_count_deadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='priority',
+            field=models.CharField(db_index=True, default='interactive', max_length=20),
+        ),
+    ]
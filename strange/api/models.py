@@ -1,7 +1,84 @@
 from django.db import models
+from django.utils import timezone
+
+from .claim_check import LazyResult
 
 class Item(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField()
 
 
+class AnalysisRequest(models.Model):
+    """A user request that was routed to one agent, or split into jobs for several."""
+    correlation_id = models.CharField(max_length=64, unique=True)
+    user_input = models.TextField(blank=True)
+    routed_by = models.CharField(max_length=20, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    # Composite requests fan out to several jobs and report what arrived by the deadline
+    part_count = models.PositiveIntegerField(default=1)
+    deadline = models.DateTimeField(null=True, blank=True)
+
+
+class AnalysisJob(models.Model):
+    """An agent message published for a request."""
+    QUEUED = "queued"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (COMPLETED, "Completed"), (FAILED, "Failed")]
+
+    request = models.ForeignKey(AnalysisRequest, null=True, blank=True, on_delete=models.SET_NULL, related_name="jobs")
+    correlation_id = models.CharField(max_length=64, db_index=True)
+    message_type = models.CharField(max_length=64)
+    repo = models.CharField(max_length=200)
+    pattern = models.CharField(max_length=64, blank=True)
+    analysis_type = models.CharField(max_length=64, blank=True)
+    # Priority lane the message was published to
+    priority = models.CharField(max_length=20, default="interactive", db_index=True)
+    message_id = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["repo", "pattern"], name="job_repo_pattern_idx"),
+            models.Index(fields=["repo", "analysis_type"], name="job_repo_analysis_type_idx"),
+        ]
+
+
+class AnalysisResult(models.Model):
+    """
+    A result received from an agent.
+
+    Claim-checked results keep only their summary and blob reference; the payload is read from
+    the blob store when load() is called.
+    """
+    job = models.ForeignKey(AnalysisJob, null=True, blank=True, on_delete=models.SET_NULL, related_name="results")
+    correlation_id = models.CharField(max_length=64, blank=True, db_index=True)
+    # Hash of the message body, a redelivered or republished result maps to the same row
+    dedup_key = models.CharField(max_length=64, unique=True)
+    message_id = models.CharField(max_length=100)
+    message_type = models.CharField(max_length=64)
+    repo = models.CharField(max_length=200)
+    pattern = models.CharField(max_length=64, blank=True)
+    analysis_type = models.CharField(max_length=64, blank=True)
+    revision = models.CharField(max_length=64, blank=True)
+    # Results of requests made with a GitHub token are never served to other requests
+    private = models.BooleanField(default=False)
+    is_error = models.BooleanField(default=False)
+    summary = models.JSONField(default=dict)
+    payload = models.JSONField(null=True, blank=True)
+    blob_reference = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["repo", "message_type", "pattern", "-created_at"], name="result_repo_pattern_idx"),
+            models.Index(fields=["repo", "message_type", "analysis_type", "-created_at"], name="result_repo_analysis_idx"),
+        ]
+
+    def load(self):
+        """The full result, from the row or from the blob store for claim-checked results."""
+        if self.payload is not None:
+            return self.payload
+        return LazyResult(self.summary, reference=self.blob_reference).load()
@@ -0,0 +1,456 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .agent_messages import RESULT_TYPES, repo_attribute, ARCHIDETECT_REQUEST, PRIORITY_INTERACTIVE
+from .claim_check import ClaimCheckError
+from .composite import merge_composite_report
+from .routing import ARCHIDETECT_AGENT, PATTERN_EVALUATION_AGENT
+from .models import AnalysisRequest, AnalysisJob, AnalysisResult
+
+logger = logging.getLogger(__name__)
+
+RESULT_STORE_BATCH_SIZE = int(os.getenv('RESULT_STORE_BATCH_SIZE', '50'))
+RESULT_STORE_FLUSH_INTERVAL = float(os.getenv('RESULT_STORE_FLUSH_INTERVAL', '1.0'))
+# Stored results younger than this answer repeated questions without dispatching to an agent
+RESULT_STORE_MAX_AGE = int(os.getenv('RESULT_STORE_MAX_AGE', str(24 * 3600)))
+# Redis channel prefix used to wake up the requests waiting for a result
+RESULT_NOTIFY_CHANNEL = "analysis-results"
+RESULT_NOTIFY_REDIS_URL = os.getenv('RESULT_NOTIFY_REDIS_URL', os.getenv('REDIS_URL'))
+# Database polling interval of waiters when Redis is not available
+RESULT_POLL_INTERVAL = 0.5
+# Longest a waiter blocks on the notification channel before checking again (composite deadlines)
+RESULT_NOTIFY_WAIT_MAX = 1.0
+
+
+# --- Requests and jobs ---
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+def record_dispatch(agent_request, user_input="", routed_by=""):
+    """
+    Records a routed request and the agent job published for it.
+
+    The request's correlation ID is assigned here if it has none, so it must be called before
+    the agent message is encoded.
+
+    Returns:
+        AnalysisJob: The job, or None if it could not be stored (dispatch does not depend on it).
+    """
+    agent_request.correlation_id = agent_request.correlation_id or new_correlation_id()
+    correlation_id = agent_request.correlation_id
+    try:
+        analysis_request = AnalysisRequest.objects.create(
+            correlation_id=correlation_id, user_input=user_input or "", routed_by=routed_by or ""
+        )
+        return AnalysisJob.objects.create(
+            request=analysis_request,
+            correlation_id=correlation_id,
+            message_type=agent_request.message_type,
+            repo=repo_attribute(agent_request.repo_url),
+            pattern=agent_request.pattern or "",
+            analysis_type=agent_request.analysis_type or "",
+            priority=agent_request.priority or PRIORITY_INTERACTIVE,
+        )
+    except Exception as e:
+        logger.error(f"Could not record the dispatched request: {e}")
+        return None
+
+
+def record_plan(agent_requests, user_input="", routed_by="", deadline_seconds=None):
+    """
+    Records a composite request and one job per part.
+
+    Each part gets the correlation ID "<request>-<index>", so its result is stored under the
+    part while the client follows the request's own correlation ID.
+
+    Returns:
+        tuple: (request correlation ID, list of AnalysisJob or None per part).
+    """
+    correlation_id = new_correlation_id()
+    for index, agent_request in enumerate(agent_requests):
+        agent_request.correlation_id = f"{correlation_id}-{index}"
+    try:
+        analysis_request = AnalysisRequest.objects.create(
+            correlation_id=correlation_id,
+            user_input=user_input or "",
+            routed_by=routed_by or "",
+            part_count=len(agent_requests),
+            deadline=timezone.now() + timedelta(seconds=deadline_seconds) if deadline_seconds else None,
+        )
+        jobs = [
+            AnalysisJob.objects.create(
+                request=analysis_request,
+                correlation_id=agent_request.correlation_id,
+                message_type=agent_request.message_type,
+                repo=repo_attribute(agent_request.repo_url),
+                pattern=agent_request.pattern or "",
+                analysis_type=agent_request.analysis_type or "",
+                priority=agent_request.priority or PRIORITY_INTERACTIVE,
+            )
+            for agent_request in agent_requests
+        ]
+        return correlation_id, jobs
+    except Exception as e:
+        logger.error(f"Could not record the composite request: {e}")
+        return correlation_id, [None] * len(agent_requests)
+
+
+def set_job_message_id(job, message_id):
+    if job is not None:
+        AnalysisJob.objects.filter(pk=job.pk).update(message_id=message_id)
+
+
+def set_job_failed(job):
+    """Marks a job whose message could not be published, so no one waits for its result."""
+    if job is None:
+        return
+    try:
+        AnalysisJob.objects.filter(pk=job.pk).update(status=AnalysisJob.FAILED)
+        # Wakes the long-polls and streams already waiting for it
+        parent = job.request.correlation_id if job.request_id else None
+        RESULT_NOTIFIER.notify([job.correlation_id] + ([parent] if parent and parent != job.correlation_id else []))
+    except Exception as e:
+        logger.error(f"Could not mark job {job.correlation_id} failed: {e}")
+
+
+def find_stored_result(agent_request, max_age=RESULT_STORE_MAX_AGE):
+    """
+    The latest stored result answering the same question, if it is recent enough.
+
+    Requests carrying a GitHub token are never answered from the store, and results of such
+    requests are never served, so private repositories do not leak between users.
+
+    Returns:
+        AnalysisResult: The stored result, or None.
+    """
+    if agent_request.token or max_age <= 0:
+        return None
+    filters = {
+        "repo": repo_attribute(agent_request.repo_url),
+        "message_type": RESULT_TYPES[agent_request.message_type],
+        "private": False,
+        "is_error": False,
+        "created_at__gte": timezone.now() - timedelta(seconds=max_age),
+    }
+    if agent_request.pattern:
+        filters["pattern"] = agent_request.pattern
+    if agent_request.analysis_type:
+        filters["analysis_type"] = agent_request.analysis_type
+    return AnalysisResult.objects.filter(**filters).order_by("-created_at").first()
+
+
+# --- Results ---
+
+def build_result_row(message, lazy_result):
+    """Unsaved AnalysisResult of a received result message."""
+    attributes = message.attributes or {}
+    return AnalysisResult(
+        correlation_id=attributes.get("correlation_id", ""),
+        # Redeliveries share the hash; the same result published for another request does not
+        dedup_key=hashlib.sha256(
+            f"{attributes.get('message_type', '')}\0{attributes.get('correlation_id', '')}\0".encode('utf-8') + message.data
+        ).hexdigest(),
+        message_id=message.message_id,
+        message_type=attributes.get("message_type", ""),
+        repo=attributes.get("repo", ""),
+        pattern=attributes.get("pattern", ""),
+        analysis_type=attributes.get("analysis_type", ""),
+        revision=attributes.get("revision", ""),
+        private=attributes.get("private", "0") == "1",
+        is_error="error" in lazy_result.summary,
+        summary=lazy_result.summary,
+        payload=None if lazy_result.is_claim_check else lazy_result.load(),
+        blob_reference=lazy_result.reference,
+    )
+
+
+class ResultWriter:
+    """
+    Buffers received results and writes them with bulk inserts.
+
+    Messages are acked only once their batch is committed, and nacked if the write fails.
+    Redelivered messages are deduplicated within a batch and by the unique dedup_key.
+    """
+
+    def __init__(self, batch_size=RESULT_STORE_BATCH_SIZE, flush_interval=RESULT_STORE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+
+    def add(self, message, row):
+        with self._lock:
+            self._pending.append((message, row))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            rows = list({row.dedup_key: row for _, row in pending}.values())
+            try:
+                close_old_connections()
+                AnalysisResult.objects.bulk_create(rows, batch_size=self.batch_size, ignore_conflicts=True)
+                parents = self._complete_jobs(rows)
+                RESULT_NOTIFIER.notify([row.correlation_id for row in rows if row.correlation_id] + parents)
+            except Exception as e:
+                logger.error(f"Could not store {len(rows)} analysis results: {e}. Messages not acknowledged.")
+                for message, _ in pending:
+                    message.nack()
+                return 0
+            for message, _ in pending:
+                message.ack()
+            logger.info(f"Stored {len(rows)} analysis results ({len(pending) - len(rows)} duplicates in the batch)")
+            return len(rows)
+
+    def _complete_jobs(self, rows):
+        """Marks the jobs of the rows completed and returns the correlation IDs of their composite requests."""
+        correlation_ids = {row.correlation_id for row in rows if row.correlation_id}
+        if not correlation_ids:
+            return []
+        AnalysisJob.objects.filter(correlation_id__in=correlation_ids, status=AnalysisJob.QUEUED).update(
+            status=AnalysisJob.COMPLETED, completed_at=timezone.now()
+        )
+        # Link the results inserted just now to their jobs
+        parents = set()
+        for job in AnalysisJob.objects.filter(correlation_id__in=correlation_ids).select_related("request"):
+            AnalysisResult.objects.filter(correlation_id=job.correlation_id, job__isnull=True).update(job=job)
+            if job.request is not None and job.request.part_count > 1:
+                parents.add(job.request.correlation_id)
+        return list(parents)
+
+    def start(self):
+        """Flushes every flush_interval seconds from a daemon thread, so small batches are not held back."""
+        if self._flusher is not None:
+            return
+
+        def run():
+            while not self._stopped.wait(self.flush_interval):
+                self.flush()
+
+        self._flusher = threading.Thread(target=run, name="result-writer", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+
+# --- Delivery to waiting clients ---
+
+class ResultNotifier:
+    """
+    Wakes up the requests waiting for a result.
+
+    The results subscriber publishes each stored correlation ID on a Redis channel; waiters
+    subscribe to it. Without Redis, waiters poll the database instead.
+    """
+
+    def __init__(self, redis_url=RESULT_NOTIFY_REDIS_URL):
+        self.client = None
+        if redis_url:
+            try:
+                import redis
+
+                self.client = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("redis package not installed, result waiters poll the database")
+
+    def _channel(self, correlation_id):
+        return f"{RESULT_NOTIFY_CHANNEL}:{correlation_id}"
+
+    def notify(self, correlation_ids):
+        if self.client is None:
+            return
+        for correlation_id in correlation_ids:
+            try:
+                self.client.publish(self._channel(correlation_id), "stored")
+            except Exception as e:
+                logger.warning(f"Could not notify waiters of {correlation_id}: {e}")
+                return
+
+    def wait(self, correlation_id, timeout, check=None):
+        """
+        Waits until a result for the correlation ID is stored.
+
+        Args:
+            check (callable): Called with the correlation ID after each notification; waiting
+                              stops when it returns something other than None. Defaults to
+                              latest_result.
+
+        Returns:
+            The value returned by check, or None on timeout.
+        """
+        check = check or latest_result
+        deadline = time.monotonic() + timeout
+        pubsub = None
+        if self.client is not None:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self._channel(correlation_id))
+            except Exception as e:
+                logger.warning(f"Result notifications unavailable ({e}), polling the database")
+                pubsub = None
+        try:
+            while True:
+                # Checked after subscribing, so a result stored in between is not missed
+                result = check(correlation_id)
+                remaining = deadline - time.monotonic()
+                if result is not None or remaining <= 0:
+                    return result
+                if pubsub is not None:
+                    try:
+                        pubsub.get_message(timeout=min(RESULT_NOTIFY_WAIT_MAX, remaining))
+                        continue
+                    except Exception as e:
+                        logger.warning(f"Result notifications interrupted ({e}), polling the database")
+                        pubsub = None
+                time.sleep(min(RESULT_POLL_INTERVAL, remaining))
+        finally:
+            if pubsub is not None:
+                pubsub.close()
+
+
+RESULT_NOTIFIER = ResultNotifier()
+
+
+def latest_result(correlation_id):
+    close_old_connections()
+    return AnalysisResult.objects.filter(correlation_id=correlation_id).order_by("-created_at").first()
+
+
+def result_status(correlation_id, result=None):
+    """
+    State of an orchestrated request, as returned by the result endpoints.
+
+    Returns:
+        dict: The response body, or None if the correlation ID is unknown.
+    """
+    composite = AnalysisRequest.objects.filter(correlation_id=correlation_id, part_count__gt=1).first()
+    if composite is not None:
+        return composite_status(composite)
+    result = result or latest_result(correlation_id)
+    job = AnalysisJob.objects.filter(correlation_id=correlation_id).select_related("request").first()
+    if result is None and job is None:
+        return None
+    body = {
+        "correlation_id": correlation_id,
+        "status": "completed" if result is not None else job.status,
+        "repo": job.repo if job else result.repo,
+    }
+    if result is not None:
+        try:
+            body["result"] = result.load()
+        except ClaimCheckError as e:
+            # The blob was purged after CLAIM_CHECK_TTL or is corrupt
+            logger.error(f"Result of {correlation_id} could not be loaded: {e}")
+            body.update(status=AnalysisJob.FAILED, error=str(e))
+            return body
+        body["completed_at"] = result.created_at.isoformat()
+        if job is not None and job.request is not None:
+            body["end_to_end_seconds"] = round((result.created_at - job.request.created_at).total_seconds(), 3)
+    return body
+
+
+def _part_of(job):
+    part = {
+        "correlation_id": job.correlation_id,
+        "agent": ARCHIDETECT_AGENT if job.message_type == ARCHIDETECT_REQUEST else PATTERN_EVALUATION_AGENT,
+        "pattern": job.pattern,
+        "analysis_type": job.analysis_type,
+        "status": job.status,
+    }
+    result = job.results.order_by("-created_at").first()
+    if result is not None:
+        try:
+            part.update(status="completed", result=result.load(), completed_at=result.created_at)
+        except ClaimCheckError as e:
+            logger.error(f"Result of {job.correlation_id} could not be loaded: {e}")
+            part.update(status=AnalysisJob.FAILED, error=str(e))
+    return part
+
+
+def composite_status(analysis_request):
+    """
+    State of a composite request: "completed" once every part has a result, "partial" once its
+    deadline passed with parts still missing or no missing part can arrive any more (they all
+    failed), "processing" otherwise.
+
+    The merged report is included once the status is final; its latency is that of the slowest
+    part, since the parts run concurrently.
+    """
+    parts = [_part_of(job) for job in analysis_request.jobs.order_by("correlation_id")]
+    completed = [part for part in parts if part["status"] == "completed"]
+    pending = [part for part in parts if part["status"] not in ("completed", AnalysisJob.FAILED)]
+    if len(completed) >= analysis_request.part_count:
+        state = "completed"
+    elif not pending or (analysis_request.deadline is not None and timezone.now() >= analysis_request.deadline):
+        state = "partial"
+    else:
+        state = "processing"
+
+    body = {
+        "correlation_id": analysis_request.correlation_id,
+        "status": state,
+        "repo": analysis_request.jobs.values_list("repo", flat=True).first(),
+        "parts_completed": len(completed),
+        "parts_total": analysis_request.part_count,
+        "deadline": analysis_request.deadline.isoformat() if analysis_request.deadline else None,
+        "parts": [
+            {key: part[key] for key in ("correlation_id", "agent", "pattern", "analysis_type", "status")}
+            for part in parts
+        ],
+    }
+    if state != "processing":
+        body["report"] = merge_composite_report(parts)
+        if completed:
+            last = max(part["completed_at"] for part in completed)
+            body["completed_at"] = last.isoformat()
+            body["end_to_end_seconds"] = round((last - analysis_request.created_at).total_seconds(), 3)
+    return body
+
+
+def final_status(correlation_id):
+    """The result_status body if the request is completed, partial or failed, else None."""
+    close_old_connections()
+    body = result_status(correlation_id)
+    if body is not None and body["status"] in ("completed", "partial", AnalysisJob.FAILED):
+        return body
+    return None
+
+
+def wait_for_status(correlation_id, timeout):
+    """
+    Waits up to `timeout` seconds for the request to reach a final status.
+
+    Returns:
+        dict: The result_status body, final or not, or None if the correlation ID is unknown.
+    """
+    body = RESULT_NOTIFIER.wait(correlation_id, timeout, check=final_status) if timeout > 0 else None
+    return body or result_status(correlation_id)
+
+
+def end_to_end_latencies(limit=1000, priority=None):
+    """Seconds from the routed request to the stored result, for the latest `limit` results (of one lane if given)."""
+    results = AnalysisResult.objects.filter(job__request__isnull=False)
+    if priority:
+        results = results.filter(job__priority=priority)
+    results = results.order_by("-created_at").values_list("created_at", "job__request__created_at")[:limit]
+    return [(completed_at - requested_at).total_seconds() for completed_at, requested_at in results]
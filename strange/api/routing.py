@@ -0,0 +1,187 @@
+import re
+import logging
+from datetime import datetime
+
+from .llm_backend import CallCounters
+from .agent_messages import AgentRequest, PATTERN_EVALUATION_REQUEST, ARCHIDETECT_REQUEST
+
+logger = logging.getLogger(__name__)
+
+GITHUB_URL_REGEX = re.compile(r'https?://github\.com/[\w-]+/[\w.-]+')
+GITHUB_TOKEN_REGEX = re.compile(r'\b(gh[pousr]_[A-Za-z0-9_]{20,}|github_pat_[A-Za-z0-9_]{20,})\b')
+
+ARCHITECTURE_PATTERNS = [
+    "mvc", "microservice", "monolithic", "event-driven", "layered", "client-server",
+    "serverless", "domain-driven", "cqrs", "hexagonal", "soa", "service-oriented",
+]
+# Whole words only, optionally plural ("microservices"), so "soap" or "mvcframework" do not match
+ARCHITECTURE_REGEX = re.compile(r'\b(' + "|".join(re.escape(p) for p in ARCHITECTURE_PATTERNS) + r')s?\b', re.IGNORECASE)
+
+EVALUATION_INTENT_REGEX = re.compile(r'\b(evaluat\w*|assess\w*|rate|rating|score|how well|review|check)\b', re.IGNORECASE)
+DISCOVERY_INTENT_REGEX = re.compile(
+    r'\b(what|which|identify|detect|discover|find)\b.*\b(patterns?|architectures?)\b', re.IGNORECASE
+)
+
+# ArchiDetect analysis types, most specific keywords first
+ANALYSIS_TYPE_KEYWORDS = [
+    ("commit sizes", "commit_sizes"),
+    ("commit size", "commit_sizes"),
+    ("commit activity", "commit_activity"),
+    ("trend", "architecture_trends"),
+    ("evolution", "architecture_trends"),
+    ("user stor", "user_stories"),
+    ("contributor", "contributors"),
+    ("issue", "issues"),
+    ("commit", "commits"),
+]
+
+PATTERN_EVALUATION_AGENT = "Pattern Evaluation Agent"
+ARCHIDETECT_AGENT = "ArchiDetect Agent"
+
+AGENT_MESSAGE_TYPES = {
+    PATTERN_EVALUATION_AGENT: PATTERN_EVALUATION_REQUEST,
+    ARCHIDETECT_AGENT: ARCHIDETECT_REQUEST,
+}
+
+# What to ask the user when a required message field could not be determined
+MISSING_FIELD_QUESTIONS = {
+    "repo_url": "the GitHub repository URL",
+    "pattern": "the architectural pattern to evaluate",
+    "analysis_type": "the kind of analysis to run",
+}
+
+# Token written in quotes after the URL by older router answers
+QUOTED_TOKEN_REGEX = re.compile(r', "([\w-]+)"')
+
+ROUTING_COUNTERS = CallCounters()
+
+
+def extract_repo_info(text):
+    """
+    Extracts the GitHub repository referenced in a piece of text.
+
+    Args:
+        text (str): User input or a line of the LLM answer.
+
+    Returns:
+        dict: repo_url, repo_owner and repo_name, or an empty dict if no URL is found.
+    """
+    url_match = GITHUB_URL_REGEX.search(text or "")
+    if not url_match:
+        return {}
+    repo_url = url_match.group(0).rstrip('.')
+    parts = repo_url.rstrip('/').split('/')
+    return {"repo_url": repo_url, "repo_owner": parts[-2], "repo_name": parts[-1]}
+
+
+def extract_architectures(text):
+    """Returns the distinct architectural patterns mentioned in the text, in order of appearance."""
+    # Repository names such as microservices-demo do not name a pattern
+    text = GITHUB_URL_REGEX.sub(" ", text or "")
+    return list(dict.fromkeys(match.lower() for match in ARCHITECTURE_REGEX.findall(text)))
+
+
+def extract_analysis_type(text):
+    """Maps the wording of a discovery request to an ArchiDetect analysis type (default "full")."""
+    lowered = (text or "").lower()
+    for keyword, analysis_type in ANALYSIS_TYPE_KEYWORDS:
+        if keyword in lowered:
+            return analysis_type
+    return "full"
+
+
+def fast_route(user_input):
+    """
+    Routes unambiguous requests locally, without calling the LLM.
+
+    A request is unambiguous when it contains exactly one GitHub URL and either asks to
+    evaluate exactly one known architectural pattern, or asks which patterns a repository
+    uses without naming any. Everything else returns None and goes to the LLM router.
+
+    Args:
+        user_input (str): The raw user request.
+
+    Returns:
+        dict: Same structure as parse_structured_response, or None if the LLM is needed.
+    """
+    urls = set(url.rstrip('.') for url in GITHUB_URL_REGEX.findall(user_input or ""))
+    if len(urls) != 1:
+        return None
+
+    repo_info = extract_repo_info(user_input)
+    architectures = extract_architectures(user_input)
+    token_match = GITHUB_TOKEN_REGEX.search(user_input)
+    token_suffix = f', "{token_match.group(1)}"' if token_match else ""
+    wants_evaluation = bool(EVALUATION_INTENT_REGEX.search(user_input))
+    wants_discovery = bool(DISCOVERY_INTENT_REGEX.search(user_input))
+
+    # The agent messages follow the formats the agent subscribers parse
+    if len(architectures) == 1 and wants_evaluation and not wants_discovery:
+        architecture = architectures[0]
+        return {
+            "selected_agent": PATTERN_EVALUATION_AGENT,
+            "reason": f"The request explicitly asks to evaluate the {architecture} pattern.",
+            "missing_information": "None",
+            "message_to_agent": f"Evaluate the {architecture} architectural pattern of {repo_info['repo_url']}{token_suffix}",
+            "extracted_information": {**repo_info, "architecture": architecture},
+        }
+
+    if not architectures and wants_discovery:
+        analysis_type = extract_analysis_type(user_input)
+        return {
+            "selected_agent": ARCHIDETECT_AGENT,
+            "reason": "The request asks which architectural patterns the repository uses.",
+            "missing_information": "None",
+            "message_to_agent": f"Please analyze the {analysis_type} of this repo: {repo_info['repo_url']}{token_suffix}",
+            "extracted_information": {**repo_info, "analysis_type": analysis_type},
+        }
+
+    return None
+
+
+def build_agent_request(parsed_response):
+    """
+    Builds the typed agent message of a routing decision.
+
+    Fields come from the extracted information when present, otherwise from the message
+    to the agent, which is kept as optional context.
+
+    Args:
+        parsed_response (dict): Result of fast_route, the routing cache or the LLM router.
+
+    Returns:
+        AgentRequest: The request (check missing_fields()), or None for an unknown agent.
+    """
+    message_type = AGENT_MESSAGE_TYPES.get(parsed_response.get("selected_agent"))
+    if message_type is None:
+        return None
+    message = parsed_response.get("message_to_agent") or ""
+    extracted = parsed_response.get("extracted_information") or {}
+
+    token_match = GITHUB_TOKEN_REGEX.search(message) or QUOTED_TOKEN_REGEX.search(message)
+    request = AgentRequest(
+        message_type,
+        extracted.get("repo_url") or extract_repo_info(message).get("repo_url"),
+        token=token_match.group(1) if token_match else None,
+        context=message or None,
+        timestamp=datetime.utcnow().isoformat(),
+    )
+    if message_type == PATTERN_EVALUATION_REQUEST:
+        architectures = extract_architectures(message)
+        request.pattern = extracted.get("architecture") or (architectures[0] if architectures else None)
+    else:
+        request.analysis_type = extracted.get("analysis_type") or extract_analysis_type(message)
+    return request
+
+
+def record_route(routed_by):
+    """Counts how a request was routed ("fast_path", "cache" or "llm") and logs the fast-path share."""
+    ROUTING_COUNTERS.increment(routed_by)
+    logger.info(f"Routed by {routed_by}, fast-path share: {fast_path_share():.1%}")
+
+
+def fast_path_share():
+    """Share of requests routed by the deterministic pre-router since the process started."""
+    counts = ROUTING_COUNTERS.snapshot()
+    total = sum(counts.values())
+    return counts.get("fast_path", 0) / total if total else 0.0
@@ -0,0 +1,216 @@
+import os
+import re
+import math
+import zlib
+import threading
+from collections import OrderedDict
+
+from .llm_backend import CallCounters
+from .routing import GITHUB_URL_REGEX, GITHUB_TOKEN_REGEX, ARCHITECTURE_REGEX, extract_repo_info, extract_architectures
+
+ROUTING_CACHE_SIZE = int(os.getenv('ROUTING_CACHE_SIZE', '512'))
+ROUTING_CACHE_THRESHOLD = float(os.getenv('ROUTING_CACHE_THRESHOLD', '0.9'))
+
+# Number of hashed feature buckets of the n-gram vectors
+VECTOR_DIMENSIONS = 2 ** 18
+NGRAM_SIZE = 3
+
+# Placeholders used both in normalized inputs and in cached message templates
+REPO_URL_MASK = "<repo_url>"
+TOKEN_MASK = "<token>"
+ARCHITECTURE_MASK = "<architecture>"
+# Owner or repository names shorter than this are not masked outside the URL
+MIN_MASKED_NAME_LENGTH = 3
+
+
+def normalize_input(user_input):
+    """
+    Masks the request-specific parameters of a user input.
+
+    Args:
+        user_input (str): The raw user request.
+
+    Returns:
+        tuple: (normalized text, parameters dict with repo_url, token and architecture).
+    """
+    repo_info = extract_repo_info(user_input)
+    token_match = GITHUB_TOKEN_REGEX.search(user_input)
+    architectures = extract_architectures(user_input)
+    params = {
+        "repo_url": repo_info.get("repo_url"),
+        "token": token_match.group(1) if token_match else None,
+        "architecture": architectures[0] if len(architectures) == 1 else None,
+        "architecture_count": len(architectures),
+    }
+
+    # One pass, so owner and repository names are only masked outside the URL and never inside a
+    # placeholder; names are whole words, and very short ones are too ambiguous to mask
+    names = [
+        re.escape(name) for name in (repo_info.get("repo_owner"), repo_info.get("repo_name"))
+        if name and len(name) >= MIN_MASKED_NAME_LENGTH
+    ]
+    parameters = rf"(?P<url>{GITHUB_URL_REGEX.pattern})|(?P<token>{GITHUB_TOKEN_REGEX.pattern})"
+    if names:
+        parameters += rf"|(?P<repo>\b(?:{'|'.join(names)})\b)"
+    masks = {"url": REPO_URL_MASK, "token": TOKEN_MASK, "repo": "<repo>"}
+    text = re.sub(parameters, lambda match: masks[match.lastgroup], user_input, flags=re.IGNORECASE)
+    if params["architecture"]:
+        text = ARCHITECTURE_REGEX.sub(ARCHITECTURE_MASK, text)
+    text = re.sub(r"[^\w<>\s]", " ", text.lower())
+    return " ".join(text.split()), params
+
+
+def vectorize(text):
+    """
+    Hashed word and character n-gram vector of a normalized text, L2-normalized.
+
+    Args:
+        text (str): Normalized input.
+
+    Returns:
+        dict: Bucket index -> weight.
+    """
+    features = text.split()
+    padded = f" {text} "
+    features += [padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1)]
+    vector = {}
+    for feature in features:
+        bucket = zlib.crc32(feature.encode("utf-8")) % VECTOR_DIMENSIONS
+        vector[bucket] = vector.get(bucket, 0.0) + 1.0
+    norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+    return {bucket: weight / norm for bucket, weight in vector.items()}
+
+
+def cosine_similarity(a, b):
+    """Cosine similarity of two L2-normalized sparse vectors."""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+
+class RoutingCache:
+    """
+    Caches routing decisions by normalized input.
+
+    Lookups try the exact normalized key first, then the most similar cached input by
+    cosine similarity of hashed n-gram vectors. On a hit above the threshold, the cached
+    agent and message template are reused with the new repository, token and pattern
+    filled in. Entries are evicted least-recently-used first.
+    """
+
+    def __init__(self, max_entries=ROUTING_CACHE_SIZE, threshold=ROUTING_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.counters = CallCounters()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _make_template(message, params):
+        template = message
+        if params["repo_url"]:
+            template = template.replace(params["repo_url"], REPO_URL_MASK)
+        if params["token"]:
+            template = template.replace(params["token"], TOKEN_MASK)
+        if params["architecture"]:
+            template = re.sub(rf"\b{re.escape(params['architecture'])}", ARCHITECTURE_MASK, template, flags=re.IGNORECASE)
+        return template
+
+    @staticmethod
+    def _compatible(entry, params):
+        """
+        A cached template can only be reused if the new input provides every parameter it needs,
+        and every parameter of the new input has a place in it (a token must not be dropped).
+        """
+        if entry["params"]["architecture_count"] != params["architecture_count"]:
+            return False
+        return all(
+            bool(params[name]) == (mask in entry["template"])
+            for name, mask in (("repo_url", REPO_URL_MASK), ("token", TOKEN_MASK), ("architecture", ARCHITECTURE_MASK))
+        )
+
+    def store(self, user_input, parsed_response):
+        """
+        Stores a complete LLM routing decision for reuse.
+
+        Decisions that ask for missing information or whose message does not contain the
+        repository URL (so it could not be re-targeted) are not cached.
+        """
+        missing = parsed_response.get("missing_information")
+        message = parsed_response.get("message_to_agent")
+        if not message or not parsed_response.get("selected_agent") or (missing and missing.lower() != "none"):
+            return
+        key, params = normalize_input(user_input)
+        if not params["repo_url"] or params["repo_url"] not in message:
+            return
+
+        entry = {
+            "vector": vectorize(key),
+            "params": params,
+            "selected_agent": parsed_response["selected_agent"],
+            "reason": parsed_response.get("reason"),
+            "template": self._make_template(message, params),
+            "extracted_information": {
+                k: v for k, v in parsed_response.get("extracted_information", {}).items()
+                if k not in ("repo_url", "repo_owner", "repo_name", "architecture")
+            },
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.counters.increment("stores")
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters.increment("evictions")
+
+    def lookup(self, user_input):
+        """
+        Finds a cached routing decision for this input.
+
+        Args:
+            user_input (str): The raw user request.
+
+        Returns:
+            dict: A parse_structured_response-like result for the new input, or None on a miss.
+        """
+        key, params = normalize_input(user_input)
+        with self._lock:
+            hit_key, hit_kind = key, "exact_hits"
+            if key not in self._entries:
+                vector = vectorize(key)
+                hit_key, hit_kind, best_score = None, "similar_hits", self.threshold
+                for cached_key, cached in self._entries.items():
+                    score = cosine_similarity(vector, cached["vector"])
+                    if score >= best_score and self._compatible(cached, params):
+                        hit_key, best_score = cached_key, score
+            entry = self._entries.get(hit_key)
+            if entry is None or not self._compatible(entry, params):
+                self.counters.increment("misses")
+                return None
+            self._entries.move_to_end(hit_key)
+            self.counters.increment(hit_kind)
+
+        message = entry["template"]
+        for name, mask in (("repo_url", REPO_URL_MASK), ("token", TOKEN_MASK), ("architecture", ARCHITECTURE_MASK)):
+            if params[name]:
+                message = message.replace(mask, params[name])
+        extracted = {**entry["extracted_information"], **extract_repo_info(user_input)}
+        if params["architecture"]:
+            extracted["architecture"] = params["architecture"]
+        return {
+            "selected_agent": entry["selected_agent"],
+            "reason": entry["reason"],
+            "missing_information": "None",
+            "message_to_agent": message,
+            "extracted_information": extracted,
+        }
+
+    def stats(self):
+        """Counters plus the hit rate since the process started."""
+        counts = self.counters.snapshot()
+        hits = counts.get("exact_hits", 0) + counts.get("similar_hits", 0)
+        lookups = hits + counts.get("misses", 0)
+        return {**counts, "entries": len(self._entries), "hit_rate": hits / lookups if lookups else 0.0}
+
+
+ROUTING_CACHE = RoutingCache()
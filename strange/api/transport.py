@@ -0,0 +1,606 @@
+# transport.py
+#
+# Message transport of the orchestrator and the agents.
+#
+# Shared with the other services: edit strange/api/transport.py and copy it to
+# mock_aplens/server/api and archidetect/api/utils with `python check_shared_modules.py --sync`.
+#
+# MESSAGE_TRANSPORT selects the implementation:
+#   pubsub  Google Pub/Sub (or the emulator from setup_emulator.py), the default.
+#   redis   Redis Streams on TRANSPORT_REDIS_URL (or REDIS_URL). Each topic is a stream and each
+#           subscription a consumer group on it, so several subscriptions of a topic all receive
+#           every message, as with Pub/Sub.
+#
+# Both expose the operations the services use: topic_path/subscription_path, ensure_topic,
+# ensure_subscription, publish (returns a future with result() and add_done_callback()),
+# subscribe (streaming pull with the client library's FlowControl and scheduler, returns a
+# future with cancel(), done() and result()), and pull/acknowledge/release for administrative
+# synchronous pulls. Received messages have data, attributes, message_id, publish_time, ack(),
+# nack(), modify_ack_deadline(seconds) and drop().
+
+import os
+import time
+import socket
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_TRANSPORT = os.getenv('MESSAGE_TRANSPORT', 'pubsub')
+PROJECT_ID = os.getenv('PUBSUB_PROJECT_ID', 'my-local-emulator-project')
+
+# --- Redis Streams settings ---
+TRANSPORT_REDIS_URL = os.getenv('TRANSPORT_REDIS_URL', os.getenv('REDIS_URL'))
+STREAM_KEY_PREFIX = "stream:"
+# Hash of subscription name -> stream key, the equivalent of a Pub/Sub subscription's topic
+STREAM_SUBSCRIPTIONS_KEY = "stream-subscriptions"
+# Approximate number of entries kept per stream; acked entries are not deleted individually
+# because other consumer groups of the stream may not have read them yet
+STREAM_MAXLEN = int(os.getenv('STREAM_MAXLEN', '100000'))
+# A delivered entry that is neither acked nor extended for this long is redelivered
+STREAM_ACK_DEADLINE = int(os.getenv('STREAM_ACK_DEADLINE', '60'))
+# Publishes are sent in pipelined XADD batches of up to this many entries, waiting at most this long
+STREAM_BATCH_MAX_MESSAGES = int(os.getenv('STREAM_BATCH_MAX_MESSAGES', '100'))
+STREAM_BATCH_MAX_LATENCY = float(os.getenv('STREAM_BATCH_MAX_LATENCY', '0.01'))
+# Longest XREADGROUP block, so cancellation and reclaims are noticed
+STREAM_READ_BLOCK_MS = 1000
+# Pending entries of crashed or slow consumers are looked for this often
+STREAM_RECLAIM_INTERVAL = 5.0
+# Acks and deadline changes are sent in one pipeline this often
+STREAM_HOUSEKEEPING_INTERVAL = 0.1
+
+
+def get_transport(kind=None, **kwargs):
+    """
+    The transport selected by MESSAGE_TRANSPORT (or `kind`).
+
+    Args:
+        kind (str): "pubsub" or "redis".
+        **kwargs: Passed to the transport, e.g. batch_settings for Pub/Sub.
+    """
+    kind = kind or MESSAGE_TRANSPORT
+    if kind == "redis":
+        return RedisStreamsTransport(**{key: value for key, value in kwargs.items() if key != "batch_settings"})
+    if kind == "pubsub":
+        return PubSubTransport(**kwargs)
+    raise ValueError(f"Unknown MESSAGE_TRANSPORT {kind}, expected 'pubsub' or 'redis'")
+
+
+# --- Pub/Sub ---
+
+class PubSubTransport:
+    """
+    Google Pub/Sub through the publisher and subscriber clients.
+
+    Args:
+        project_id (str): Pub/Sub project.
+        batch_settings (pubsub_v1.types.BatchSettings): Optional publisher batching.
+    """
+
+    def __init__(self, project_id=PROJECT_ID, batch_settings=None):
+        from google.cloud import pubsub_v1
+        from google.api_core import exceptions
+
+        self.exceptions = exceptions
+        self.project_id = project_id
+        if os.getenv('PUBSUB_EMULATOR_HOST'):
+            logger.info(f"Using Pub/Sub emulator at {os.getenv('PUBSUB_EMULATOR_HOST')}")
+        else:
+            logger.info("Using production Pub/Sub.")
+        self.publisher = pubsub_v1.PublisherClient(batch_settings=batch_settings) if batch_settings else pubsub_v1.PublisherClient()
+        self.subscriber = pubsub_v1.SubscriberClient()
+
+    def topic_path(self, topic_id):
+        return self.publisher.topic_path(self.project_id, topic_id)
+
+    def subscription_path(self, subscription_id):
+        return self.subscriber.subscription_path(self.project_id, subscription_id)
+
+    def ensure_topic(self, topic_id):
+        """Creates the topic if it does not exist. Returns False if it could not be verified or created."""
+        topic_path = self.topic_path(topic_id)
+        logger.info(f"Checking for topic existence: {topic_path}")
+        try:
+            self.publisher.get_topic(request={"topic": topic_path})
+            logger.info(f"Topic {topic_path} already exists.")
+            return True
+        except self.exceptions.NotFound:
+            logger.info(f"Topic {topic_path} not found. Creating...")
+            try:
+                self.publisher.create_topic(request={"name": topic_path})
+                logger.info(f"Topic {topic_path} created.")
+                return True
+            except self.exceptions.AlreadyExists:
+                return True
+            except Exception as e:
+                logger.error(f"Failed to create topic {topic_path}: {e}")
+                return False
+        except Exception as e:
+            logger.error(f"Error checking for topic {topic_path}: {e}")
+            return False
+
+    def ensure_subscription(self, topic_id, subscription_id, subscription_filter=None):
+        """
+        Creates the subscription if it does not exist.
+
+        Args:
+            subscription_filter (str): Pub/Sub filter on the message attributes, applied on creation.
+        """
+        topic_path = self.topic_path(topic_id)
+        subscription_path = self.subscription_path(subscription_id)
+        logger.info(f"Checking for subscription existence: {subscription_path}")
+        try:
+            self.subscriber.get_subscription(request={"subscription": subscription_path})
+            logger.info(f"Subscription {subscription_path} already exists.")
+            return True
+        except self.exceptions.NotFound:
+            logger.info(f"Subscription {subscription_path} not found. Creating...")
+            request = {"name": subscription_path, "topic": topic_path}
+            if subscription_filter:
+                request["filter"] = subscription_filter
+            try:
+                self.subscriber.create_subscription(request=request)
+                logger.info(f"Subscription {subscription_path} created.")
+                return True
+            except (self.exceptions.Conflict, self.exceptions.AlreadyExists):
+                logger.warning(f"Subscription {subscription_path} already exists (Conflict during creation).")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to create subscription {subscription_path}: {e}")
+                return False
+        except Exception as e:
+            logger.error(f"Error checking for subscription {subscription_path}: {e}")
+            return False
+
+    def subscription_topic(self, subscription_path):
+        """Topic path of a subscription, or None if the subscription does not exist."""
+        try:
+            return self.subscriber.get_subscription(request={"subscription": subscription_path}).topic
+        except self.exceptions.NotFound:
+            return None
+
+    def publish(self, topic_path, data, **attributes):
+        return self.publisher.publish(topic_path, data, **attributes)
+
+    def subscribe(self, subscription_path, callback, flow_control=None, scheduler=None):
+        kwargs = {"callback": callback}
+        if flow_control is not None:
+            kwargs["flow_control"] = flow_control
+        if scheduler is not None:
+            kwargs["scheduler"] = scheduler
+        return self.subscriber.subscribe(subscription_path, **kwargs)
+
+    def pull(self, subscription_path, max_messages, timeout=10):
+        """Synchronous pull. Returns received messages with ack_id and message, [] when none is available."""
+        try:
+            response = self.subscriber.pull(
+                request={"subscription": subscription_path, "max_messages": max_messages},
+                timeout=timeout,
+            )
+        except self.exceptions.DeadlineExceeded:
+            return []
+        return list(response.received_messages)
+
+    def acknowledge(self, subscription_path, ack_ids):
+        if ack_ids:
+            self.subscriber.acknowledge(request={"subscription": subscription_path, "ack_ids": list(ack_ids)})
+
+    def release(self, subscription_path, ack_ids):
+        """Makes pulled messages immediately available again."""
+        if ack_ids:
+            self.subscriber.modify_ack_deadline(request={
+                "subscription": subscription_path,
+                "ack_ids": list(ack_ids),
+                "ack_deadline_seconds": 0,
+            })
+
+
+# --- Redis Streams ---
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class StreamMessage:
+    """
+    An entry delivered from a consumer group, with the Pub/Sub message interface.
+
+    The data is stored in the "data" field of the entry and each attribute in an "attr:<name>"
+    field. The message ID is the entry ID, whose first part is the publish time in milliseconds.
+    """
+
+    def __init__(self, entry_id, fields, pull=None):
+        self.message_id = _decode(entry_id)
+        self.data = fields.get(b"data", b"")
+        self.attributes = {
+            _decode(key)[len("attr:"):]: _decode(value) for key, value in fields.items() if key.startswith(b"attr:")
+        }
+        self.publish_time = datetime.fromtimestamp(int(self.message_id.split("-")[0]) / 1000, tz=timezone.utc)
+        self.size = len(self.data)
+        self.ack_id = self.message_id
+        self.message = self
+        self._pull = pull
+
+    def ack(self):
+        self._pull.ack(self)
+
+    def nack(self):
+        self._pull.release(self, 0)
+
+    def modify_ack_deadline(self, seconds):
+        self._pull.release(self, seconds)
+
+    def drop(self):
+        self._pull.forget(self)
+
+
+class _XAddBatcher:
+    """Sends publishes in pipelined XADD batches from a background thread."""
+
+    def __init__(self, client, max_messages=STREAM_BATCH_MAX_MESSAGES, max_latency=STREAM_BATCH_MAX_LATENCY):
+        self.client = client
+        self.max_messages = max_messages
+        self.max_latency = max_latency
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="stream-publisher", daemon=True)
+        self._thread.start()
+        # Daemon thread: send what is still buffered when the process exits
+        atexit.register(self.flush)
+
+    def add(self, stream, fields):
+        future = Future()
+        with self._condition:
+            self._pending.append((stream, fields, future))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_messages:
+                self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.monotonic() + self.max_latency
+                while len(self._pending) < self.max_messages and time.monotonic() < deadline:
+                    self._condition.wait(max(0.0, deadline - time.monotonic()))
+            self.flush()
+
+    def flush(self):
+        with self._condition:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for stream, fields, _ in batch:
+                pipeline.xadd(stream, fields, maxlen=STREAM_MAXLEN, approximate=True)
+            entry_ids = pipeline.execute(raise_on_error=False)
+        except Exception as e:
+            entry_ids = [e] * len(batch)
+        for (stream, _, future), entry_id in zip(batch, entry_ids):
+            if isinstance(entry_id, Exception):
+                future.set_exception(entry_id)
+            else:
+                future.set_result(_decode(entry_id))
+
+
+class StreamingPull:
+    """
+    Reads a consumer group in a background thread and runs the callback through the scheduler.
+
+    Flow control limits the entries delivered but not yet acked, nacked or dropped. Delivered
+    entries are kept leased (their idle time reset) while being processed, up to the flow
+    control's max_lease_duration; entries of other consumers idle for longer than
+    STREAM_ACK_DEADLINE are reclaimed and redelivered. Acks and deadline changes are batched.
+    """
+
+    def __init__(self, transport, stream, group, callback, flow_control=None, scheduler=None):
+        self.transport = transport
+        self.client = transport.client
+        self.stream = stream
+        self.group = group
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-{id(self)}"
+        self.callback = callback
+        self.max_messages = getattr(flow_control, "max_messages", None) or 100
+        self.max_lease_duration = getattr(flow_control, "max_lease_duration", None) or 3600
+        if scheduler is None:
+            from google.cloud.pubsub_v1.subscriber.scheduler import ThreadScheduler
+            scheduler = ThreadScheduler()
+        self.scheduler = scheduler
+        # entry ID -> monotonic time until which it is kept leased
+        self._leases = {}
+        # Same for entries released with a delay longer than the ack deadline; dropping them keeps these
+        self._delayed = {}
+        self._outstanding = set()
+        self._acks = []
+        self._idle_resets = []
+        self._lock = threading.Condition()
+        self._stopped = threading.Event()
+        self._done = threading.Event()
+        self._exception = None
+        self._callbacks = []
+        self._threads = [
+            threading.Thread(target=self._read_loop, name=f"stream-pull-{group}", daemon=True),
+            threading.Thread(target=self._housekeeping_loop, name=f"stream-lease-{group}", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    # --- Message operations ---
+
+    def ack(self, message):
+        with self._lock:
+            self._leases.pop(message.message_id, None)
+            self._delayed.pop(message.message_id, None)
+            self._release_slot(message.message_id)
+            if not self._stopped.is_set():
+                self._acks.append(message.message_id)
+                return
+        # Stopped: no housekeeping left to batch it
+        self.client.xack(self.stream, self.group, message.message_id)
+
+    def release(self, message, seconds):
+        """Redelivers the entry after `seconds` unless it is acked first."""
+        with self._lock:
+            self._release_slot(message.message_id)
+            self._leases.pop(message.message_id, None)
+            if seconds > STREAM_ACK_DEADLINE:
+                # The idle time cannot be set in the future: keep the lease until the rest of the delay is an ack deadline
+                self._delayed[message.message_id] = time.monotonic() + seconds - STREAM_ACK_DEADLINE
+                return
+            self._delayed.pop(message.message_id, None)
+            self._idle_resets.append((message.message_id, (STREAM_ACK_DEADLINE - seconds) * 1000))
+        if self._stopped.is_set():
+            self._flush()
+
+    def forget(self, message):
+        """
+        Stops leasing the entry; it is redelivered an ack deadline after its last extension. A
+        delay set by release() beforehand is kept.
+        """
+        with self._lock:
+            self._leases.pop(message.message_id, None)
+            self._release_slot(message.message_id)
+
+    def _release_slot(self, entry_id):
+        if entry_id in self._outstanding:
+            self._outstanding.discard(entry_id)
+            self._lock.notify()
+
+    # --- Background loops ---
+
+    def _deliver(self, entries):
+        now = time.monotonic()
+        messages = []
+        orphans = []
+        with self._lock:
+            for entry_id, fields in entries:
+                if fields is None:
+                    # Trimmed from the stream before it was acked
+                    orphans.append(entry_id)
+                    continue
+                message = StreamMessage(entry_id, fields, self)
+                self._outstanding.add(message.message_id)
+                self._leases[message.message_id] = now + self.max_lease_duration
+                messages.append(message)
+        if orphans:
+            self.client.xack(self.stream, self.group, *orphans)
+        for message in messages:
+            self.scheduler.schedule(self.callback, message)
+
+    def _read_loop(self):
+        next_reclaim = 0.0
+        reclaim_cursor = "0-0"
+        try:
+            while not self._stopped.is_set():
+                with self._lock:
+                    while len(self._outstanding) >= self.max_messages and not self._stopped.is_set():
+                        self._lock.wait(1.0)
+                    free = self.max_messages - len(self._outstanding)
+                if self._stopped.is_set():
+                    break
+
+                if time.monotonic() >= next_reclaim:
+                    response = self.client.xautoclaim(
+                        self.stream, self.group, self.consumer, STREAM_ACK_DEADLINE * 1000,
+                        start_id=reclaim_cursor, count=free,
+                    )
+                    reclaim_cursor, entries = _decode(response[0]), response[1]
+                    if entries:
+                        logger.info(f"Reclaimed {len(entries)} pending entries of {self.stream} for {self.group}")
+                        self._deliver(entries)
+                    # Scan the rest of the pending list right away, otherwise wait for the next interval
+                    if reclaim_cursor == "0-0":
+                        next_reclaim = time.monotonic() + STREAM_RECLAIM_INTERVAL
+                    continue
+
+                response = self.client.xreadgroup(
+                    self.group, self.consumer, {self.stream: ">"}, count=free, block=STREAM_READ_BLOCK_MS,
+                )
+                for _, entries in response or []:
+                    self._deliver(entries)
+        except Exception as e:
+            if not self._stopped.is_set():
+                logger.error(f"Streaming pull of {self.group} failed: {e}")
+                self._finish(e)
+
+    def _flush(self):
+        with self._lock:
+            acks, self._acks = self._acks, []
+            idle_resets, self._idle_resets = self._idle_resets, []
+        if not (acks or idle_resets):
+            return
+        pipeline = self.client.pipeline(transaction=False)
+        if acks:
+            pipeline.xack(self.stream, self.group, *acks)
+        for entry_id, idle_ms in idle_resets:
+            pipeline.xclaim(self.stream, self.group, self.consumer, 0, [entry_id], idle=int(idle_ms), justid=True)
+        pipeline.execute(raise_on_error=False)
+
+    def _extend_leases(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [entry_id for entry_id, until in self._leases.items() if until <= now]
+            for entry_id in expired:
+                del self._leases[entry_id]
+                self._release_slot(entry_id)
+            # A delayed entry is redelivered one ack deadline after its last extension
+            for entry_id in [entry_id for entry_id, until in self._delayed.items() if until <= now]:
+                del self._delayed[entry_id]
+            leased = list(self._leases) + list(self._delayed)
+        if expired:
+            logger.warning(f"{len(expired)} entries of {self.stream} outlived their maximum lease and will be redelivered")
+        if leased:
+            # Claiming an entry for its own consumer resets its idle time
+            self.client.xclaim(self.stream, self.group, self.consumer, 0, leased, justid=True)
+
+    def _housekeeping_loop(self):
+        next_extension = time.monotonic() + STREAM_ACK_DEADLINE / 3
+        while not self._done.is_set():
+            try:
+                self._flush()
+                if time.monotonic() >= next_extension:
+                    self._extend_leases()
+                    next_extension = time.monotonic() + STREAM_ACK_DEADLINE / 3
+            except Exception as e:
+                logger.error(f"Stream housekeeping of {self.group} failed: {e}")
+            self._stopped.wait(STREAM_HOUSEKEEPING_INTERVAL)
+            if self._stopped.is_set():
+                try:
+                    self._flush()
+                except Exception as e:
+                    logger.error(f"Could not send the last acks of {self.group}: {e}")
+                return
+
+    # --- Future interface ---
+
+    def _finish(self, exception=None):
+        if self._done.is_set():
+            return
+        self._stopped.set()
+        with self._lock:
+            self._lock.notify_all()
+        dropped = self.scheduler.shutdown(await_msg_callbacks=False) or []
+        for message in dropped:
+            message.nack()
+        self._exception = exception
+        self._done.set()
+        for callback in self._callbacks:
+            callback(self)
+
+    def cancel(self):
+        """Stops reading; messages not yet handed to a worker are released for redelivery."""
+        self._finish()
+        return True
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Streaming pull of {self.group} still running")
+        if self._exception is not None:
+            raise self._exception
+        return None
+
+    def add_done_callback(self, callback):
+        self._callbacks.append(callback)
+
+
+class RedisStreamsTransport:
+    """
+    Redis Streams with consumer groups.
+
+    Args:
+        redis_url (str): Redis to use.
+    """
+
+    def __init__(self, redis_url=TRANSPORT_REDIS_URL, project_id=PROJECT_ID):
+        if not redis_url:
+            raise ValueError("MESSAGE_TRANSPORT=redis needs TRANSPORT_REDIS_URL or REDIS_URL")
+        import redis
+
+        self.redis = redis
+        self.client = redis.Redis.from_url(redis_url)
+        self.project_id = project_id
+        self._batcher = _XAddBatcher(self.client)
+        logger.info(f"Using Redis Streams transport at {redis_url}")
+
+    def topic_path(self, topic_id):
+        return f"{STREAM_KEY_PREFIX}{topic_id}"
+
+    def subscription_path(self, subscription_id):
+        return subscription_id
+
+    def ensure_topic(self, topic_id):
+        # Streams are created by the first XADD or consumer group
+        return True
+
+    def ensure_subscription(self, topic_id, subscription_id, subscription_filter=None):
+        """
+        Creates the consumer group if it does not exist. A new group starts at the oldest entry
+        kept in the stream, so requests published before the agent first started are not lost.
+
+        Pub/Sub filters are not applied; the agents ignore message types that are not theirs.
+        """
+        stream = self.topic_path(topic_id)
+        try:
+            self.client.xgroup_create(stream, subscription_id, id="0", mkstream=True)
+            logger.info(f"Consumer group {subscription_id} created on {stream}.")
+        except self.redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                logger.error(f"Failed to create consumer group {subscription_id} on {stream}: {e}")
+                return False
+            logger.info(f"Consumer group {subscription_id} already exists on {stream}.")
+        except Exception as e:
+            logger.error(f"Error creating consumer group {subscription_id} on {stream}: {e}")
+            return False
+        self.client.hset(STREAM_SUBSCRIPTIONS_KEY, subscription_id, stream)
+        return True
+
+    def subscription_topic(self, subscription_path):
+        return _decode(self.client.hget(STREAM_SUBSCRIPTIONS_KEY, subscription_path))
+
+    def publish(self, topic_path, data, **attributes):
+        fields = {b"data": data}
+        fields.update({f"attr:{key}".encode('utf-8'): str(value).encode('utf-8') for key, value in attributes.items()})
+        return self._batcher.add(topic_path, fields)
+
+    def subscribe(self, subscription_path, callback, flow_control=None, scheduler=None):
+        stream = self.subscription_topic(subscription_path)
+        if stream is None:
+            raise ValueError(f"Unknown subscription {subscription_path}, call ensure_subscription first")
+        return StreamingPull(self, stream, subscription_path, callback, flow_control=flow_control, scheduler=scheduler)
+
+    def pull(self, subscription_path, max_messages, timeout=10):
+        """Synchronous pull of released or expired entries first, then new ones."""
+        stream = self.subscription_topic(subscription_path)
+        if stream is None:
+            return []
+        consumer = f"{socket.gethostname()}-{os.getpid()}-admin"
+        response = self.client.xautoclaim(
+            stream, subscription_path, consumer, STREAM_ACK_DEADLINE * 1000, count=max_messages,
+        )
+        entries = [(entry_id, fields) for entry_id, fields in response[1] if fields is not None]
+        if len(entries) < max_messages:
+            for _, new_entries in self.client.xreadgroup(
+                subscription_path, consumer, {stream: ">"}, count=max_messages - len(entries), block=int(timeout * 1000),
+            ) or []:
+                entries.extend(new_entries)
+        return [StreamMessage(entry_id, fields) for entry_id, fields in entries]
+
+    def acknowledge(self, subscription_path, ack_ids):
+        if ack_ids:
+            self.client.xack(self.subscription_topic(subscription_path), subscription_path, *ack_ids)
+
+    def release(self, subscription_path, ack_ids):
+        if ack_ids:
+            consumer = f"{socket.gethostname()}-{os.getpid()}-admin"
+            self.client.xclaim(
+                self.subscription_topic(subscription_path), subscription_path, consumer, 0, list(ack_ids),
+                idle=STREAM_ACK_DEADLINE * 1000, justid=True,
+            )
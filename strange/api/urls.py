@@ -1,6 +1,10 @@
 from django.urls import path
-from .views import review
+from .views import review, results
 
 urlpatterns = [
     path('orchestrate/', review.orchestrate_request, name='orchestrate'),
+    path('orchestrate/batch/', review.orchestrate_batch, name='orchestrate_batch'),
+    path('orchestrate/stats/', review.routing_stats, name='routing_stats'),
+    path('results/<str:correlation_id>/', results.get_result, name='get_result'),
+    path('results/<str:correlation_id>/stream/', results.stream_result, name='stream_result'),
 ]
\ No newline at end of file
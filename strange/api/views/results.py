@@ -0,0 +1,93 @@
+from rest_framework import status
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+from django.http import StreamingHttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+import json
+import os
+import time
+import logging
+
+from ..result_store import result_status, wait_for_status
+
+logger = logging.getLogger(__name__)
+
+# Longest a long-poll request may wait for the result
+RESULT_LONG_POLL_MAX = float(os.getenv('RESULT_LONG_POLL_MAX', '30'))
+# Longest an SSE stream stays open; clients reconnect with the same correlation ID after it
+RESULT_STREAM_TIMEOUT = float(os.getenv('RESULT_STREAM_TIMEOUT', '300'))
+# Comment lines sent on an idle stream so proxies do not close it
+RESULT_STREAM_HEARTBEAT = 15.0
+# Statuses after which the result does not change any more
+FINAL_STATUSES = ("completed", "partial", "failed")
+
+
+@api_view(["GET"])
+def get_result(request, correlation_id):
+    """
+    Returns the state of an orchestrated request and its result once available.
+
+    With ?wait=N the request blocks for up to N seconds (at most RESULT_LONG_POLL_MAX) until
+    the result arrives, instead of the client polling repeatedly. Composite requests are
+    final once every part arrived ("completed") or their deadline passed ("partial").
+    """
+    try:
+        wait = min(max(float(request.query_params.get('wait', 0)), 0.0), RESULT_LONG_POLL_MAX)
+    except ValueError:
+        return Response({
+            "status": "error",
+            "message": "'wait' must be a number of seconds."
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    body = result_status(correlation_id)
+    if body is None:
+        return Response({
+            "status": "error",
+            "message": f"Unknown correlation ID {correlation_id}."
+        }, status=status.HTTP_404_NOT_FOUND)
+    if body["status"] not in FINAL_STATUSES and wait > 0:
+        body = wait_for_status(correlation_id, wait) or body
+    return Response(body, status=status.HTTP_200_OK)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@require_GET
+def stream_result(request, correlation_id):
+    """
+    Server-Sent Events stream of an orchestrated request.
+
+    Sends a "status" event at once, then a "result" event when the result is stored, and
+    closes. Idle periods are filled with heartbeat comments. If RESULT_STREAM_TIMEOUT passes
+    first, a "timeout" event is sent and the client may reconnect.
+    """
+    body = result_status(correlation_id)
+    if body is None:
+        return JsonResponse({
+            "status": "error",
+            "message": f"Unknown correlation ID {correlation_id}."
+        }, status=404)
+
+    def events():
+        yield sse_event("status", {"correlation_id": correlation_id, "status": body["status"]})
+        if body["status"] in FINAL_STATUSES:
+            yield sse_event("result", body)
+            return
+        deadline = time.monotonic() + RESULT_STREAM_TIMEOUT
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield sse_event("timeout", {"correlation_id": correlation_id})
+                return
+            current = wait_for_status(correlation_id, min(RESULT_STREAM_HEARTBEAT, remaining))
+            if current is not None and current["status"] in FINAL_STATUSES:
+                yield sse_event("result", current)
+                return
+            yield ": heartbeat\n\n"
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response